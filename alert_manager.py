@@ -1,10 +1,7 @@
-import urllib
-import urllib.error
-import urllib.request
-import os
-from config import PAGER_PORT, PAGER_ADDRESS
-import socket
+import http.client
 import time
+from config import PAGER_PORT, PAGER_ADDRESS, PAGER_OUTBOX_PATH, PAGER_NUM_WORKERS, PAGER_TIMEOUT_SECONDS
+from pager import PagerClient, PagerOutbox, PagerPool, PagerRejectedError, backoff_delays
 
 NUM_PAGING_RETRIES = 10 
 
@@ -12,28 +9,64 @@ class AlertManager:
     """
     AlertManager handles the communication with the hospital's alerting system.
     """
+    def __init__(self,
+                 outbox_path: str = PAGER_OUTBOX_PATH,
+                 num_workers: int = PAGER_NUM_WORKERS,
+                 address: tuple[str, int] = (PAGER_ADDRESS, PAGER_PORT)):
+        """
+        Initializes the alert manager.
+
+        Parameters:
+        outbox_path (str): Directory in which pending pages are stored until delivered.
+        num_workers (int): Number of background workers delivering pages.
+        address (tuple[str, int]): Hostname and port number of the pager.
+        """
+        self.outbox_path = outbox_path
+        self.num_workers = num_workers
+        self.address = address
+        self.pool = None
+        self._client = PagerClient(*address, timeout=PAGER_TIMEOUT_SECONDS)
+
+    def start(self):
+        """
+        Starts the background paging workers, which also redeliver any page left
+        in the outbox by a previous run.
+        """
+        if self.pool is None:
+            self.pool = PagerPool(PagerOutbox(self.outbox_path), num_workers=self.num_workers,
+                                  host=self.address[0], port=self.address[1],
+                                  timeout=PAGER_TIMEOUT_SECONDS, failure_threshold=NUM_PAGING_RETRIES)
+            self.pool.start()
+
+    def enqueue_alert(self, patient_mrn: str, timestamp: str, on_done=None):
+        """
+        Durably queues an alert for the specified patient MRN and returns immediately.
+
+        Parameters:
+        patient_mrn (str): The medical record number of the patient.
+        timestamp (str): The timestamp of the alert in the format YYYYMMDDHHMMSS
+        on_done (callable): Called with True once the alert is delivered, or with
+                            False once it has failed NUM_PAGING_RETRIES times.
+        """
+        self.start()
+        self.pool.submit(patient_mrn, timestamp, on_done)
 
-    @staticmethod
-    def send_alert(patient_mrn: str, timestamp: str):
+    def send_alert(self, patient_mrn: str, timestamp: str):
         """
-        Send an alert for the specified patient MRN.
+        Send an alert for the specified patient MRN and wait for it to be delivered.
 
         Parameters:
         patient_mrn (str): The medical record number of the patient.
         timestamp (str): The timestamp of the alert in the format YYYYMMDDHHMMSS
         """
-        socket.setdefaulttimeout(1)
-        paged = False
-        counter = 0
-        while not paged and counter < NUM_PAGING_RETRIES:
-            counter += 1
+        delays = backoff_delays(0.1, 1.0)
+        for counter in range(1, NUM_PAGING_RETRIES + 1):
             try:
-                alert_data = bytes(patient_mrn +','+timestamp, 'utf-8')
-                r = urllib.request.urlopen(f"http://{PAGER_ADDRESS}:{PAGER_PORT}/page", data=alert_data)
-                if 200 <= r.status  <= 300:
-                    paged = True
-                else:
-                    time.sleep(1)
-            except urllib.error.URLError as e:
+                self._client.page(patient_mrn, timestamp)
+                return
+            except PagerRejectedError:
+                raise RuntimeError("Failed to page")
+            except (OSError, http.client.HTTPException):
                 if counter == NUM_PAGING_RETRIES:
                     raise RuntimeError("Failed to page")
+                time.sleep(next(delays))
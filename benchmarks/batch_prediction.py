@@ -0,0 +1,47 @@
+"""
+Compares single-row and batched AKI predictions per second across batch sizes.
+
+Usage (from the repository root):
+    python -m benchmarks.batch_prediction --batch-sizes 1 8 32 128 512
+"""
+import argparse
+import random
+import time
+
+from hospital_message import PatientAdmissionMessage
+from storage_manager import StorageManager
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched prediction benchmark")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128, 512])
+    parser.add_argument("--predictions", type=int, default=2000, help="Number of predictions per measurement")
+    flags = parser.parse_args()
+
+    storage_manager = StorageManager()
+    rng = random.Random(0)
+    mrns = []
+    for i in range(max(flags.batch_sizes)):
+        mrn = str(i)
+        storage_manager.add_admitted_patient_to_current_patients(
+            PatientAdmissionMessage(mrn, "PATIENT", f"{rng.randint(1930, 2005)}-01-01", rng.choice("MF")))
+        for _ in range(rng.randint(1, 8)):
+            storage_manager.current_patients[mrn].add_result(rng.uniform(50, 200))
+        mrns.append(mrn)
+
+    start = time.perf_counter()
+    for i in range(flags.predictions):
+        storage_manager.predict_aki(mrns[i % len(mrns)])
+    single_rate = flags.predictions / (time.perf_counter() - start)
+    print(f"predict_aki: {single_rate:.0f} predictions/sec")
+
+    for batch_size in flags.batch_sizes:
+        batch = mrns[:batch_size]
+        batches = max(flags.predictions // batch_size, 1)
+        start = time.perf_counter()
+        for _ in range(batches):
+            storage_manager.predict_aki_batch(batch)
+        rate = batches * batch_size / (time.perf_counter() - start)
+        print(f"predict_aki_batch({batch_size}): {rate:.0f} predictions/sec ({rate / single_rate:.1f}x)")
+
+if __name__ == "__main__":
+    main()
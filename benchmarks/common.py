@@ -0,0 +1,107 @@
+"""
+Helpers shared by the benchmark scripts.
+
+The benchmarks are run from the repository root as modules, e.g.
+`python -m benchmarks.listener_throughput`, so that the top level modules of
+the project can be imported directly.
+"""
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from simulator import patient_messages, read_history_mrns
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_CSV = os.path.join(REPO_ROOT, "history.csv")
+
+MLLP_START_OF_BLOCK = 0x0b
+MLLP_END_OF_BLOCK = 0x1c
+MLLP_CARRIAGE_RETURN = 0x0d
+
+def to_mllp(segments: list) -> bytes:
+    m = bytes(chr(MLLP_START_OF_BLOCK), "ascii")
+    m += bytes("\r".join(segments) + "\r", "ascii")
+    m += bytes(chr(MLLP_END_OF_BLOCK) + chr(MLLP_CARRIAGE_RETURN), "ascii")
+    return m
+
+def synthesise_hl7_messages(num_messages: int, history_csv_path: str = HISTORY_CSV, seed: int = 0) -> list:
+    """
+    Builds a realistic stream of HL7 messages for patients taken from history.csv.
+
+    Each patient's stay comes from the load generator of simulator.py: an
+    admission (ADT^A01), a few creatinine results (ORU^R01) and a discharge
+    (ADT^A03), one patient after the other and with fixed timestamps, so every
+    message is valid against the state built by the previous ones and the
+    stream is the same from run to run.
+
+    Args:
+        num_messages (int): The number of messages to generate.
+        history_csv_path (str): The history file the MRNs are drawn from.
+        seed (int): Seed for the random number generator.
+
+    Returns:
+        list: The messages, each one a list of HL7 segments.
+    """
+    rng = random.Random(seed)
+    mrns = read_history_mrns(history_csv_path)
+    messages = []
+    patient = 0
+    while len(messages) < num_messages:
+        mrn = mrns[patient % len(mrns)]
+        patient += 1
+        day = 1 + patient % 28
+        stay = list(patient_messages(mrn, rng))
+        hours = [8] + [9 + hour for hour in range(len(stay) - 2)] + [20]
+        for segments, hour in zip(stay, hours):
+            now = f"202401{day:02d}{hour:02d}0000"
+            messages.append([segment.replace("{now}", now) for segment in segments])
+    return messages[:num_messages]
+
+def write_mllp_file(messages: list, path: str) -> None:
+    with open(path, "wb") as w:
+        for m in messages:
+            w.write(to_mllp(m))
+
+def wait_until_healthy(p: subprocess.Popen, http_address: str, max_attempts: int = 20) -> bool:
+    for _ in range(max_attempts):
+        if p.poll() is not None:
+            return False
+        try:
+            r = urllib.request.urlopen("http://%s/healthy" % http_address)
+            if r.status == 200:
+                return True
+        except urllib.error.URLError:
+            pass
+        time.sleep(0.5)
+    return False
+
+def start_simulator(messages_path: str, mllp_port: int, pager_port: int, extra_args: list = ()) -> subprocess.Popen:
+    """
+    Starts simulator.py as a subprocess and waits until its pager is healthy.
+    """
+    p = subprocess.Popen([
+        sys.executable,
+        os.path.join(REPO_ROOT, "simulator.py"),
+        f"--mllp={mllp_port}",
+        f"--pager={pager_port}",
+        f"--messages={messages_path}",
+        *extra_args,
+    ], stdout=subprocess.DEVNULL)
+    if not wait_until_healthy(p, f"localhost:{pager_port}"):
+        p.kill()
+        raise RuntimeError("simulator did not become healthy")
+    return p
+
+def stop_simulator(p: subprocess.Popen, pager_port: int) -> None:
+    try:
+        urllib.request.urlopen(f"http://localhost:{pager_port}/shutdown")
+        p.wait(timeout=10)
+    except Exception:
+        pass
+    finally:
+        if p.poll() is None:
+            p.kill()
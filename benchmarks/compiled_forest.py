@@ -0,0 +1,50 @@
+"""
+Compares the latency and throughput of the sklearn random forest with the
+NumPy CompiledForest it was compiled into.
+
+Usage (from the repository root):
+    python -m benchmarks.compiled_forest --batch-sizes 1 32 512
+"""
+import argparse
+import time
+
+import numpy as np
+
+from compiled_forest import CompiledForest
+from config import MODEL_PATH, SKLEARN_MODEL_PATH
+
+def rate(predict, X, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predict(X)
+    elapsed = time.perf_counter() - start
+    return elapsed / repeats, repeats * X.shape[0] / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiled forest benchmark")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 512])
+    parser.add_argument("--predictions", type=int, default=5000, help="Approximate number of predictions per measurement")
+    flags = parser.parse_args()
+
+    import joblib
+    start = time.perf_counter()
+    sklearn_model = joblib.load(SKLEARN_MODEL_PATH)
+    sklearn_load = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled_model = CompiledForest.load(MODEL_PATH)
+    compiled_load = time.perf_counter() - start
+    print(f"load: sklearn {sklearn_load * 1000:.1f} ms, compiled {compiled_load * 1000:.1f} ms")
+
+    rng = np.random.default_rng(0)
+    for batch_size in flags.batch_sizes:
+        X = np.column_stack([rng.integers(18, 100, batch_size), rng.integers(0, 2, batch_size),
+                             rng.uniform(40, 250, (batch_size, 5))])
+        repeats = max(flags.predictions // batch_size, 1)
+        sklearn_latency, sklearn_rate = rate(sklearn_model.predict, X, repeats)
+        compiled_latency, compiled_rate = rate(compiled_model.predict, X, repeats)
+        print(f"batch {batch_size}:")
+        print(f"  sklearn:  {sklearn_latency * 1e6:.0f} us/call, {sklearn_rate:.0f} predictions/sec")
+        print(f"  compiled: {compiled_latency * 1e6:.0f} us/call, {compiled_rate:.0f} predictions/sec ({compiled_rate / sklearn_rate:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+End-to-end benchmark of the detector, from an HL7 message arriving to the pager
+receiving its page.
+
+For every scenario file (benchmarks/scenarios/*.json), simulator.py is started
+in load generation mode and the listener is started as a separate process
+against it, with its state in a temporary directory. The simulator records when
+each message is sent and acknowledged and when each page is received; the
+listener's own latency histograms are scraped from its Prometheus endpoint. The
+results, with p50/p95/p99/max latencies and throughput, are written as JSON.
+
+With --baseline, the results are compared with a stored run, and the script
+exits with status 1 when throughput drops or a latency percentile grows by
+more than --tolerance (and latencies by more than --slack-ms), so a regression
+shows up on the commit which caused it.
+--save-baseline stores the results of this run as the baseline. The baseline of
+the scenarios of benchmarks/scenarios is kept in benchmarks/baseline.json, with
+the commit it was measured on; measure it again on the same machine before
+comparing, since throughput and latencies depend on it.
+
+A scenario fails when the listener has not acknowledged every message within
+--timeout seconds (or the "timeout" of the scenario file), so that a stalled
+listener cannot hang the benchmark; the other scenarios still run, and the
+script exits with status 1.
+
+A scenario file holds the options of the simulator load generator (count, rate,
+arrivals, connections, window) and the listener engine ("threaded" or "asyncio").
+
+Usage (from the repository root):
+    python -m benchmarks.end_to_end --output results.json
+    python -m benchmarks.end_to_end benchmarks/scenarios/steady.json --baseline benchmarks/baseline.json
+"""
+import argparse
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.common import HISTORY_CSV, REPO_ROOT, wait_until_healthy
+
+SCENARIOS = os.path.join(REPO_ROOT, "benchmarks", "scenarios", "*.json")
+# Metrics compared with the baseline, and whether a higher value is better
+COMPARED_METRICS = {
+    ("throughput",): True,
+    ("ack_latency_seconds", "p50"): False,
+    ("ack_latency_seconds", "p95"): False,
+    ("ack_latency_seconds", "p99"): False,
+    ("paging_latency_seconds", "p50"): False,
+    ("paging_latency_seconds", "p95"): False,
+    ("paging_latency_seconds", "p99"): False,
+}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+# Timeout of every HTTP request to the simulator and the listener, in seconds
+HTTP_TIMEOUT = 10
+
+def read_stats(pager_port: int) -> dict:
+    return json.loads(urllib.request.urlopen(f"http://localhost:{pager_port}/stats", timeout=HTTP_TIMEOUT).read())
+
+def scrape_histogram(prometheus_port: int, name: str) -> dict:
+    """
+    Returns the count and mean of a histogram exported by the listener.
+    """
+    text = urllib.request.urlopen(f"http://localhost:{prometheus_port}/metrics", timeout=HTTP_TIMEOUT).read().decode()
+    values = {}
+    for line in text.splitlines():
+        for suffix in ("_count", "_sum"):
+            if line.startswith(name + suffix + " "):
+                values[suffix] = float(line.split()[1])
+    count = values.get("_count", 0)
+    return {"count": count, "mean": values.get("_sum", 0) / count if count else None}
+
+def run_scenario(name: str, scenario: dict, ports: dict, settle_seconds: float, timeout: float) -> dict:
+    """
+    Runs one scenario and returns its results.
+
+    Raises:
+        RuntimeError: If the simulator or the listener fails, or if every message
+                      has not been acknowledged within timeout seconds.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        simulator = subprocess.Popen([
+            sys.executable, os.path.join(REPO_ROOT, "simulator.py"),
+            f"--mllp={ports['mllp']}", f"--pager={ports['pager']}", "--generate",
+            f"--history={HISTORY_CSV}",
+            f"--count={scenario['count']}", f"--rate={scenario.get('rate', 0)}",
+            f"--arrivals={scenario.get('arrivals', 'uniform')}",
+            f"--connections={scenario.get('connections', 1)}", f"--window={scenario.get('window', 1)}",
+        ], stdout=subprocess.DEVNULL)
+        if not wait_until_healthy(simulator, f"localhost:{ports['pager']}"):
+            simulator.kill()
+            raise RuntimeError("simulator did not become healthy")
+
+        feeds = [f"localhost:{ports['mllp']}"] * scenario.get("connections", 1)
+        environment = dict(os.environ,
+                           PAGER_ADDRESS=f"localhost:{ports['pager']}",
+                           PROMETHEUS_PORT=str(ports["prometheus"]),
+                           MESSAGE_LOG_CSV_PATH=os.path.join(directory, "message_log.csv"),
+                           MESSAGE_LOG_BINARY_PATH=os.path.join(directory, "message_log.bin"),
+                           PAGER_OUTBOX_PATH=os.path.join(directory, "pager_outbox"),
+                           HISTORY_CACHE_PATH=os.path.join(directory, "history.cache"),
+                           **scenario.get("environment", {}))
+        listener = subprocess.Popen([
+            sys.executable, os.path.join(REPO_ROOT, "message_listener.py"),
+            f"--history-dir={HISTORY_CSV}", f"--engine={scenario.get('engine', 'threaded')}",
+            "--feeds", *feeds,
+        ], cwd=REPO_ROOT, env=environment, stdout=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                if listener.poll() is not None:
+                    raise RuntimeError(f"listener exited with status {listener.returncode}")
+                stats = read_stats(ports["pager"])
+                if stats["messages_acked"] >= scenario["count"]:
+                    break
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"only {stats['messages_acked']} of {scenario['count']} messages "
+                                       f"acknowledged after {timeout:g} seconds")
+                time.sleep(0.2)
+            # Leave the last pages time to arrive
+            time.sleep(settle_seconds)
+            stats = read_stats(ports["pager"])
+            listener_metrics = {
+                "message_latency_seconds": scrape_histogram(ports["prometheus"], "message_latency"),
+                "paging_latency_seconds": scrape_histogram(ports["prometheus"], "paging_latency"),
+            }
+        finally:
+            listener.send_signal(signal.SIGTERM)
+            try:
+                listener.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                listener.kill()
+            try:
+                urllib.request.urlopen(f"http://localhost:{ports['pager']}/shutdown", timeout=HTTP_TIMEOUT)
+                simulator.wait(timeout=10)
+            except Exception:
+                simulator.kill()
+
+    return {"scenario": name, "description": scenario.get("description", ""),
+            **stats, "listener": listener_metrics}
+
+def metric(results: dict, path: tuple):
+    for key in path:
+        results = results.get(key) if isinstance(results, dict) else None
+    return results
+
+def compare(results: list, baseline: list, tolerance: float, slack_seconds: float) -> bool:
+    """
+    Prints the change of every compared metric and returns whether none has
+    regressed by more than tolerance. Latencies must also have grown by more than
+    slack_seconds, so that the jitter of millisecond latencies is not reported.
+    """
+    baseline = {entry["scenario"]: entry for entry in baseline}
+    passed = True
+    for entry in results:
+        reference = baseline.get(entry["scenario"])
+        if reference is None:
+            print(f"{entry['scenario']}: no baseline")
+            continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            current, previous = metric(entry, path), metric(reference, path)
+            if not current or not previous:
+                continue
+            change = current / previous - 1
+            if higher_is_better:
+                regressed = -change > tolerance
+            else:
+                regressed = change > tolerance and current - previous > slack_seconds
+            passed = passed and not regressed
+            print(f"{entry['scenario']}: {'.'.join(path)}: {previous:.4g} -> {current:.4g} "
+                  f"({change:+.1%}){' REGRESSION' if regressed else ''}")
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency and throughput benchmark")
+    parser.add_argument("scenarios", nargs="*", help="Scenario files, by default benchmarks/scenarios/*.json")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to the --baseline file instead")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression of each metric")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="Latency growth always allowed, in milliseconds")
+    parser.add_argument("--settle", type=float, default=1.0, help="Seconds to wait for the last pages")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds after which a scenario fails")
+    parser.add_argument("--mllp", type=int, default=28440)
+    parser.add_argument("--pager", type=int, default=28441)
+    parser.add_argument("--prometheus", type=int, default=28442)
+    flags = parser.parse_args()
+    if flags.save_baseline and not flags.baseline:
+        parser.error("--save-baseline needs --baseline")
+
+    ports = {"mllp": flags.mllp, "pager": flags.pager, "prometheus": flags.prometheus}
+    results = []
+    failed = False
+    for path in flags.scenarios or sorted(glob.glob(SCENARIOS)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as file:
+            scenario = json.load(file)
+        try:
+            entry = run_scenario(name, scenario, ports, flags.settle, scenario.get("timeout", flags.timeout))
+        except (RuntimeError, OSError) as e:
+            print(f"{name}: FAILED: {e}")
+            failed = True
+            continue
+        entry["commit"] = git_commit()
+        results.append(entry)
+        print(f"{name}: {entry['throughput']:.0f} messages/sec, ack p99 "
+              f"{entry['ack_latency_seconds'].get('p99', 0) * 1000:.1f} ms, paging p99 "
+              f"{entry['paging_latency_seconds'].get('p99', 0) * 1000:.1f} ms")
+
+    report = json.dumps(results, indent=2)
+    if flags.output:
+        with open(flags.output, "w") as file:
+            file.write(report)
+    else:
+        print(report)
+
+    if flags.baseline and flags.save_baseline:
+        if failed:
+            print("Not saving the baseline, since a scenario failed")
+        else:
+            with open(flags.baseline, "w") as file:
+                file.write(report + "\n")
+    elif flags.baseline:
+        with open(flags.baseline) as file:
+            if not compare(results, json.load(file), flags.tolerance, flags.slack_ms / 1000):
+                failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
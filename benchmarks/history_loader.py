@@ -0,0 +1,99 @@
+"""
+Compares load time and memory of the original row-by-row history.csv loader
+(a dictionary of float lists) with the columnar HistoryStore, parsed from the
+CSV or memory-mapped from its history cache, on synthetic histories of several
+sizes. Each load runs in a fresh interpreter so that its
+RSS can be measured on its own (Linux with glibc only).
+
+Usage (from the repository root):
+    python -m benchmarks.history_loader --patients 10000 1000000 10000000
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.common import REPO_ROOT
+
+MAX_RESULTS = 24
+
+LOADER = r"""
+import csv, ctypes, json, resource, sys, time
+sys.path.insert(0, {repo_root!r})
+def resident_kib():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+baseline, baseline_resident = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resident_kib()
+start = time.perf_counter()
+if {loader!r} == 'legacy':
+    history = dict()
+    with open({path!r}, 'r') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for row in reader:
+            history[row[0]] = list(map(float, [row[col] for col in range(2, len(row), 2) if row[col] != ""]))
+else:
+    from history_store import HistoryStore
+    baseline, baseline_resident = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resident_kib()
+    start = time.perf_counter()
+    if {loader!r} == 'columnar':
+        history = HistoryStore.from_csv({path!r})
+    else:
+        history = HistoryStore.from_cache({path!r} + '.cache')
+        history['100000']
+elapsed = time.perf_counter() - start
+# Return the heap freed by the loader to the OS, so that RSS reflects the data kept
+ctypes.CDLL('libc.so.6').malloc_trim(0)
+print(json.dumps({{'seconds': elapsed, 'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline,
+                  'rss_kib': resident_kib() - baseline_resident, 'patients': len(history)}}))
+"""
+
+def write_history(path, patients, seed=0):
+    """
+    Writes a synthetic history.csv with 1 to MAX_RESULTS results per patient.
+    """
+    rng = np.random.default_rng(seed)
+    header = ['mrn']
+    for i in range(MAX_RESULTS):
+        header += [f'creatinine_date_{i}', f'creatinine_result_{i}']
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        counts = rng.integers(1, MAX_RESULTS + 1, size=patients)
+        for mrn, count in enumerate(counts):
+            row = [str(100000 + mrn)]
+            values = np.round(rng.uniform(40, 200, size=count), 2)
+            for i, value in enumerate(values):
+                row += [f'2024-01-{1 + i:02d} 08:00:00', f'{value}']
+            row += [''] * (2 * (MAX_RESULTS - count))
+            writer.writerow(row)
+
+def measure(loader, path):
+    code = LOADER.format(repo_root=REPO_ROOT, loader=loader, path=path)
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description="history.csv loader benchmark")
+    parser.add_argument("--patients", type=int, nargs="+", default=[10000, 1000000, 10000000])
+    flags = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for patients in flags.patients:
+            path = os.path.join(directory, 'history.csv')
+            write_history(path, patients)
+            print(f"{patients} patients ({os.path.getsize(path) / 2**20:.0f} MiB):")
+            # Built in a separate process, so that this one's peak RSS stays low
+            subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'history_store.py'), path], check=True, capture_output=True)
+            for loader in ('legacy', 'columnar', 'cached'):
+                result = measure(loader, path)
+                print(f"  {loader}: {result['seconds']:.2f}s, RSS after load +{result['rss_kib'] / 1024:.0f} MiB, "
+                      f"peak +{result['peak_rss_kib'] / 1024:.0f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Replays a large messages.mllp file through simulator.py into the listener and
+reports the achieved throughput in messages per second.
+
+Usage (from the repository root):
+    python -m benchmarks.listener_throughput --messages 5000
+    python -m benchmarks.listener_throughput --messages-file messages.mllp
+    python -m benchmarks.listener_throughput --engine asyncio
+    python -m benchmarks.listener_throughput --engine asyncio --feeds 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks.common import (HISTORY_CSV, start_simulator, stop_simulator,
+                               synthesise_hl7_messages, write_mllp_file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Listener throughput benchmark")
+    parser.add_argument("--messages", type=int, default=5000, help="Number of synthetic messages to replay")
+    parser.add_argument("--messages-file", type=str, default=None, help="Replay an existing MLLP file instead of synthetic messages")
+    parser.add_argument("--mllp", type=int, default=28440, help="Port for the simulator MLLP server")
+    parser.add_argument("--pager", type=int, default=28441, help="Port for the simulator pager")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded", help="Listener engine to benchmark")
+    parser.add_argument("--short-messages", action="store_true", help="Ask the simulator to split every message in two")
+    parser.add_argument("--feeds", type=int, default=1, help="Number of simulators, each one replaying the messages of "
+                        "a share of the patients on its own connection (asyncio engine)")
+    flags = parser.parse_args()
+    if flags.feeds > 1 and (flags.engine != "asyncio" or flags.messages_file):
+        parser.error("--feeds needs --engine asyncio and synthetic messages")
+
+    import message_listener
+    from storage_manager import StorageManager
+    from alert_manager import AlertManager
+
+    with tempfile.TemporaryDirectory() as directory:
+        messages_paths = [flags.messages_file]
+        if flags.messages_file is None:
+            # The messages of a patient all go through the same feed
+            feeds = [[] for _ in range(flags.feeds)]
+            for message in synthesise_hl7_messages(flags.messages):
+                mrn = message[1].split("|")[3]
+                feeds[int(mrn) % flags.feeds].append(message)
+            messages_paths = []
+            for i, messages in enumerate(feeds):
+                messages_paths.append(os.path.join(directory, f"messages{i}.mllp"))
+                write_mllp_file(messages, messages_paths[-1])
+
+        storage_manager = StorageManager(message_log_filepath=os.path.join(directory, "message_log.csv"))
+        storage_manager.initialise_database(HISTORY_CSV, wipe_past_message_log=True)
+        alert_manager = AlertManager(outbox_path=os.path.join(directory, "pager_outbox"),
+                                     address=("localhost", flags.pager))
+        alert_manager.start()
+
+        extra_args = ["--short_messages"] if flags.short_messages else []
+        # Every simulator has its own MLLP port and pager port; pages all go to the first one
+        simulators = [start_simulator(path, flags.mllp + 2 * i, flags.pager + 2 * i, extra_args)
+                      for i, path in enumerate(messages_paths)]
+        try:
+            acknowledged_before = message_listener.p_overall_messages_acknowledged._value.get()
+            start = time.perf_counter()
+            # A single attempt: the listener returns once the simulator closes the connection
+            if flags.engine == "asyncio":
+                endpoints = [("localhost", flags.mllp + 2 * i) for i in range(len(simulators))]
+                asyncio.run(message_listener.listen_for_feeds_async(storage_manager, alert_manager, endpoints, "client",
+                                                                    retries=1, start_delay=0))
+            else:
+                message_listener.listen_for_messages(storage_manager, alert_manager,
+                                                     address=("localhost", flags.mllp),
+                                                     retries=1, start_delay=0)
+            elapsed = time.perf_counter() - start
+            alert_manager.pool.join()
+            acknowledged = message_listener.p_overall_messages_acknowledged._value.get() - acknowledged_before
+        finally:
+            for i, simulator in enumerate(simulators):
+                stop_simulator(simulator, flags.pager + 2 * i)
+
+    print(f"messages acknowledged: {int(acknowledged)}")
+    print(f"elapsed: {elapsed:.3f}s")
+    print(f"throughput: {acknowledged / elapsed:.1f} messages/sec")
+
+if __name__ == "__main__":
+    main()
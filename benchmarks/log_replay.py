@@ -0,0 +1,100 @@
+"""
+Compares reading back the CSV message log through pandas, as replay originally
+did, with the streaming CSV reader and with reading the binary message log
+through a memory map, and times a full StorageManager replay of each format.
+
+Usage (from the repository root):
+    python -m benchmarks.log_replay --messages 1000000 --replay-messages 50000
+"""
+import argparse
+import csv
+import datetime
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.common import HISTORY_CSV, read_history_mrns
+from binary_log import FILE_HEADER, encode_message, message_from_csv_row
+from config import MESSAGE_LOG_CSV_FIELDS
+from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
+from storage_manager import StorageManager
+
+def synthesise_messages(n, mrns):
+    """
+    Yields n messages cycling through admission, two test results and discharge
+    for the given MRNs.
+    """
+    day = datetime.date(2024, 1, 1)
+    for i in range(n):
+        mrn = mrns[(i // 4) % len(mrns)]
+        step = i % 4
+        if step == 0:
+            yield PatientAdmissionMessage(mrn, 'Jane Smith', '1960-05-17', 'F')
+        elif step == 3:
+            yield PatientDischargeMessage(mrn)
+        else:
+            yield TestResultMessage(mrn, str(day), '08:00:00', 60.0 + i % 90)
+
+def csv_row(message):
+    if isinstance(message, PatientAdmissionMessage):
+        return ['2024-01-01 08:00:00', 'PatientAdmission', message.mrn,
+                f"Name: {message.name}. DOB: {message.date_of_birth}. Sex: {message.sex}"]
+    if isinstance(message, TestResultMessage):
+        return ['2024-01-01 08:00:00', 'TestResult', message.mrn,
+                f"Test Date: {message.test_date}. Test Time: {message.test_time}. Creatinine Value: {message.creatinine_value}"]
+    return ['2024-01-01 08:00:00', 'PatientDischarge', message.mrn, '']
+
+def write_logs(directory, n, mrns):
+    csv_path = os.path.join(directory, 'message_log.csv')
+    binary_path = os.path.join(directory, 'message_log.bin')
+    with open(csv_path, 'w', newline='') as csv_file, open(binary_path, 'wb') as binary_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(MESSAGE_LOG_CSV_FIELDS)
+        binary_file.write(FILE_HEADER)
+        for message in synthesise_messages(n, mrns):
+            writer.writerow(csv_row(message))
+            binary_file.write(encode_message(message, 0.0))
+    return csv_path, binary_path
+
+def decode_csv(path):
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return sum(1 for row in df.itertuples(index=False) if message_from_csv_row(list(row)) is not None)
+
+def decode_streaming(path):
+    storage_manager = StorageManager(message_log_filepath=path)
+    return sum(1 for message in storage_manager.read_logged_messages(path) if message is not None)
+
+def replay(path):
+    storage_manager = StorageManager(message_log_filepath=path)
+    storage_manager.initialise_database(HISTORY_CSV)
+
+def main():
+    parser = argparse.ArgumentParser(description="Message log replay benchmark")
+    parser.add_argument("--messages", type=int, default=1000000, help="Messages decoded")
+    parser.add_argument("--replay-messages", type=int, default=50000, help="Messages replayed into a StorageManager")
+    flags = parser.parse_args()
+
+    mrns = read_history_mrns(HISTORY_CSV)
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path, binary_path = write_logs(directory, flags.messages, mrns)
+        print(f"{flags.messages} messages: csv {os.path.getsize(csv_path) / 2**20:.1f} MiB, "
+              f"binary {os.path.getsize(binary_path) / 2**20:.1f} MiB")
+        for name, run, path in (("csv (pandas)", decode_csv, csv_path), ("csv (streaming)", decode_streaming, csv_path),
+                                ("binary (mmap)", decode_streaming, binary_path)):
+            start = time.perf_counter()
+            count = run(path)
+            elapsed = time.perf_counter() - start
+            print(f"  decode {name}: {elapsed:.2f}s, {count / elapsed:.0f} messages/sec")
+
+        csv_path, binary_path = write_logs(directory, flags.replay_messages, mrns)
+        print(f"full replay of {flags.replay_messages} messages:")
+        for name, path in (("csv", csv_path), ("binary", binary_path)):
+            start = time.perf_counter()
+            replay(path)
+            elapsed = time.perf_counter() - start
+            print(f"  {name}: {elapsed:.2f}s, {flags.replay_messages / elapsed:.0f} messages/sec")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compares the original per-message CSV append (open, write one row, close, no
+fsync) with the write-ahead log under each sync policy. Every message is
+committed before the next one, as the listener does when it acknowledges
+messages one by one, and with --group the commit happens once per group.
+
+Usage (from the repository root):
+    python -m benchmarks.message_log --messages 5000 --group 1 10
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+from config import MESSAGE_LOG_CSV_FIELDS
+from write_ahead_log import WriteAheadLog
+
+ROW = {'timestamp': '2024-01-01 08:00:00', 'type': 'TestResult', 'mrn': '822825',
+       'additional_info': 'Test Date: 2024-01-01. Test Time: 08:00:00. Creatinine Value: 101.2'}
+
+def legacy_append(path, messages, group):
+    for _ in range(messages):
+        with open(path, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=MESSAGE_LOG_CSV_FIELDS)
+            writer.writerow(ROW)
+
+def wal_append(path, messages, group, policy):
+    record = (','.join(ROW.values()) + '\r\n').encode()
+    log = WriteAheadLog(path, sync_policy=policy, sync_records=100, sync_interval_ms=2)
+    for i in range(messages):
+        lsn = log.append(record)
+        if (i + 1) % group == 0:
+            log.commit(lsn)
+    log.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Message log benchmark")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--group", type=int, nargs="+", default=[1, 10], help="Messages per commit")
+    flags = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for group in flags.group:
+            print(f"commit every {group} message(s):")
+            runs = [("legacy csv append (no fsync)", lambda p: legacy_append(p, flags.messages, group))]
+            for policy in ("always", "records", "interval"):
+                runs.append((f"wal {policy}", lambda p, policy=policy: wal_append(p, flags.messages, group, policy)))
+            for name, run in runs:
+                path = os.path.join(directory, "message_log.csv")
+                if os.path.exists(path):
+                    os.remove(path)
+                start = time.perf_counter()
+                run(path)
+                elapsed = time.perf_counter() - start
+                print(f"  {name}: {flags.messages / elapsed:.0f} messages/sec")
+
+if __name__ == "__main__":
+    main()
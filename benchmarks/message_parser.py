@@ -0,0 +1,73 @@
+"""
+Compares the parse rate of the original HL7 parser, which decodes the whole
+frame to str, splits every segment and expects the segments at fixed positions,
+with parse_frame, which works on the bytes of the frame. parse_frame is also
+timed on the same messages with extra PV1 and NTE segments, which the original
+parser misreads or rejects.
+
+Usage (from the repository root):
+    python -m benchmarks.message_parser --messages 100000
+"""
+import argparse
+import time
+
+from benchmarks.common import synthesise_hl7_messages, to_mllp
+from hospital_message import PatientAdmissionMessage, PatientDischargeMessage, TestResultMessage
+from message_parser import parse_frame, p_successful_message_parsing
+
+def legacy_from_mllp(buffer):
+    return str(buffer[:-1], "ascii").split("\r")
+
+def legacy_parse_message(message):
+    p_successful_message_parsing.inc()
+    message_type = message[0].split("|")[8]
+    if message_type == 'ADT^A01':
+        patient_info = message[1].split("|")
+        date_of_birth = patient_info[7][0:4]+"-"+patient_info[7][4:6]+"-"+patient_info[7][6:8]
+        return PatientAdmissionMessage(patient_info[3], patient_info[5], date_of_birth, patient_info[8])
+    elif message_type == 'ORU^R01':
+        mrn = message[1].split("|")[3]
+        test_time = message[2].split("|")[7]
+        test_day = test_time[:4]+"-"+test_time[4:6]+"-"+test_time[6:8]
+        test_time = test_time[8:10]+":"+test_time[10:12]+":"+test_time[12:]
+        return TestResultMessage(mrn, test_day, test_time, min(float(message[3].split("|")[5]), 200))
+    elif message_type == 'ADT^A03':
+        return PatientDischargeMessage(message[1].split("|")[3])
+    raise ValueError(f"Unknown message type: {message_type}")
+
+def with_extra_segments(message):
+    """
+    Returns the message with a PV1 segment after the PID and a note after each OBX.
+    """
+    extended = []
+    for segment in message:
+        extended.append(segment)
+        if segment.startswith("PID|"):
+            extended.append("PV1|1|I|WARD 4^BED 12")
+        elif segment.startswith("OBX|"):
+            extended.append("NTE|1|L|Sample slightly haemolysed")
+    return extended
+
+def main():
+    parser = argparse.ArgumentParser(description="HL7 parser benchmark")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each parser, the fastest is reported")
+    flags = parser.parse_args()
+
+    # Frames as returned by MLLPFramer: the payload with its final carriage return
+    messages = synthesise_hl7_messages(flags.messages)
+    frames = [memoryview(to_mllp(m)[1:-2]) for m in messages]
+    extended_frames = [memoryview(to_mllp(with_extra_segments(m))[1:-2]) for m in messages]
+    for name, parse, frames in (("original parser", lambda frame: legacy_parse_message(legacy_from_mllp(frame)), frames),
+                                ("parse_frame", parse_frame, frames),
+                                ("parse_frame, extra segments", parse_frame, extended_frames)):
+        elapsed = float("inf")
+        for _ in range(flags.repeat):
+            start = time.perf_counter()
+            for frame in frames:
+                parse(frame)
+            elapsed = min(elapsed, time.perf_counter() - start)
+        print(f"{name}: {len(frames) / elapsed:.0f} messages/sec ({elapsed / len(frames) * 1e6:.2f} us/message)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Microbenchmark of the incremental MLLPFramer against the original
+byte-by-byte parse_mllp_messages implementation.
+
+Two workloads are measured:
+    - fragmented: one large message delivered in small reads, as happens when
+      a big ORU^R01 arrives over a slow connection;
+    - bulk: a file of many small messages parsed in a single call, as done
+      by simulator.py when it loads messages.mllp.
+
+Usage (from the repository root):
+    python -m benchmarks.mllp_framer --message-size 65536 --chunk-size 1024
+"""
+import argparse
+import time
+
+from benchmarks.common import synthesise_hl7_messages, to_mllp
+from mllp import MLLPFramer, MLLP_START_OF_BLOCK, MLLP_END_OF_BLOCK, MLLP_CARRIAGE_RETURN
+
+def legacy_parse_mllp_messages(buffer, source):
+    """The byte-by-byte scanner previously duplicated in message_listener.py and simulator.py."""
+    i = 0
+    messages = []
+    consumed = 0
+    expect = MLLP_START_OF_BLOCK
+    while i < len(buffer):
+        if expect is not None:
+            if buffer[i] != expect:
+                raise Exception(f"{source}: bad MLLP encoding: want {hex(expect)}, found {hex(buffer[i])}")
+            if expect == MLLP_START_OF_BLOCK:
+                expect = None
+                consumed = i
+            elif expect == MLLP_CARRIAGE_RETURN:
+                messages.append(buffer[consumed+1:i-1])
+                expect = MLLP_START_OF_BLOCK
+                consumed = i + 1
+        else:
+            if buffer[i] == MLLP_END_OF_BLOCK:
+                expect = MLLP_CARRIAGE_RETURN
+        i += 1
+    return messages, buffer[consumed:]
+
+def legacy_fragmented(chunks):
+    buffer = b""
+    frames = []
+    for chunk in chunks:
+        buffer += chunk
+        received, buffer = legacy_parse_mllp_messages(buffer, "bench")
+        frames += received
+    return frames
+
+def framer_fragmented(chunks):
+    framer = MLLPFramer("bench")
+    frames = []
+    for chunk in chunks:
+        frames += framer.feed(chunk)
+    return frames
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description="MLLP framer microbenchmark")
+    parser.add_argument("--message-size", type=int, default=65536, help="Size in bytes of the fragmented message")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="Size of each read in the fragmented workload")
+    parser.add_argument("--bulk-messages", type=int, default=20000, help="Number of messages in the bulk workload")
+    flags = parser.parse_args()
+
+    segment = "OBX|1|SN|CREATININE||103.4"
+    large = to_mllp(["MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||202401201800||ORU^R01|||2.5"]
+                    + [segment] * (flags.message_size // (len(segment) + 1)))
+    chunks = [large[i:i + flags.chunk_size] for i in range(0, len(large), flags.chunk_size)]
+    legacy_time, legacy_frames = timed(legacy_fragmented, chunks)
+    framer_time, framer_frames = timed(framer_fragmented, chunks)
+    assert [bytes(f) for f in framer_frames] == legacy_frames
+    print(f"fragmented: {len(large)} bytes in {len(chunks)} reads")
+    print(f"  legacy: {legacy_time * 1000:.2f} ms")
+    print(f"  framer: {framer_time * 1000:.2f} ms ({legacy_time / framer_time:.1f}x)")
+
+    bulk = b"".join(to_mllp(m) for m in synthesise_hl7_messages(flags.bulk_messages))
+    legacy_time, (legacy_frames, _) = timed(legacy_parse_mllp_messages, bulk, "bench")
+    framer_time, framer_frames = timed(MLLPFramer("bench").feed, bulk)
+    assert [bytes(f) for f in framer_frames] == legacy_frames
+    print(f"bulk: {len(bulk)} bytes, {len(legacy_frames)} messages in one read")
+    print(f"  legacy: {legacy_time * 1000:.2f} ms")
+    print(f"  framer: {framer_time * 1000:.2f} ms ({legacy_time / framer_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares the memory taken by admitted patients stored as the original nested
+dictionaries (with float lists) and as PatientRecord objects, and the speed of
+building model features from them.
+
+Usage (from the repository root):
+    python -m benchmarks.patient_records --patients 100000 --results 10
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from patient_record import PatientRecord
+from storage_manager import StorageManager
+
+def legacy_patient(rng, results):
+    return {'name': 'Jane Smith',
+            'date_of_birth': f"{rng.randint(1930, 2005)}-01-01",
+            'sex': rng.choice('MF'),
+            'creatinine_results': [rng.uniform(50, 200) for _ in range(results)],
+            'previous_positive_aki_prediction': False}
+
+def record_patient(rng, results):
+    return PatientRecord('Jane Smith', f"{rng.randint(1930, 2005)}-01-01", rng.choice('MF'),
+                         [rng.uniform(50, 200) for _ in range(results)])
+
+def measure_memory(build, patients, results):
+    rng = random.Random(0)
+    tracemalloc.start()
+    store = {str(i): build(rng, results) for i in range(patients)}
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, store
+
+def legacy_features(patient_data, num_creatinine_results=5):
+    sex = 0 if patient_data['sex'].lower() == 'm' else 1
+    age = StorageManager.determine_age(patient_data['date_of_birth'])
+    creatinine_results = patient_data['creatinine_results'].copy()
+    if len(creatinine_results) > num_creatinine_results:
+        recent_results = creatinine_results[-num_creatinine_results:]
+    else:
+        while len(creatinine_results) < num_creatinine_results:
+            creatinine_results.append(creatinine_results[-1])
+        recent_results = creatinine_results
+    return [age, sex] + recent_results
+
+def main():
+    parser = argparse.ArgumentParser(description="Patient record benchmark")
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--results", type=int, default=10, help="Creatinine results per patient")
+    flags = parser.parse_args()
+
+    legacy_size, legacy_store = measure_memory(legacy_patient, flags.patients, flags.results)
+    record_size, record_store = measure_memory(record_patient, flags.patients, flags.results)
+    print(f"{flags.patients} patients with {flags.results} results each:")
+    print(f"  dict: {legacy_size / flags.patients:.0f} bytes/patient")
+    print(f"  PatientRecord: {record_size / flags.patients:.0f} bytes/patient ({legacy_size / record_size:.1f}x less)")
+
+    storage_manager = StorageManager()
+    storage_manager.current_patients = record_store
+    mrns = list(record_store)[:20000]
+    for name, build in (("dict", lambda mrn: legacy_features(legacy_store[mrn])),
+                        ("PatientRecord", storage_manager.build_features)):
+        start = time.perf_counter()
+        for mrn in mrns:
+            build(mrn)
+        print(f"  build_features from {name}: {len(mrns) / (time.perf_counter() - start):.0f} patients/sec")
+
+if __name__ == "__main__":
+    main()
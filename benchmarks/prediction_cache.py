@@ -0,0 +1,62 @@
+"""
+Measures the hit rate of the prediction cache and the prediction speed with and
+without it, on the features of every test result of a synthetic message stream
+for patients from history.csv.
+
+Usage (from the repository root):
+    python -m benchmarks.prediction_cache --messages 100000 --cache-sizes 0 1000 100000
+"""
+import argparse
+import time
+
+from prometheus_client import REGISTRY
+
+from benchmarks.common import HISTORY_CSV, synthesise_hl7_messages
+from hospital_message import PatientAdmissionMessage, TestResultMessage
+from message_parser import parse_message
+from prediction_cache import PredictionCache
+from storage_manager import StorageManager
+
+def stream_features(num_messages):
+    """
+    Applies a synthetic stream to a fresh state and returns the features of the
+    patient after each of its test results.
+    """
+    storage_manager = StorageManager()
+    storage_manager.load_history(HISTORY_CSV)
+    features = []
+    for segments in synthesise_hl7_messages(num_messages):
+        message_object = parse_message(segments)
+        if isinstance(message_object, TestResultMessage):
+            storage_manager.add_test_result_to_current_patients(message_object)
+            features.append(storage_manager.build_features(message_object.mrn))
+        elif isinstance(message_object, PatientAdmissionMessage):
+            storage_manager.add_admitted_patient_to_current_patients(message_object)
+        else:
+            storage_manager.remove_patient_from_current_patients(message_object)
+    return storage_manager, features
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction cache benchmark")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--cache-sizes", type=int, nargs="+", default=[0, 1000, 100000])
+    parser.add_argument("--passes", type=int, default=2, help="Times the features are predicted, as when replaying")
+    flags = parser.parse_args()
+
+    storage_manager, features = stream_features(flags.messages)
+    print(f"{len(features)} test results, {len(set(map(tuple, features)))} distinct feature vectors")
+    for cache_size in flags.cache_sizes:
+        storage_manager.prediction_cache = PredictionCache(cache_size)
+        hits = REGISTRY.get_sample_value("prediction_cache_hits_total")
+        start = time.perf_counter()
+        for _ in range(flags.passes):
+            for input_features in features:
+                storage_manager.predict_features(input_features)
+        elapsed = time.perf_counter() - start
+        hits = REGISTRY.get_sample_value("prediction_cache_hits_total") - hits
+        predictions = len(features) * flags.passes
+        print(f"cache size {cache_size}: {predictions / elapsed:.0f} predictions/sec, "
+              f"hit rate {hits / predictions:.1%}")
+
+if __name__ == "__main__":
+    main()
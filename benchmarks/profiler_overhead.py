@@ -0,0 +1,57 @@
+"""
+Measures the cost of the sampling profiler on the handling of test results: the
+handling path of benchmarks/test_result_path.py is timed with no profiler, as
+when it is idle, and while a profiling session samples the stacks at several
+intervals.
+
+Usage (from the repository root):
+    python -m benchmarks.profiler_overhead --messages 50000 --intervals 0.005 0.001
+"""
+import argparse
+import collections
+import tempfile
+import threading
+import time
+
+from benchmarks.test_result_path import frames, handle, setup
+from profiler import SamplingProfiler
+
+def sample_until(profiler: SamplingProfiler, stop: threading.Event) -> None:
+    """
+    Samples like SamplingProfiler.run, until stop is set rather than for a fixed time.
+    """
+    stacks = collections.Counter()
+    ignored = {threading.get_ident()}
+    while not stop.wait(profiler.interval):
+        profiler.sample(stacks, ignored)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sampling profiler overhead benchmark")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each variant, the fastest is reported")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[0.005, 0.001], help="Sampling intervals in seconds")
+    flags = parser.parse_args()
+
+    for interval in [None] + flags.intervals:
+        elapsed = float("inf")
+        for _ in range(flags.repeat):
+            with tempfile.TemporaryDirectory() as directory:
+                storage_manager, mrns = setup(directory, flags.patients, 10)
+                batch = frames(mrns, flags.messages)
+                stop = threading.Event()
+                sampler = threading.Thread(target=sample_until, args=(SamplingProfiler(interval), stop))
+                if interval is not None:
+                    sampler.start()
+                start = time.perf_counter()
+                handle(storage_manager, batch, lambda storage_manager, mrn: storage_manager.build_features(mrn), True)
+                elapsed = min(elapsed, time.perf_counter() - start)
+                stop.set()
+                if sampler.is_alive():
+                    sampler.join()
+                storage_manager.close_message_log()
+        name = "no profiler" if interval is None else f"sampling every {interval * 1000:g} ms"
+        print(f"{name}: {flags.messages / elapsed:.0f} msg/s ({elapsed / flags.messages * 1e6:.2f} us/msg)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Measures recovery time as a function of message log size, replaying the whole
+log against loading a snapshot taken before the last --tail messages and
+replaying only those.
+
+Usage (from the repository root):
+    python -m benchmarks.recovery --messages 10000 100000 --tail 1000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import HISTORY_CSV, read_history_mrns
+from benchmarks.log_replay import write_logs
+from storage_manager import StorageManager
+
+def recover(path):
+    storage_manager = StorageManager(message_log_filepath=path)
+    storage_manager.snapshot_interval = 0
+    start = time.perf_counter()
+    storage_manager.initialise_database(HISTORY_CSV)
+    return storage_manager, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Recovery time benchmark")
+    parser.add_argument("--messages", type=int, nargs="+", default=[10000, 100000, 1000000], help="Log sizes")
+    parser.add_argument("--tail", type=int, default=1000, help="Messages logged after the snapshot")
+    parser.add_argument("--format", choices=["csv", "binary"], default="binary")
+    flags = parser.parse_args()
+
+    mrns = read_history_mrns(HISTORY_CSV)
+    for messages in flags.messages:
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path, binary_path = write_logs(directory, messages, mrns)
+            path = binary_path if flags.format == "binary" else csv_path
+            _, full = recover(path)
+
+            # Snapshot everything but the tail, then append the tail as the active log
+            head_directory = os.path.join(directory, "head")
+            os.mkdir(head_directory)
+            head_csv, head_binary = write_logs(head_directory, messages - flags.tail, mrns)
+            head = head_binary if flags.format == "binary" else head_csv
+            storage_manager, _ = recover(head)
+            storage_manager.snapshot()
+            tail_directory = os.path.join(directory, "tail")
+            os.mkdir(tail_directory)
+            tail_csv, tail_binary = write_logs(tail_directory, flags.tail, mrns)
+            shutil.copy(tail_binary if flags.format == "binary" else tail_csv, head)
+            _, snapshot = recover(head)
+            size = os.path.getsize(storage_manager.snapshot_filepath)
+
+            print(f"{messages} messages: full replay {full:.2f}s, "
+                  f"snapshot ({size / 2**20:.1f} MiB) + {flags.tail} tail {snapshot:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Agreement report and timing of the rule fast path (rule_classifier.py).
+
+Every creatinine result of every patient of history.csv is replayed through a
+PatientRecord, for patients of several ages and both sexes, and the rule's
+decision on the resulting features is compared with the model's prediction.
+The same is done for randomly generated features, half of them stable and low
+like the ones the rule settles, so that thresholds which only fit history.csv
+are caught. The report gives the share of results settled by each path and
+lists the results where the rule and the model disagree; the script exits with
+status 1 when there is any, so that it can be run after changing the model or
+the thresholds (RULE_* in config.py, which can be set from the environment).
+
+It then times the rule alone and predict_features with and without the fast
+path, with the prediction cache disabled.
+
+Usage (from the repository root):
+    python -m benchmarks.rule_fast_path [--history history.csv] [--ages 20 45 70 90] [--generated 200000]
+"""
+import argparse
+import csv
+import datetime
+import random
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import HISTORY_CSV
+from patient_record import FEATURE_RESULTS, PatientRecord
+from prediction_cache import PredictionCache
+from storage_manager import StorageManager
+
+def history_features(history_csv_path: str, ages: list) -> list:
+    """
+    Returns the model features after each result of each patient of
+    history_csv_path, for each of the ages and both sexes.
+    """
+    today = datetime.date.today()
+    features = []
+    with open(history_csv_path) as file:
+        reader = csv.reader(file)
+        next(reader)
+        for row in reader:
+            results = [float(value) for value in row[2::2] if value]
+            for age in ages:
+                date_of_birth = today.replace(year=today.year - age, day=1).isoformat()
+                for sex in ("M", "F"):
+                    record = PatientRecord("", date_of_birth, sex)
+                    for value in results:
+                        record.add_result(value)
+                        features.append(record.features(today))
+    return features
+
+def generated_features(count: int, seed: int = 0) -> list:
+    """
+    Returns count random feature vectors of patients of 18 to 100 of both sexes,
+    with one to FEATURE_RESULTS results padded with the last one, rounded to two
+    decimals like the results of the HL7 messages. Half of them have stable
+    results below 130, one of them the lowest, the others are anything up to 400.
+    """
+    generator = random.Random(seed)
+    features = []
+    for _ in range(count):
+        if generator.random() < 0.5:
+            lowest = generator.uniform(5, 130)
+            results = [generator.uniform(lowest, min(1.3 * lowest, 130)) for _ in range(FEATURE_RESULTS)]
+            results[generator.randrange(FEATURE_RESULTS)] = lowest
+        else:
+            results = [generator.uniform(5, 400) for _ in range(FEATURE_RESULTS)]
+        available = generator.randint(1, FEATURE_RESULTS)
+        results = results[:available] + [results[available - 1]] * (FEATURE_RESULTS - available)
+        features.append([generator.randint(18, 100), generator.randint(0, 1)] + [round(value, 2) for value in results])
+    return features
+
+def disagreements(storage_manager: StorageManager, features: list) -> tuple:
+    """
+    Compares the rule's decisions on features with the model's predictions.
+
+    Returns:
+        The number of features settled by each path, and the features where the
+        rule and the model disagree, with the rule's decision and the prediction.
+    """
+    # The model is run on the quantized features, as predict_features does
+    keys = [storage_manager.prediction_cache.key(input_features) for input_features in features]
+    model_predictions = storage_manager.model.predict(np.array(keys, dtype=np.float64))
+    paths = {"rule_negative": 0, "model": 0}
+    disagreeing = []
+    for input_features, prediction in zip(features, model_predictions):
+        decision = storage_manager.rule_classifier.decide(input_features)
+        if decision is None:
+            paths["model"] += 1
+            continue
+        paths["rule_negative"] += 1
+        if decision != prediction:
+            disagreeing.append((input_features, decision, int(prediction)))
+    return paths, disagreeing
+
+def main():
+    parser = argparse.ArgumentParser(description="Rule fast path agreement report and benchmark")
+    parser.add_argument("--history", default=HISTORY_CSV)
+    parser.add_argument("--ages", type=int, nargs="+", default=[20, 45, 70, 90])
+    parser.add_argument("--generated", type=int, default=200000, help="Number of generated features compared")
+    parser.add_argument("--timed", type=int, default=20000, help="Number of results timed")
+    flags = parser.parse_args()
+
+    storage_manager = StorageManager()
+    rule_classifier = storage_manager.rule_classifier
+    print(f"Thresholds: negative when highest <= {rule_classifier.negative_max_ratio} x lowest "
+          f"and below {rule_classifier.negative_max_value}")
+
+    features = history_features(flags.history, flags.ages)
+    failed = False
+    for name, compared in (("history.csv", features), ("generated", generated_features(flags.generated))):
+        paths, disagreeing = disagreements(storage_manager, compared)
+        print(f"{name}: {len(compared)} results")
+        for path, count in paths.items():
+            print(f"  {path}: {count} ({count / len(compared):.1%})")
+        print(f"  disagreements with the model: {len(disagreeing)}")
+        for input_features, decision, prediction in disagreeing[:20]:
+            print(f"    {input_features}: rule {decision}, model {prediction}")
+        failed = failed or bool(disagreeing)
+
+    timed = features[:flags.timed]
+    start = time.perf_counter()
+    for input_features in timed:
+        rule_classifier.decide(input_features)
+    elapsed = time.perf_counter() - start
+    print(f"rule alone: {elapsed / len(timed) * 1e6:.2f} us/result")
+    storage_manager.prediction_cache = PredictionCache(0)
+    for name, enabled in (("model only", False), ("rule fast path", True)):
+        rule_classifier.enabled = enabled
+        start = time.perf_counter()
+        for input_features in timed:
+            storage_manager.predict_features(input_features)
+        elapsed = time.perf_counter() - start
+        print(f"predict_features, {name}: {elapsed / len(timed) * 1e6:.2f} us/result")
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures the throughput of the sharded listener for several numbers of worker
+processes, against the single process threaded engine.
+
+A sender process plays the hospital: it serves the synthetic messages over MLLP,
+keeping up to --window messages unacknowledged, and answers pages. Since the
+simulator waits for every ACK before sending the next message, it cannot keep
+several shards busy and is not used here.
+
+Usage (from the repository root):
+    python -m benchmarks.sharded_throughput --messages 20000 --workers 1 2 4 8
+"""
+import argparse
+import http.server
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from benchmarks.common import HISTORY_CSV, synthesise_hl7_messages, to_mllp
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def send_messages(server: socket.socket, pager: http.server.HTTPServer, frames: list, window: int, report) -> None:
+    """
+    Serves frames to the first connection, with at most window of them waiting
+    for an ACK, and reports the time from the first frame to the last ACK.
+    """
+    threading.Thread(target=pager.serve_forever, daemon=True).start()
+    connection, _ = server.accept()
+    acknowledged = 0
+    sent = 0
+    buffer = b""
+    start = time.perf_counter()
+    while acknowledged < len(frames):
+        if sent < len(frames) and sent - acknowledged < window:
+            end = min(len(frames), acknowledged + window)
+            connection.sendall(b"".join(frames[sent:end]))
+            sent = end
+        buffer += connection.recv(65536)
+        acks = buffer.count(b"\x1c\x0d")
+        acknowledged += acks
+        buffer = buffer[buffer.rfind(b"\x1c\x0d") + 2:] if acks else buffer
+    report.send(time.perf_counter() - start)
+    connection.close()
+
+def run(listen, frames: list, window: int) -> float:
+    """
+    Starts a sender process, calls listen with its address and returns the elapsed time.
+    """
+    import message_listener
+    context = multiprocessing.get_context("fork")
+    server = socket.create_server(("localhost", 0))
+    pager = http.server.HTTPServer(("localhost", 0), PageHandler)
+    parent, child = context.Pipe()
+    sender = context.Process(target=send_messages, args=(server, pager, frames, window, child))
+    sender.start()
+    message_listener.stopping_condition = False
+    listen(("localhost", server.getsockname()[1]), pager.server_address)
+    elapsed = parent.recv()
+    sender.join()
+    server.close()
+    pager.server_close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded listener throughput benchmark")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--window", type=int, default=200, help="Messages sent ahead of their ACK")
+    flags = parser.parse_args()
+
+    import message_listener
+    import sharded_listener
+    from alert_manager import AlertManager
+    from storage_manager import StorageManager
+
+    frames = [to_mllp(m) for m in synthesise_hl7_messages(flags.messages)]
+
+    def threaded(directory):
+        def listen(address, pager_address):
+            storage_manager = StorageManager(message_log_filepath=os.path.join(directory, "message_log.bin"))
+            storage_manager.initialise_database(HISTORY_CSV, wipe_past_message_log=True)
+            alert_manager = AlertManager(outbox_path=os.path.join(directory, "outbox"), address=pager_address)
+            alert_manager.start()
+            message_listener.listen_for_messages(storage_manager, alert_manager, address=address, retries=1, start_delay=0)
+            alert_manager.pool.stop()
+        return listen
+
+    def sharded(directory, workers):
+        def listen(address, pager_address):
+            shards = sharded_listener.ShardPool(workers, os.path.join(directory, "message_log.bin"),
+                                                history_csv_path=HISTORY_CSV, history_cache_path=None,
+                                                outbox_path=os.path.join(directory, "outbox"),
+                                                pager_address=pager_address)
+            try:
+                sharded_listener.listen_for_messages_sharded(shards, address=address, retries=1, start_delay=0)
+            finally:
+                shards.stop()
+        return listen
+
+    runs = [("threaded engine", threaded)] + [(f"sharded, {n} workers", lambda d, n=n: sharded(d, n)) for n in flags.workers]
+    for name, engine in runs:
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed = run(engine(directory), frames, flags.window)
+        print(f"{name}: {len(frames) / elapsed:.0f} messages/sec")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Startup time of the listener: the time to import message_listener, from
+`python -X importtime`, and the time from starting message_listener.py to the
+ACK of its first message and of its first test result, which needs the model.
+
+The listener is started against a local MLLP server with its state in a
+temporary directory; the rule fast path is turned off so that the first test
+result goes to the model. The modules taking the longest to import are listed.
+
+With --import-budget or --first-ack-budget, the script exits with status 1 when
+a time exceeds its budget; tests/startup_test.py checks the same budgets.
+
+Usage (from the repository root):
+    python -m benchmarks.startup [--import-budget 0.5] [--first-ack-budget 3]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import HISTORY_CSV, REPO_ROOT, synthesise_hl7_messages, to_mllp
+
+# Modules message_listener must not import, directly or not
+HEAVY_MODULES = ("pandas", "sklearn", "joblib")
+
+def import_time(module: str = "message_listener") -> tuple[float, list]:
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        The cumulative import time of the module in seconds, and the modules
+        with the longest own import time, as (seconds, name), longest first.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    total = 0.0
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(own) / 1e6, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative) / 1e6
+    return total, sorted(modules, reverse=True)
+
+def imported_side_effects(module: str = "message_listener") -> dict:
+    """
+    Imports a module in a fresh interpreter and returns the heavy modules it
+    imported and the number of threads running afterwards, which is 1 unless
+    the import started something such as the Prometheus HTTP server.
+    """
+    code = (f"import sys, threading, {module}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules)); "
+            f"print(threading.active_count())")
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    heavy, threads = result.stdout.split("\n")[:2]
+    return {"heavy_modules": [m for m in heavy.split(",") if m], "threads": int(threads)}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+def read_ack(connection: socket.socket) -> None:
+    buffer = b""
+    while not buffer.endswith(b"\x1c\x0d"):
+        received = connection.recv(1024)
+        if not received:
+            raise ConnectionError("the listener closed the connection")
+        buffer += received
+
+def first_ack_time(timeout: float = 60) -> tuple[float, float]:
+    """
+    Starts message_listener.py against a local MLLP server, sends it an
+    admission then a test result for the same patient, each one once the
+    previous one is acknowledged.
+
+    Returns:
+        The times in seconds from starting the process to the ACK of the
+        admission and to the ACK of the test result.
+    """
+    admission, test_result = synthesise_hl7_messages(2)
+    with tempfile.TemporaryDirectory() as directory, socket.create_server(("localhost", 0)) as server:
+        server.settimeout(timeout)
+        environment = dict(os.environ,
+                           MLLP_ADDRESS=f"localhost:{server.getsockname()[1]}",
+                           PAGER_ADDRESS=f"localhost:{free_port()}",
+                           PROMETHEUS_PORT=str(free_port()),
+                           MESSAGE_LOG_CSV_PATH=os.path.join(directory, "message_log.csv"),
+                           MESSAGE_LOG_BINARY_PATH=os.path.join(directory, "message_log.bin"),
+                           PAGER_OUTBOX_PATH=os.path.join(directory, "pager_outbox"),
+                           HISTORY_CACHE_PATH=os.path.join(directory, "history.cache"),
+                           RULE_FAST_PATH="0")
+        start = time.perf_counter()
+        listener = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "message_listener.py"),
+                                     f"--history-dir={HISTORY_CSV}"],
+                                    cwd=REPO_ROOT, env=environment, stdout=subprocess.DEVNULL)
+        try:
+            connection, _ = server.accept()
+            with connection:
+                connection.settimeout(timeout)
+                connection.sendall(to_mllp(admission))
+                read_ack(connection)
+                first_ack = time.perf_counter() - start
+                connection.sendall(to_mllp(test_result))
+                read_ack(connection)
+                first_prediction = time.perf_counter() - start
+        finally:
+            listener.terminate()
+            try:
+                listener.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                listener.kill()
+    return first_ack, first_prediction
+
+def main():
+    parser = argparse.ArgumentParser(description="Listener startup time benchmark")
+    parser.add_argument("--import-budget", type=float, help="Maximum seconds to import message_listener")
+    parser.add_argument("--first-ack-budget", type=float, help="Maximum seconds from start to the first ACK")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports listed")
+    flags = parser.parse_args()
+
+    total, modules = import_time()
+    print(f"import message_listener: {total * 1000:.0f} ms")
+    for seconds, name in modules[:flags.top]:
+        print(f"  {seconds * 1000:7.1f} ms  {name}")
+    side_effects = imported_side_effects()
+    print(f"heavy modules imported: {', '.join(side_effects['heavy_modules']) or 'none'}, "
+          f"threads after import: {side_effects['threads']}")
+
+    first_ack, first_prediction = first_ack_time()
+    print(f"first ACK: {first_ack * 1000:.0f} ms, first test result ACK: {first_prediction * 1000:.0f} ms")
+
+    failed = bool(side_effects["heavy_modules"]) or side_effects["threads"] != 1
+    if flags.import_budget is not None and total > flags.import_budget:
+        print(f"import time over budget of {flags.import_budget * 1000:.0f} ms")
+        failed = True
+    if flags.first_ack_budget is not None and first_ack > flags.first_ack_budget:
+        print(f"first ACK over budget of {flags.first_ack_budget * 1000:.0f} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Microbenchmark of the whole handling path of an ORU^R01 test result, as run by
+the listener for every creatinine result: MLLP unwrapping and parsing, applying
+the result to the patient state, logging it, building the model features and,
+optionally, running the model.
+
+The features are either read from the vector kept up to date by PatientRecord
+or rebuilt from the creatinine results on every message, as before.
+
+Usage (from the repository root):
+    python -m benchmarks.test_result_path --messages 200000 --results 10
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import to_mllp
+from hospital_message import PatientAdmissionMessage, TestResultMessage
+from message_listener import apply_message
+from message_parser import parse_frame
+from storage_manager import StorageManager
+
+def rebuilt_features(storage_manager, mrn, num_creatinine_results=5):
+    """
+    Features built from scratch from the creatinine results of the patient.
+    """
+    patient_data = storage_manager.current_patients.get(mrn)
+    if patient_data is None:
+        raise ValueError(f"Patient with MRN {mrn} not found in current_patients dictionary.")
+    age = patient_data.age(datetime.date.today())
+    recent_results = patient_data.creatinine_results[-num_creatinine_results:].tolist()
+    recent_results += [recent_results[-1]] * (num_creatinine_results - len(recent_results))
+    return [age, patient_data.sex] + recent_results
+
+def setup(directory, patients, results, seed=0):
+    rng = random.Random(seed)
+    storage_manager = StorageManager(message_log_filepath=os.path.join(directory, "message_log.bin"))
+    storage_manager.snapshot_interval = float("inf")
+    storage_manager.open_message_log()
+    mrns = [str(100000 + i) for i in range(patients)]
+    for mrn in mrns:
+        storage_manager.add_admitted_patient_to_current_patients(
+            PatientAdmissionMessage(mrn, "PATIENT", f"{rng.randint(1930, 2005)}-01-01", rng.choice("MF")))
+        for _ in range(results):
+            storage_manager.add_test_result_to_current_patients(TestResultMessage(mrn, "20240101", "090000", rng.uniform(50, 200)))
+    return storage_manager, mrns
+
+def frames(mrns, messages, seed=0):
+    rng = random.Random(seed)
+    out = []
+    for i in range(messages):
+        segments = [
+            "MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240101100000||ORU^R01|||2.5",
+            f"PID|1||{mrns[i % len(mrns)]}",
+            "OBR|1||||||20240101100000",
+            f"OBX|1|SN|CREATININE||{rng.uniform(50, 200):.2f}",
+        ]
+        out.append(to_mllp(segments)[1:-2])
+    return out
+
+def handle(storage_manager, frames, build_features, predict):
+    for frame in frames:
+        message_object = parse_frame(frame)
+        apply_message(storage_manager, message_object)
+        storage_manager.add_message_to_log_csv(message_object)
+        if storage_manager.no_positive_aki_prediction_so_far(message_object.mrn):
+            features = build_features(storage_manager, message_object.mrn)
+            if predict:
+                storage_manager.predict_features(features)
+
+def main():
+    parser = argparse.ArgumentParser(description="TestResult handling path benchmark")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--results", type=int, default=10, help="Creatinine results per patient before the run")
+    flags = parser.parse_args()
+
+    variants = (("rebuilt features", rebuilt_features),
+                ("incremental features", lambda storage_manager, mrn: storage_manager.build_features(mrn)))
+    for predict in (False, True):
+        messages = flags.messages if not predict else flags.messages // 10
+        for name, build_features in variants:
+            with tempfile.TemporaryDirectory() as directory:
+                storage_manager, mrns = setup(directory, flags.patients, flags.results)
+                batch = frames(mrns, messages)
+                start = time.perf_counter()
+                handle(storage_manager, batch, build_features, predict)
+                elapsed = time.perf_counter() - start
+                storage_manager.close_message_log()
+            print(f"{name}{' + model' if predict else ''}: {messages / elapsed:.0f} msg/s "
+                  f"({elapsed / messages * 1e6:.2f} us/msg)")
+
+if __name__ == "__main__":
+    main()
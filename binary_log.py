@@ -0,0 +1,221 @@
+import argparse
+import csv
+import datetime
+import mmap
+import os
+import struct
+import time
+
+from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage, PositiveAKIPredictionMessage
+
+# Every binary message log starts with this header
+MAGIC = b"AKILOG"
+VERSION = 1
+FILE_HEADER = struct.pack("<6sH", MAGIC, VERSION)
+
+# Each record starts with the length of the rest of the record, its type and the
+# time it was logged. Test results then hold the creatinine value. The string
+# fields of the message follow as UTF-8, separated by NUL bytes, so that a record
+# is decoded with a single slice, decode and split.
+RECORD_HEADER = struct.Struct("<IBd")
+FLOAT = struct.Struct("<d")
+SEPARATOR = "\0"
+
+RECORD_ADMISSION = 1
+RECORD_TEST_RESULT = 2
+RECORD_DISCHARGE = 3
+RECORD_POSITIVE_PREDICTION = 4
+
+class BinaryLogError(Exception):
+    """
+    Raised when a file is not a binary message log of a supported version, or
+    holds a record which cannot be decoded.
+    """
+
+def _pack_strings(*values: str) -> bytes:
+    for value in values:
+        if SEPARATOR in value:
+            raise ValueError(f"Cannot encode a field containing a NUL byte: {value!r}")
+    return SEPARATOR.join(values).encode()
+
+def encode_message(message: object, logged_at: float = None) -> bytes:
+    """
+    Encodes a message as a binary log record.
+
+    Args:
+        message (object): A PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
+                          or PositiveAKIPredictionMessage.
+        logged_at (float): The time the message was logged, in seconds since the epoch.
+                           Defaults to now.
+
+    Returns:
+        bytes: The encoded record.
+    """
+    if logged_at is None:
+        logged_at = time.time()
+    if isinstance(message, PatientAdmissionMessage):
+        record_type = RECORD_ADMISSION
+        payload = _pack_strings(message.mrn, message.name, message.date_of_birth, message.sex)
+    elif isinstance(message, TestResultMessage):
+        record_type = RECORD_TEST_RESULT
+        payload = FLOAT.pack(float(message.creatinine_value)) + _pack_strings(message.mrn, message.test_date, message.test_time)
+    elif isinstance(message, PatientDischargeMessage):
+        record_type = RECORD_DISCHARGE
+        payload = _pack_strings(message.mrn)
+    elif isinstance(message, PositiveAKIPredictionMessage):
+        record_type = RECORD_POSITIVE_PREDICTION
+        payload = _pack_strings(message.mrn)
+    else:
+        raise ValueError(f"Cannot encode message of type {type(message).__name__}")
+    return RECORD_HEADER.pack(RECORD_HEADER.size - 4 + len(payload), record_type, logged_at) + payload
+
+def iter_records(buffer, offset: int = len(FILE_HEADER)):
+    """
+    Decodes the records of a binary message log held in a bytes-like object.
+
+    A record cut short at the end of the buffer, as left by a crash during an
+    append, is ignored; recovery truncates it with complete_length before any
+    record is appended after it.
+
+    Args:
+        buffer: The contents of the log, e.g. a memory map of the file.
+        offset (int): Where to start decoding; by default just after the file header.
+
+    Yields:
+        tuple: The decoded message, the time it was logged, and the offset just after its record.
+
+    Raises:
+        BinaryLogError: If a complete record cannot be decoded.
+    """
+    unpack_header = RECORD_HEADER.unpack_from
+    unpack_float = FLOAT.unpack_from
+    header_size = RECORD_HEADER.size
+    end = len(buffer)
+    while offset + header_size <= end:
+        length, record_type, logged_at = unpack_header(buffer, offset)
+        record_end = offset + 4 + length
+        if record_end > end:
+            return
+        position = offset + header_size
+        try:
+            if record_type == RECORD_TEST_RESULT:
+                (value,) = unpack_float(buffer, position)
+                mrn, test_date, test_time = str(buffer[position + 8:record_end], "utf-8").split(SEPARATOR)
+                message = TestResultMessage(mrn, test_date, test_time, value)
+            elif record_type == RECORD_ADMISSION:
+                message = PatientAdmissionMessage(*str(buffer[position:record_end], "utf-8").split(SEPARATOR))
+            elif record_type == RECORD_DISCHARGE:
+                message = PatientDischargeMessage(str(buffer[position:record_end], "utf-8"))
+            elif record_type == RECORD_POSITIVE_PREDICTION:
+                message = PositiveAKIPredictionMessage(str(buffer[position:record_end], "utf-8"))
+            else:
+                raise BinaryLogError(f"Unknown record type {record_type} at offset {offset}")
+        except (ValueError, TypeError, struct.error) as e:
+            raise BinaryLogError(f"Corrupt record of type {record_type} at offset {offset}: {e}") from e
+        yield message, logged_at, record_end
+        offset = record_end
+
+def complete_length(buffer, offset: int = len(FILE_HEADER)) -> int:
+    """
+    Returns the length of the log held in buffer up to the end of its last
+    complete record, from the record lengths alone, without decoding them.
+    """
+    unpack_length = RECORD_HEADER.unpack_from
+    header_size = RECORD_HEADER.size
+    end = len(buffer)
+    while offset + header_size <= end:
+        record_end = offset + 4 + unpack_length(buffer, offset)[0]
+        if record_end > end:
+            break
+        offset = record_end
+    return min(offset, end)
+
+def read_log(path: str, offset: int = len(FILE_HEADER)):
+    """
+    Streams the records of a binary message log through a memory map of the file.
+
+    Args:
+        path (str): Path of the log.
+        offset (int): Where to start reading; by default just after the file header.
+
+    Yields:
+        tuple: The decoded message, the time it was logged, and the offset just after its record.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size < len(FILE_HEADER):
+            raise BinaryLogError(f"{path}: not a binary message log")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            magic, version = struct.unpack_from("<6sH", buffer, 0)
+            if magic != MAGIC:
+                raise BinaryLogError(f"{path}: not a binary message log")
+            if version != VERSION:
+                raise BinaryLogError(f"{path}: unsupported binary message log version {version}")
+            try:
+                yield from iter_records(buffer, offset)
+            except BinaryLogError as e:
+                raise BinaryLogError(f"{path}: {e}") from e
+
+def message_from_csv_row(row: list) -> object:
+    """
+    Rebuilds the message logged as a row of message_log.csv.
+
+    The fields of additional_info are located by their labels, searching from
+    the right, so that a patient name containing ". " is read correctly.
+
+    Args:
+        row (list): The timestamp, type, mrn and additional_info columns.
+
+    Returns:
+        object: The message, or None if the row has an unknown type.
+    """
+    _, message_type, mrn, additional_info = row
+    if message_type == 'PatientAdmission':
+        rest, sex = additional_info.rsplit('. Sex: ', 1)
+        name, dob = rest[len('Name: '):].rsplit('. DOB: ', 1)
+        return PatientAdmissionMessage(mrn, name, dob, sex)
+    elif message_type == 'PatientDischarge':
+        return PatientDischargeMessage(mrn)
+    elif message_type == 'PositiveAKIPrediction':
+        return PositiveAKIPredictionMessage(mrn)
+    elif message_type == 'TestResult':
+        rest, creatinine_value = additional_info.rsplit('. Creatinine Value: ', 1)
+        test_date, test_time = rest[len('Test Date: '):].rsplit('. Test Time: ', 1)
+        return TestResultMessage(mrn, test_date, test_time, float(creatinine_value))
+    return None
+
+def convert_csv_to_binary(csv_path: str, binary_path: str) -> int:
+    """
+    Converts a message_log.csv file into a binary message log.
+
+    Args:
+        csv_path (str): The existing CSV message log.
+        binary_path (str): Where to write the binary log. It is written to a
+                           temporary file first and renamed into place.
+
+    Returns:
+        int: The number of records converted.
+    """
+    count = 0
+    with open(csv_path, "r", newline="") as source, open(binary_path + ".tmp", "wb") as target:
+        target.write(FILE_HEADER)
+        reader = csv.reader(source)
+        next(reader, None)
+        for row in reader:
+            message = message_from_csv_row(row)
+            if message is None:
+                continue
+            logged_at = datetime.datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S").timestamp()
+            target.write(encode_message(message, logged_at))
+            count += 1
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(binary_path + ".tmp", binary_path)
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert a CSV message log into the binary format')
+    parser.add_argument('csv_path', type=str, help='Path of the existing message_log.csv')
+    parser.add_argument('binary_path', type=str, help='Path of the binary log to write')
+    args = parser.parse_args()
+
+    print(f"Converted {convert_csv_to_binary(args.csv_path, args.binary_path)} messages")
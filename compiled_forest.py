@@ -0,0 +1,118 @@
+import numpy as np
+
+# Up to this many samples, trees are walked in plain Python rather than with NumPy
+SCALAR_BATCH_LIMIT = 4
+
+class CompiledForest:
+    """
+    Random forest classifier evaluated with plain NumPy.
+
+    The trees of a fitted sklearn RandomForestClassifier are exported by
+    model_compiler.py into flat node arrays, with the nodes of every tree
+    concatenated one after the other. Leaves point back to themselves, so a batch
+    of samples can walk all the trees at once for a fixed number of steps,
+    without sklearn or joblib being imported.
+    """
+    def __init__(self,
+                 feature: np.ndarray,
+                 threshold: np.ndarray,
+                 left: np.ndarray,
+                 right: np.ndarray,
+                 value: np.ndarray,
+                 roots: np.ndarray,
+                 classes: np.ndarray,
+                 max_depth: int) -> None:
+        """
+        Initializes the forest from its flat node arrays.
+
+        Args:
+            feature (np.ndarray): Feature tested by each node.
+            threshold (np.ndarray): Threshold of each node; samples with a feature
+                                    value less than or equal to it go left.
+            left (np.ndarray), right (np.ndarray): Index of the children of each node.
+            value (np.ndarray): Class probabilities of each node, shape (nodes, classes).
+            roots (np.ndarray): Index of the root node of each tree.
+            classes (np.ndarray): The class labels, as in RandomForestClassifier.classes_.
+            max_depth (int): Depth of the deepest tree.
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = max_depth
+        # The right then the left child of each node, indexed by 2 * node + go_left
+        self._children = np.column_stack([right, left]).ravel()
+        self._is_internal = left != np.arange(left.shape[0])
+        self._lists = None
+
+    @property
+    def n_features(self) -> int:
+        return int(self.feature.max()) + 1
+
+    @classmethod
+    def load(cls, path: str) -> "CompiledForest":
+        """
+        Loads a forest saved by save.
+        """
+        with np.load(path) as arrays:
+            return cls(arrays['feature'], arrays['threshold'], arrays['left'], arrays['right'],
+                       arrays['value'], arrays['roots'], arrays['classes'], int(arrays['max_depth']))
+
+    def save(self, path: str) -> None:
+        """
+        Saves the node arrays as an uncompressed .npz file.
+        """
+        np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 value=self.value, roots=self.roots, classes=self.classes, max_depth=self.max_depth)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Returns the class probabilities averaged over all trees, shape (samples, classes).
+        """
+        # sklearn evaluates trees on float32 inputs, so do the same for identical splits
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.shape[0] <= SCALAR_BATCH_LIMIT:
+            return np.array([self._predict_proba_row(row) for row in X.tolist()]).reshape(X.shape[0], -1)
+
+        n_samples, n_features = X.shape
+        n_trees = self.roots.shape[0]
+        flat_X = X.ravel()
+        # One entry per (sample, tree) pair; only pairs not yet at a leaf are advanced
+        nodes = np.tile(self.roots, n_samples)
+        row_offsets = np.repeat(np.arange(n_samples) * n_features, n_trees)
+        active = np.arange(nodes.shape[0])
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            go_left = flat_X[row_offsets[active] + self.feature[current]] <= self.threshold[current]
+            following = self._children[2 * current + go_left]
+            nodes[active] = following
+            active = active[self._is_internal[following]]
+            if active.shape[0] == 0:
+                break
+        return self.value[nodes].reshape(n_samples, n_trees, -1).sum(axis=1) / n_trees
+
+    def _predict_proba_row(self, x: list) -> list:
+        """
+        Walks every tree for a single sample in plain Python, which is faster than
+        NumPy for a handful of samples.
+        """
+        if self._lists is None:
+            self._lists = (self.feature.tolist(), self.threshold.tolist(), self._children.tolist(),
+                           self._is_internal.tolist(), self.roots.tolist(), self.value.tolist())
+        feature, threshold, children, is_internal, roots, value = self._lists
+        total = [0.0] * len(value[0])
+        for node in roots:
+            while is_internal[node]:
+                node = children[2 * node + (x[feature[node]] <= threshold[node])]
+            for i, v in enumerate(value[node]):
+                total[i] += v
+        return [t / len(roots) for t in total]
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Returns the predicted class of each sample, like RandomForestClassifier.predict.
+        """
+        return self.classes[np.argmax(self.predict_proba(X), axis=1)]
@@ -2,12 +2,53 @@ import os
 
 # The path to the CSV file where historical patient data is stored.
 HISTORY_CSV_PATH = '/hospital-history/history.csv'
-MESSAGE_LOG_CSV_PATH = '/state/message_log.csv'
+# Memory-mapped cache compiled from history.csv; /hospital-history is mounted read-only
+HISTORY_CACHE_PATH = os.environ.get('HISTORY_CACHE_PATH', '/state/history.cache')
+MESSAGE_LOG_CSV_PATH = os.environ.get('MESSAGE_LOG_CSV_PATH', '/state/message_log.csv')
+MESSAGE_LOG_BINARY_PATH = os.environ.get('MESSAGE_LOG_BINARY_PATH', '/state/message_log.bin')
+
+# The format of the message log: 'csv', or 'binary' for the compact format of
+# binary_log.py. When 'binary' is chosen and only a CSV log exists, the CSV log is
+# converted on start up, with its snapshot and sealed segments.
+MESSAGE_LOG_FORMAT = os.environ.get('MESSAGE_LOG_FORMAT', 'csv')
 
 # These act as the header row for the MESSAGE_LOG CSV file
 MESSAGE_LOG_CSV_FIELDS = ['timestamp', 'type', 'mrn', 'additional_info']
 
-MODEL_PATH = "model/model.jl"
+# When the message log is fsynced: 'always' after every message, 'records' once
+# MESSAGE_LOG_SYNC_RECORDS messages are waiting, or 'interval' every
+# MESSAGE_LOG_SYNC_INTERVAL_MS milliseconds. Messages are only acknowledged once
+# their row has been fsynced, so with 'records' all the messages handled together
+# are committed by a single fsync before they are acknowledged.
+MESSAGE_LOG_SYNC_POLICY = os.environ.get('MESSAGE_LOG_SYNC_POLICY', 'records')
+MESSAGE_LOG_SYNC_RECORDS = 100
+MESSAGE_LOG_SYNC_INTERVAL_MS = 5
+
+# Every SNAPSHOT_INTERVAL_MESSAGES logged messages the in-memory state is written to
+# <message log>.snapshot and the log written before it is removed, so that a restart
+# only replays the messages logged since. 0 disables snapshots.
+SNAPSHOT_INTERVAL_MESSAGES = int(os.environ.get('SNAPSHOT_INTERVAL_MESSAGES', 10000))
+
+# The model used for predictions, compiled from SKLEARN_MODEL_PATH by model_compiler.py
+MODEL_PATH = "model/model.npz"
+SKLEARN_MODEL_PATH = "model/model.jl"
+
+# Predictions are cached for up to PREDICTION_CACHE_SIZE feature vectors, least
+# recently used first out, with features quantized to PREDICTION_CACHE_DECIMALS
+# decimals. 0 disables the cache. The model file is checked for changes at most
+# every MODEL_CHECK_INTERVAL_SECONDS; a changed model is reloaded and the cache cleared.
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 100000))
+PREDICTION_CACHE_DECIMALS = 2
+MODEL_CHECK_INTERVAL_SECONDS = 5
+
+# Clearly negative results are predicted by rule_classifier.py without running the
+# model: when the recent creatinine results are all below RULE_NEGATIVE_MAX_VALUE
+# and the highest is at most RULE_NEGATIVE_MAX_RATIO times the lowest. RULE_FAST_PATH=0
+# sends every result to the model. Check the agreement with the model with
+# benchmarks/rule_fast_path.py after changing the thresholds or the model.
+RULE_FAST_PATH = os.environ.get('RULE_FAST_PATH', '1') != '0'
+RULE_NEGATIVE_MAX_RATIO = float(os.environ.get('RULE_NEGATIVE_MAX_RATIO', 1.3))
+RULE_NEGATIVE_MAX_VALUE = float(os.environ.get('RULE_NEGATIVE_MAX_VALUE', 130))
 
 # Details for the message listener (e.g., IP and port for HL7 messages)
 if os.environ.get('MLLP_ADDRESS') is None:
@@ -16,6 +57,29 @@ if os.environ.get('MLLP_ADDRESS') is None:
 else:
     MLLP_ADDRESS, MLLP_PORT = os.environ.get('MLLP_ADDRESS').split(":")
     MLLP_PORT = int(MLLP_PORT)
+
+# All the MLLP endpoints, as a comma separated list of host:port in MLLP_ENDPOINTS,
+# e.g. "lab:8440,adt:8440". The asyncio engine handles every one of them at once,
+# either connecting to each (MLLP_MODE=client) or listening on each (MLLP_MODE=server).
+if os.environ.get('MLLP_ENDPOINTS') is None:
+    MLLP_ENDPOINTS = [(MLLP_ADDRESS, MLLP_PORT)]
+else:
+    MLLP_ENDPOINTS = [(host, int(port)) for host, port in
+                      (endpoint.strip().rsplit(":", 1) for endpoint in os.environ.get('MLLP_ENDPOINTS').split(","))]
+MLLP_MODE = os.environ.get('MLLP_MODE', 'client')
+
+# MLLP frames larger than MLLP_MAX_FRAME_BYTES, without framing bytes, are dropped
+# as they are received and rejected with an AE ACK, so a peer which never ends a
+# frame cannot make the listener buffer it without limit.
+MLLP_MAX_FRAME_BYTES = int(os.environ.get('MLLP_MAX_FRAME_BYTES', 1048576))
+
+# The asyncio engine stops reading a feed when it has more than the high watermark
+# of messages received and not acknowledged, or of bytes received and not yet
+# parsed, and reads it again once both are back down to the low watermarks.
+LISTENER_HIGH_WATERMARK_MESSAGES = int(os.environ.get('LISTENER_HIGH_WATERMARK_MESSAGES', 1000))
+LISTENER_LOW_WATERMARK_MESSAGES = int(os.environ.get('LISTENER_LOW_WATERMARK_MESSAGES', 500))
+LISTENER_HIGH_WATERMARK_BYTES = int(os.environ.get('LISTENER_HIGH_WATERMARK_BYTES', 16777216))
+LISTENER_LOW_WATERMARK_BYTES = int(os.environ.get('LISTENER_LOW_WATERMARK_BYTES', 8388608))
     
 if os.environ.get('PAGER_ADDRESS') is None:
     PAGER_ADDRESS = "localhost"
@@ -24,5 +88,40 @@ else:
     PAGER_ADDRESS, PAGER_PORT = os.environ.get('PAGER_ADDRESS').split(":")
     PAGER_PORT = int(PAGER_PORT)
 
+# Pages waiting for delivery are kept here, so that they survive a restart
+PAGER_OUTBOX_PATH = os.environ.get('PAGER_OUTBOX_PATH', '/state/pager_outbox')
+PAGER_NUM_WORKERS = 4
+PAGER_TIMEOUT_SECONDS = 1
+
+
+PROMETHEUS_PORT = int(os.environ.get('PROMETHEUS_PORT', 8000))
+
+# On-demand profiling (profiler.py), served on PROMETHEUS_PORT at /profile, or
+# started with SIGUSR1, which writes the stacks to a file in PROFILE_OUTPUT_PATH.
+# Sessions sample the stacks of every thread every PROFILE_SAMPLE_INTERVAL_MS
+# milliseconds for PROFILE_DEFAULT_SECONDS, or as asked up to PROFILE_MAX_SECONDS.
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+PROFILE_SAMPLE_INTERVAL_MS = 5
+PROFILE_OUTPUT_PATH = os.environ.get('PROFILE_OUTPUT_PATH', '/state/profiles')
+
+# The time spent by every message in each stage of the listener is exported as
+# message_stage_duration_seconds (stage_timing.py). Messages acknowledged more than
+# SLOW_MESSAGE_BUDGET_MS after they were read are counted, and the stages of one of
+# them are printed at most every SLOW_MESSAGE_LOG_INTERVAL_SECONDS.
+SLOW_MESSAGE_BUDGET_MS = float(os.environ.get('SLOW_MESSAGE_BUDGET_MS', 100))
+SLOW_MESSAGE_LOG_INTERVAL_SECONDS = 1
+
+# Settings for the asyncio engine of the message listener
+# Maximum number of items waiting between two stages of the pipeline
+ASYNC_QUEUE_SIZE = 100
+# Maximum number of queued test results predicted with a single call to the model
+ASYNC_PREDICTION_BATCH_SIZE = 32
 
-PROMETHEUS_PORT = 8000
\ No newline at end of file
+# Settings for the sharded listener (sharded_listener.py)
+# Number of worker processes, each one owning the patients whose MRN hashes to it
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', 4))
+# Maximum number of messages routed to the workers and not yet acknowledged; once
+# reached, the feed is read again when no more than SHARD_RESUME_IN_FLIGHT are left
+SHARD_MAX_IN_FLIGHT = 1000
+SHARD_RESUME_IN_FLIGHT = 500
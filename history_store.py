@@ -0,0 +1,492 @@
+from collections.abc import MutableMapping
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Bytes of history.csv tokenized at a time
+CHUNK_BYTES = 4 * 2**20
+
+# The history cache starts with the magic bytes and the length of a JSON header
+# describing the source history.csv and the position of each column; the columns
+# follow, each aligned so that they can be used in place from a memory map.
+CACHE_MAGIC = b"AKIHIST"
+CACHE_VERSION = 1
+CACHE_ALIGNMENT = 64
+CACHE_HEADER_BYTES = 4096
+CACHE_SUFFIX = '.cache'
+
+COMMA, NEWLINE, CARRIAGE_RETURN = (ord(character) for character in ',\n\r')
+
+def _characters(data: np.ndarray, starts: np.ndarray, width: int) -> np.ndarray:
+    """
+    Returns the width bytes from each of starts as the rows of a matrix. data must
+    be followed by at least width padding bytes.
+    """
+    return sliding_window_view(data, width)[starts]
+
+def _gather(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Copies the fields at starts, of the given lengths, into a fixed-width bytes array.
+    """
+    width = max(int(lengths.max()), 1) if len(lengths) else 1
+    characters = _characters(data, starts, width)
+    characters[np.arange(width) >= lengths[:, None]] = 0
+    return characters.view(f'S{width}').ravel()
+
+def _parse_decimals(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Parses the fields at starts as floats.
+
+    Plain decimals such as 68.58 with at most 15 digits are parsed into an integer
+    and divided by a power of ten, which rounds exactly like float(). Any other
+    field is left to NumPy's string conversion.
+    """
+    width = int(lengths.max()) if len(lengths) else 0
+    characters = _characters(data, starts, max(width, 1))
+    numbers = characters - np.uint8(ord('0'))
+    mantissa = np.zeros(len(starts), dtype=np.int64)
+    digits = np.zeros(len(starts), dtype=np.int64)
+    fraction_digits = np.zeros(len(starts), dtype=np.int64)
+    dots = np.zeros(len(starts), dtype=np.int64)
+    plain = lengths > 0
+    for column in range(width):
+        inside = column < lengths
+        character = numbers[:, column]
+        is_digit = inside & (character <= 9)
+        is_dot = inside & (characters[:, column] == ord('.'))
+        plain &= ~inside | is_digit | is_dot
+        mantissa *= np.where(is_digit, 10, 1)
+        mantissa += np.where(is_digit, character, 0)
+        digits += is_digit
+        fraction_digits += is_digit & (dots > 0)
+        dots += is_dot
+    plain &= (dots <= 1) & (digits > 0) & (digits <= 15)
+    values = mantissa / 10.0 ** fraction_digits
+    other = np.flatnonzero(~plain)
+    if len(other):
+        values[other] = _gather(data, starts[other], lengths[other]).astype(np.float64)
+    return values
+
+# Layout of the 'YYYY-MM-DD HH:MM:SS' dates of history.csv
+DATE_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]
+DATE_SEPARATORS = {4: b'-', 7: b'-', 10: b' T', 13: b':', 16: b':'}
+
+def _parse_datetimes(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Parses the fields at starts as datetimes.
+
+    Fields in the 'YYYY-MM-DD HH:MM:SS' format of history.csv are converted from
+    their digits directly; any other field is left to NumPy's string conversion.
+    """
+    characters = _characters(data, starts, 19)
+    regular = lengths == 19
+    for column, separators in DATE_SEPARATORS.items():
+        regular &= np.isin(characters[:, column], list(separators))
+    digits = (characters[:, DATE_DIGITS] - np.uint8(ord('0'))).astype(np.int32)
+    regular &= (digits <= 9).all(axis=1)
+    def number(first, count):
+        value = digits[:, first]
+        for column in range(first + 1, first + count):
+            value = value * 10 + digits[:, column]
+        return value
+    year, month, day = number(0, 4), number(4, 2), number(6, 2)
+    seconds = number(8, 2) * 3600 + number(10, 2) * 60 + number(12, 2)
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dates = (months.astype('datetime64[D]') + (day - 1)).astype('datetime64[s]')
+    dates += seconds.astype('timedelta64[s]')
+    other = np.flatnonzero(~regular)
+    if len(other):
+        dates[other] = _gather(data, starts[other], lengths[other]).astype('datetime64[s]')
+    return dates
+
+def _parse_lines(lines: bytes) -> tuple:
+    """
+    Tokenizes whole lines of history.csv.
+
+    Returns:
+        tuple: The MRN of each row as bytes, the number of results of each row, and
+        the results and their dates in row order.
+    """
+    if b'"' in lines:
+        return _parse_quoted_lines(lines)
+    # Padded, so that fixed-width windows starting at any field stay inside the buffer
+    data = np.frombuffer(lines + bytes(32), dtype=np.uint8)
+    ends = np.flatnonzero((data == COMMA) | (data == NEWLINE))
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+    row_ends = data[ends] == NEWLINE
+    lengths[row_ends & (lengths > 0) & (data[ends - 1] == CARRIAGE_RETURN)] -= 1
+    
+    # The row of each field, and its column within the row
+    first_fields = np.flatnonzero(np.concatenate(([True], row_ends[:-1])))
+    rows = np.cumsum(row_ends) - row_ends
+    columns = np.arange(len(ends)) - first_fields[rows]
+    
+    mrn_fields = first_fields
+    result_fields = np.flatnonzero((columns >= 2) & (columns % 2 == 0) & (lengths > 0))
+    mrns = _gather(data, starts[mrn_fields], lengths[mrn_fields])
+    counts = np.bincount(rows[result_fields], minlength=len(first_fields))
+    values = _parse_decimals(data, starts[result_fields], lengths[result_fields])
+    dates = _parse_datetimes(data, starts[result_fields - 1], lengths[result_fields - 1])
+    return mrns, counts, values, dates
+
+def _parse_quoted_lines(lines: bytes) -> tuple:
+    """
+    Tokenizes whole lines of history.csv with csv.reader, for files with quoted fields.
+    """
+    mrns, counts, values, dates = [], [], [], []
+    for row in csv.reader(io.StringIO(lines.decode())):
+        mrns.append(row[0].encode())
+        results = [col for col in range(2, len(row), 2) if row[col] != ""]
+        counts.append(len(results))
+        values.extend(float(row[col]) for col in results)
+        dates.extend(row[col - 1] or 'NaT' for col in results)
+    return (np.array(mrns, dtype=bytes), np.array(counts, dtype=np.int64),
+            np.array(values, dtype=np.float64), np.array(dates, dtype='datetime64[s]'))
+
+class HistoryStore(MutableMapping):
+    """
+    Columnar store of the creatinine results history of every patient.
+
+    The results loaded from history.csv are kept in a CSR-style layout: the
+    results of all patients in one float array, the times they were taken in a
+    parallel datetime64 array, and per-patient offsets into both. Patients are
+    found by binary search in a sorted copy of the MRNs. The columns are either
+    held in memory or memory-mapped from a history cache file, and can be loaded
+    lazily on first use.
+
+    The store behaves as a dictionary from MRN to the list of results of the
+    patient; results written after loading, e.g. when a patient is discharged,
+    are kept in a small dictionary which takes precedence.
+    """
+    def __init__(self,
+                 mrns: np.ndarray = None,
+                 offsets: np.ndarray = None,
+                 values: np.ndarray = None,
+                 dates: np.ndarray = None,
+                 loader = None) -> None:
+        """
+        Initializes the store from its columns; with no arguments the store is empty.
+
+        Args:
+            mrns (np.ndarray): The MRN of each row, as bytes.
+            offsets (np.ndarray): Start of each row in values and dates, followed by the total.
+            values (np.ndarray): The creatinine results of every row, as float64.
+            dates (np.ndarray): The time each result was taken, as datetime64.
+            loader: Called without arguments on first use to load the columns instead,
+                    returning a HistoryStore whose columns are taken over.
+        """
+        self._loader = loader
+        if loader is None:
+            self._set_columns(mrns, offsets, values, dates)
+        # MRN -> sequence of results written after loading, or None once deleted
+        self.updates = dict()
+
+    def _set_columns(self, mrns, offsets, values, dates, sorted_mrns=None, order=None, buffer=None):
+        self._mrns = np.array([], dtype='S1') if mrns is None else mrns
+        self._offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        self._values = np.array([], dtype=np.float64) if values is None else values
+        self._dates = np.array([], dtype='datetime64[s]') if dates is None else dates
+        if sorted_mrns is None:
+            order = np.argsort(self._mrns, kind='stable')
+            sorted_mrns = self._mrns[order]
+        self._sorted_mrns = sorted_mrns
+        self._order = order
+        # The memory map backing the columns, if any
+        self._buffer = buffer
+        # Rows whose MRN appears again further down; as in a dictionary, the last one wins
+        self._unique = np.ones(len(sorted_mrns), dtype=bool)
+        self._unique[:-1] = sorted_mrns[:-1] != sorted_mrns[1:]
+        self._unique_count = int(self._unique.sum())
+
+    def _load(self):
+        if self._loader is not None:
+            loaded, self._loader = self._loader(), None
+            self._set_columns(loaded._mrns, loaded._offsets, loaded._values, loaded._dates,
+                              loaded._sorted_mrns, loaded._order, loaded._buffer)
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Whether the columns have been loaded.
+        """
+        return self._loader is None
+
+    @property
+    def values(self) -> np.ndarray:
+        self._load()
+        return self._values
+
+    @property
+    def dates(self) -> np.ndarray:
+        self._load()
+        return self._dates
+
+    @property
+    def offsets(self) -> np.ndarray:
+        self._load()
+        return self._offsets
+
+    @classmethod
+    def open(cls, history_csv_path: str, cache_path: str = None) -> "HistoryStore":
+        """
+        Returns a store of history.csv which is loaded on first use.
+
+        The columns are memory-mapped from the history cache when it matches
+        history.csv. Otherwise history.csv is parsed and the cache is rebuilt for the
+        next start; if it cannot be written, the parsed columns are used as they are.
+
+        Args:
+            history_csv_path (str): The history.csv file.
+            cache_path (str): The history cache; by default next to history.csv.
+        """
+        if cache_path is None:
+            cache_path = history_csv_path + CACHE_SUFFIX
+        return cls(loader=lambda: load_or_build_cache(history_csv_path, cache_path))
+
+    @classmethod
+    def from_csv(cls, history_csv_path: str, chunk_bytes: int = CHUNK_BYTES) -> "HistoryStore":
+        """
+        Loads a history.csv file, whose rows hold a MRN followed by pairs of date and
+        result columns.
+
+        The file is tokenized with NumPy a chunk of whole lines at a time: the
+        delimiters are located in bulk, the fields are gathered into fixed-width
+        byte arrays and converted to floats and datetimes by NumPy casts, so no
+        Python object is created per result.
+        """
+        mrns, counts, values, dates = [], [], [], []
+        with open(history_csv_path, 'rb') as file:
+            file.readline()  # Skip the header row
+            remainder = b''
+            while True:
+                block = file.read(chunk_bytes)
+                data = remainder + block
+                if not block:
+                    if data and not data.endswith(b'\n'):
+                        data += b'\n'
+                    remainder = b''
+                else:
+                    cut = data.rfind(b'\n') + 1
+                    data, remainder = data[:cut], data[cut:]
+                if data:
+                    for column, chunk in zip((mrns, counts, values, dates), _parse_lines(data)):
+                        column.append(chunk)
+                if not block:
+                    break
+        if not mrns:
+            return cls()
+        offsets = np.zeros(sum(len(chunk) for chunk in counts) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(counts), out=offsets[1:])
+        # Each column is joined and its chunks released before the next, to limit the peak memory
+        columns = [mrns, values, dates]
+        for position, chunks in enumerate(columns):
+            columns[position] = np.concatenate(chunks)
+            chunks.clear()
+        mrns, values, dates = columns
+        return cls(mrns=mrns, offsets=offsets, values=values, dates=dates)
+
+    @classmethod
+    def from_cache(cls, cache_path: str) -> "HistoryStore":
+        """
+        Opens a history cache, memory-mapping its columns read-only.
+        """
+        header, buffer = _map_cache(cache_path)
+        columns = {name: np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+                   for name, (dtype, count, offset) in header['columns'].items()}
+        store = cls()
+        store._set_columns(columns['mrns'], columns['offsets'], columns['values'],
+                           columns['dates'].view('datetime64[s]'), columns['sorted_mrns'],
+                           columns['order'], buffer)
+        return store
+
+    def save_cache(self, cache_path: str, source: dict) -> None:
+        """
+        Writes the loaded columns to a history cache, through a temporary file renamed
+        into place.
+
+        Args:
+            cache_path (str): Where to write the cache.
+            source (dict): The size, mtime and hash of the history.csv the columns were
+                           loaded from, used to validate the cache.
+        """
+        self._load()
+        arrays = {'mrns': self._mrns, 'offsets': self._offsets, 'values': self._values,
+                  'dates': self._dates.view(np.int64), 'sorted_mrns': self._sorted_mrns,
+                  'order': self._order}
+        columns, offset = dict(), CACHE_HEADER_BYTES
+        for name, array in arrays.items():
+            columns[name] = (array.dtype.str, len(array), offset)
+            offset += -(-array.nbytes // CACHE_ALIGNMENT) * CACHE_ALIGNMENT
+        header = json.dumps({'version': CACHE_VERSION, 'source': source, 'columns': columns}).encode()
+        header = CACHE_MAGIC + struct.pack('<I', len(header)) + header
+        if len(header) > CACHE_HEADER_BYTES:
+            raise ValueError("History cache header too large")
+        
+        temporary_path = cache_path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(header)
+            for name, array in arrays.items():
+                file.seek(columns[name][2])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(offset)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, cache_path)
+
+    def _row(self, mrn: str) -> int:
+        """
+        Returns the row of a patient in the columns, or -1 if there is none.
+        """
+        self._load()
+        key = mrn.encode()
+        position = int(np.searchsorted(self._sorted_mrns, key, side='right')) - 1
+        if position >= 0 and self._sorted_mrns[position] == key:
+            return int(self._order[position])
+        return -1
+
+    def results(self, mrn: str) -> np.ndarray:
+        """
+        Returns the results loaded for a patient from history.csv, as a view of the values array.
+        """
+        row = self._row(mrn)
+        if row < 0:
+            raise KeyError(mrn)
+        return self._values[self._offsets[row]:self._offsets[row + 1]]
+
+    def result_dates(self, mrn: str) -> np.ndarray:
+        """
+        Returns the times of the results loaded for a patient from history.csv.
+        """
+        row = self._row(mrn)
+        if row < 0:
+            raise KeyError(mrn)
+        return self._dates[self._offsets[row]:self._offsets[row + 1]]
+
+    def __getitem__(self, mrn: str) -> list:
+        if mrn in self.updates:
+            results = self.updates[mrn]
+            if results is None:
+                raise KeyError(mrn)
+            return list(results)
+        return self.results(mrn).tolist()
+
+    def __setitem__(self, mrn: str, results) -> None:
+        self.updates[mrn] = results
+
+    def __delitem__(self, mrn: str) -> None:
+        if mrn not in self:
+            raise KeyError(mrn)
+        self.updates[mrn] = None
+
+    def __contains__(self, mrn: object) -> bool:
+        if mrn in self.updates:
+            return self.updates[mrn] is not None
+        return isinstance(mrn, str) and self._row(mrn) >= 0
+
+    def _loaded_mrns(self):
+        self._load()
+        for key in self._sorted_mrns[self._unique].tolist():
+            yield key.decode()
+
+    def __iter__(self):
+        for mrn in self._loaded_mrns():
+            if self.updates.get(mrn, ()) is not None:
+                yield mrn
+        for mrn, results in self.updates.items():
+            if results is not None and self._row(mrn) < 0:
+                yield mrn
+
+    def __len__(self) -> int:
+        self._load()
+        length = self._unique_count
+        for mrn, results in self.updates.items():
+            if self._row(mrn) >= 0:
+                length -= results is None
+            else:
+                length += results is not None
+        return length
+
+    def clear(self) -> None:
+        self.__init__()
+
+def _map_cache(cache_path: str) -> tuple:
+    """
+    Memory-maps a history cache and returns its header and the map.
+    """
+    with open(cache_path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+        buffer.close()
+        raise ValueError(f"{cache_path}: not a history cache")
+    (length,) = struct.unpack_from('<I', buffer, len(CACHE_MAGIC))
+    start = len(CACHE_MAGIC) + 4
+    header = json.loads(buffer[start:start + length])
+    if header.get('version') != CACHE_VERSION:
+        buffer.close()
+        raise ValueError(f"{cache_path}: unsupported history cache version {header.get('version')}")
+    return header, buffer
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_is_valid(history_csv_path: str, cache_path: str) -> bool:
+    """
+    Checks that a history cache was built from the current history.csv: the size
+    must match, and either the mtime or, when only the mtime differs (e.g. after a
+    copy), the SHA-256 of the contents.
+    """
+    try:
+        header, buffer = _map_cache(cache_path)
+    except (OSError, ValueError):
+        return False
+    buffer.close()
+    status = os.stat(history_csv_path)
+    source = header['source']
+    if source['size'] != status.st_size:
+        return False
+    return source['mtime_ns'] == status.st_mtime_ns or source['sha256'] == _file_hash(history_csv_path)
+
+def load_or_build_cache(history_csv_path: str, cache_path: str) -> HistoryStore:
+    """
+    Memory-maps the history cache if it matches history.csv; otherwise parses
+    history.csv and tries to write the cache for the next start.
+    """
+    if cache_is_valid(history_csv_path, cache_path):
+        return HistoryStore.from_cache(cache_path)
+    status = os.stat(history_csv_path)
+    store = HistoryStore.from_csv(history_csv_path)
+    source = {'size': status.st_size, 'mtime_ns': status.st_mtime_ns, 'sha256': _file_hash(history_csv_path)}
+    try:
+        store.save_cache(cache_path, source)
+    except OSError as e:
+        print(f"Could not write the history cache {cache_path}: {e}")
+    return store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the memory-mapped cache of a history.csv file')
+    parser.add_argument('history_csv_path', type=str, help='Path of history.csv')
+    parser.add_argument('--cache', type=str, default=None, help='Path of the cache; by default next to history.csv')
+    args = parser.parse_args()
+
+    cache_path = args.cache or args.history_csv_path + CACHE_SUFFIX
+    if cache_is_valid(args.history_csv_path, cache_path):
+        print(f"{cache_path} is up to date")
+    else:
+        store = load_or_build_cache(args.history_csv_path, cache_path)
+        print(f"Wrote {cache_path} for {len(store)} patients")
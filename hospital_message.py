@@ -60,8 +60,25 @@ class TestResultMessage():
         self.creatinine_value = creatinine_value
         self.timestamp = test_date[0:4] + test_date[5:7] + test_date[8:10] + test_time[0:2] + test_time[3:5] + test_time[6:8]
  
+class PositiveAKIPredictionMessage():
+    """
+    Records that a positive AKI prediction was made for a patient. It is written to
+    the message log so that recovery restores the prediction without the model.
+    """
+    def __init__(self, mrn: str) -> None:
+        """
+        Initializes a positive AKI prediction message.
+
+        Args:
+            mrn (str): The medical record number of the patient.
+
+        Returns:
+            None
+        """
+        self.mrn = mrn
+ 
 # Example usage
 if __name__ == "__main__":
     admission_msg = PatientAdmissionMessage(mrn='123', name='John Doe', date_of_birth='1980-01-01', sex='M')   
     discharge_msg = PatientDischargeMessage(mrn='123')
-    test_result_msg = TestResultMessage(mrn='123', test_date='2021-01-01', test_time='08:00', creatinine_value=1.2)
\ No newline at end of file
+    test_result_msg = TestResultMessage(mrn='123', test_date='2021-01-01', test_time='08:00', creatinine_value=1.2)
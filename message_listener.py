@@ -1,29 +1,28 @@
+import asyncio
+import functools
 import socket
 import time
 import threading
 import sys
 import signal
 import os
-import pandas as pd
 import datetime
-import time
 import argparse
 
-from prometheus_client import Gauge, Counter, Histogram, start_http_server
+from prometheus_client import Gauge, Counter, Histogram
 
-from config import MLLP_PORT, MLLP_ADDRESS, PROMETHEUS_PORT, MESSAGE_LOG_CSV_PATH, HISTORY_CSV_PATH
+from config import MLLP_PORT, MLLP_ADDRESS, MLLP_ENDPOINTS, MLLP_MODE, PROMETHEUS_PORT, MESSAGE_LOG_CSV_PATH, MESSAGE_LOG_BINARY_PATH, MESSAGE_LOG_FORMAT, HISTORY_CSV_PATH, HISTORY_CACHE_PATH, ASYNC_QUEUE_SIZE, ASYNC_PREDICTION_BATCH_SIZE, LISTENER_HIGH_WATERMARK_MESSAGES, LISTENER_LOW_WATERMARK_MESSAGES, LISTENER_HIGH_WATERMARK_BYTES, LISTENER_LOW_WATERMARK_BYTES
 
-from storage_manager import StorageManager
-from message_parser import parse_message
+from storage_manager import StorageManager, convert_message_log_to_binary
+from message_parser import parse_frame
 from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
 from alert_manager import AlertManager
+import profiler
+from stage_timing import MESSAGE_TYPES, MessageTiming, observe_stage
+from mllp import MLLPFramer, OVERSIZED_FRAME, MLLP_START_OF_BLOCK, MLLP_END_OF_BLOCK, MLLP_CARRIAGE_RETURN
 
 from storage_manager import p_sum_of_all_messages, p_sum_of_positive_aki_predictions
 
-MLLP_START_OF_BLOCK = 0x0b
-MLLP_END_OF_BLOCK = 0x1c
-MLLP_CARRIAGE_RETURN = 0x0d
-
 #General message metrics
 p_overall_messages_received = Gauge("overall_messages_received", "Number of overall messages received")
 p_overall_messages_acknowledged = Counter("overall_messages_acknowledged", "Number of overall messages received")
@@ -37,6 +36,7 @@ p_successful_discharge_message_handlings = Counter("successful_discharge_message
 
 p_test_result_messages = Counter("test_result_messages_received", "Number of test result messages received")
 p_successful_test_result_handlings = Counter("test_result_successful_handled", "Number of cases where the test result was not added to the storage manager due to not having the patient in the current patients list")
+p_duplicate_test_results = Counter("duplicate_test_results", "Number of test results received again and not applied a second time")
 
 #Predictions and pagings
 p_positive_aki_predictions = Counter("positive_aki_predictions", "Number of positive aki predictions")
@@ -55,81 +55,313 @@ p_message_latency = Histogram('message_latency', 'Time to process message', buck
 p_connection_closed_error = Counter("connection_closed_error", "Number of times socket connection closed")
 p_number_of_connection_attempts = Counter("number_of_connection_attempts", "Number of times socket connection was attempted")
 
+#Framing metrics
+p_frames_per_read = Histogram('frames_per_read', 'Number of complete MLLP frames drained from a single socket read', buckets=[0, 1, 2, 3, 4, 5, 10, 20, 50, 100])
+p_oversized_frames = Counter("oversized_frames", "Number of MLLP frames over MLLP_MAX_FRAME_BYTES rejected with an AE ACK")
+
+#Per feed metrics, labelled with the address of the connection
+p_feed_messages_received = Counter("feed_messages_received", "Number of messages received from a feed", ["feed"])
+p_feed_messages_acknowledged = Counter("feed_messages_acknowledged", "Number of messages acknowledged to a feed", ["feed"])
+p_feed_backlog = Gauge("feed_backlog", "Number of messages received from a feed and not yet acknowledged", ["feed"])
+p_feed_lag = Gauge("feed_lag_seconds", "Time between receiving and acknowledging the last acknowledged message of a feed", ["feed"])
+p_feed_buffered_bytes = Gauge("feed_buffered_bytes", "Number of bytes received from a feed and not yet parsed", ["feed"])
+p_feed_paused = Gauge("feed_paused", "1 while a feed is not read because too much of it is waiting", ["feed"])
+
+#Queue metrics of the asyncio engine
+p_queue_depth = Gauge("listener_queue_depth", "Number of items waiting in a queue of the asyncio listener", ["queue"])
+
 #Badly handled messages
 p_message_errors = Counter("message_errors", "Number of times a message was badly handled")
 
-start_http_server(PROMETHEUS_PORT)
-
 global stopping_condition
 stopping_condition = False
 
-def shutdown():
+def shutdown(*args):
     global stopping_condition
     stopping_condition = True
     print("graceful shutdown")
     sys.exit(0)
-    
-signal.signal(signal.SIGTERM, shutdown)
-
-def parse_mllp_messages(buffer, source):
-    i = 0
-    messages = []
-    consumed = 0
-    expect = MLLP_START_OF_BLOCK
-    while i < len(buffer):
-        if expect is not None:
-            if buffer[i] != expect:
-                raise Exception(f"{source}: bad MLLP encoding: want {hex(expect)}, found {hex(buffer[i])}")
-            if expect == MLLP_START_OF_BLOCK:
-                expect = None
-                consumed = i
-            elif expect == MLLP_CARRIAGE_RETURN:
-                messages.append(buffer[consumed+1:i-1])
-                expect = MLLP_START_OF_BLOCK
-                consumed = i + 1
-        else:
-            if buffer[i] == MLLP_END_OF_BLOCK:
-                expect = MLLP_CARRIAGE_RETURN
-        i += 1
-    return messages, buffer[consumed:]
 
-def initialise_system(message_log_filepath : str = MESSAGE_LOG_CSV_PATH):
+def default_message_log_path() -> str:
+    """
+    Returns the path of the message log in the configured MESSAGE_LOG_FORMAT. When the
+    binary format is configured but only a CSV log exists, the CSV log is converted
+    with its snapshot and segments.
+    """
+    if MESSAGE_LOG_FORMAT != 'binary':
+        return MESSAGE_LOG_CSV_PATH
+    count = convert_message_log_to_binary(MESSAGE_LOG_CSV_PATH, MESSAGE_LOG_BINARY_PATH)
+    if count is not None:
+        print(f"Converted {count} messages from {MESSAGE_LOG_CSV_PATH} to {MESSAGE_LOG_BINARY_PATH}")
+    return MESSAGE_LOG_BINARY_PATH
+
+def initialise_system(message_log_filepath : str = None):
     """
     Initialises the environment for the aki prediction system.
     
     This function creates the necessary objects for the system to work, namely the storage manager and the alert manager, 
-    It also loads past data to make the system up to date.
+    It also loads past data to make the system up to date. The model is loaded in
+    the background meanwhile, and while the socket connects; the first prediction
+    waits for it.
     
     Args:
-        message_log_filepath (str): The path to the message log file.
+        message_log_filepath (str): The path to the message log file. Defaults to the log
+            in the configured MESSAGE_LOG_FORMAT.
         
     Returns:
         storage_manager (StorageManager): The storage manager object.
         alert_manager (AlertManager): The alert manager object.
     """
-    storage_manager = StorageManager(message_log_filepath = message_log_filepath)
+    if message_log_filepath is None:
+        message_log_filepath = default_message_log_path()
+    storage_manager = StorageManager(message_log_filepath = message_log_filepath, history_cache_path = HISTORY_CACHE_PATH,
+                                     load_model_in_background = True)
     alert_manager = AlertManager()
+    alert_manager.start()
     storage_manager.initialise_database(history_csv_path=HISTORY_CSV_PATH)
     
     return storage_manager, alert_manager
 
 def to_mllp(segments: list):
-    MLLP_START_OF_BLOCK = 0x0b
-    MLLP_END_OF_BLOCK = 0x1c
-    MLLP_CARRIAGE_RETURN = 0x0d
     m = bytes(chr(MLLP_START_OF_BLOCK), "ascii")
     m += bytes("\r".join(segments) + "\r", "ascii")
     m += bytes(chr(MLLP_END_OF_BLOCK) + chr(MLLP_CARRIAGE_RETURN), "ascii")
     return m
 
-def from_mllp(buffer):
-    return str(buffer[:-1], "ascii").split("\r") # Strip MLLP framing and final \r
-
-def send_ack(s: socket.socket):
+def build_ack(code: str = "AA") -> bytes:
+    """
+    Builds an ACK with the given acknowledgment code: AA to accept the message,
+    AE to reject it.
+    """
     ack_raw = [f"MSH|^~\&|||||{datetime.datetime.now().strftime('%Y%M%D%H%M%S')}||ACK|||2.5",
-                    "MSA|AA",]
-    ack = to_mllp(ack_raw)
-    s.sendall(ack)
+                    f"MSA|{code}",]
+    return to_mllp(ack_raw)
+
+def send_ack(s: socket.socket, code: str = "AA"):
+    s.sendall(build_ack(code))
+
+def apply_message(storage_manager: StorageManager, message_object: object) -> bool:
+    """
+    Applies a single parsed HL7 message to the in-memory patient state.
+
+    Args:
+        storage_manager (StorageManager): The storage manager object.
+        message_object (object): The parsed HL7 message.
+
+    Returns:
+        bool: False if the message is a test result already applied, which a peer
+              sends again when it was not acknowledged, and True otherwise.
+
+    Raises:
+        ValueError: If the message cannot be applied to the current state.
+    """
+    if isinstance(message_object, PatientAdmissionMessage):
+        p_admission_messages.inc()
+        storage_manager.add_admitted_patient_to_current_patients(message_object)
+        p_successful_admission_message_handlings.inc()
+        
+    elif isinstance(message_object, TestResultMessage):
+        p_test_result_messages.inc()
+        if not storage_manager.add_test_result_to_current_patients(message_object):
+            p_duplicate_test_results.inc()
+            return False
+        p_successful_test_result_handlings.inc()
+                    
+    elif isinstance(message_object, PatientDischargeMessage):
+        p_discharge_messages.inc()
+        storage_manager.remove_patient_from_current_patients(message_object)
+        p_successful_discharge_message_handlings.inc()
+    return True
+
+def record_prediction(prediction_result: int) -> None:
+    """
+    Updates the prediction metrics for a single AKI prediction.
+    """
+    if prediction_result == 1:
+        p_positive_aki_predictions.inc()
+        p_sum_of_positive_aki_predictions.inc()
+    elif prediction_result == 0:
+        p_negative_aki_predictions.inc()
+
+def page_positive_prediction(alert_manager: AlertManager, mrn: str, timestamp: str, time_message_received: float) -> None:
+    """
+    Queues a page to the hospital staff for a positive AKI prediction. The page is
+    delivered in the background, and the paging metrics are recorded once it has been.
+    """
+    def on_done(delivered: bool) -> None:
+        if delivered:
+            p_paging_latency.observe(time.time() - time_message_received)
+        else:
+            p_failed_pagings.inc()
+
+    alert_manager.enqueue_alert(mrn, timestamp, on_done)
+    p_number_of_pagings.inc()
+
+def predict_pending(storage_manager: StorageManager,
+                    alert_manager: AlertManager,
+                    pending: dict,
+                    time_message_received: float,
+                    timings: dict = None) -> None:
+    """
+    Predicts AKI for a batch of test results with a single call to the model and
+    pages the hospital staff for every positive prediction.
+
+    Args:
+        storage_manager (StorageManager): The storage manager object.
+        alert_manager (AlertManager): The alert manager object.
+        pending (dict): Maps each MRN to the test result awaiting a prediction. It
+                        is emptied once the predictions have been handled.
+        time_message_received (float): The time at which the messages were read from the socket.
+        timings (dict): Maps the MRNs of pending to the MessageTiming of their test
+                        result, if measured; the time to predict the batch and to
+                        queue the pages is added to each one, and it is emptied too.
+    """
+    if not pending:
+        return
+    start = time.perf_counter_ns()
+    mrns = list(pending)
+    predictions = storage_manager.predict_aki_batch(mrns)
+    predicted = time.perf_counter_ns()
+    for mrn, prediction_result in zip(mrns, predictions):
+        record_prediction(prediction_result)
+        if prediction_result == 1:
+            page_positive_prediction(alert_manager, mrn, pending[mrn].timestamp, time_message_received)
+            storage_manager.record_positive_aki_prediction(mrn)
+    pending.clear()
+    if timings:
+        paged = time.perf_counter_ns()
+        for timing in timings.values():
+            timing.add("predict", predicted - start)
+            timing.add("page", paged - predicted)
+        timings.clear()
+
+def handle_message(storage_manager: StorageManager,
+                   alert_manager: AlertManager,
+                   message_object: object,
+                   pending: dict,
+                   time_message_received: float,
+                   timing: MessageTiming = None,
+                   timings: dict = None) -> None:
+    """
+    Applies a parsed message to the state and appends it to the message log. A
+    test result needing a prediction is added to pending; the predictions already
+    pending are made first if the message concerns one of their patients.
+
+    When timing, the MessageTiming of the message, is given, the time taken to
+    apply and log it is added to it, and a test result added to pending has its
+    timing added to timings, as taken by predict_pending.
+
+    Raises:
+        ValueError: If the message cannot be applied to the current state.
+    """
+    if message_object.mrn in pending:
+        predict_pending(storage_manager, alert_manager, pending, time_message_received, timings)
+    start = time.perf_counter_ns()
+    if not apply_message(storage_manager, message_object):
+        return
+    if isinstance(message_object, TestResultMessage) and storage_manager.no_positive_aki_prediction_so_far(message_object.mrn):
+        pending[message_object.mrn] = message_object
+        if timing is not None and timings is not None:
+            timings[message_object.mrn] = timing
+    applied = time.perf_counter_ns()
+    storage_manager.add_message_to_log_csv(message_object)
+    p_messages_added_to_log.inc()
+    if timing is not None:
+        timing.add("apply", applied - start)
+        timing.add("log", time.perf_counter_ns() - applied)
+
+def acknowledge_frames(s: socket.socket,
+                       frames: list,
+                       timings: list,
+                       storage_manager: StorageManager,
+                       time_message_received: float) -> None:
+    """
+    Commits the message log and acknowledges handled frames in order, the
+    oversized ones with an AE ACK.
+    """
+    start = time.perf_counter_ns()
+    storage_manager.commit_message_log()
+    committed = time.perf_counter_ns()
+    for frame in frames:
+        send_ack(s, "AE" if frame is OVERSIZED_FRAME else "AA")
+        p_overall_messages_acknowledged.inc()
+        time_message_latency = time.time() - time_message_received
+        p_message_latency.observe(time_message_latency)
+    acknowledged = time.perf_counter_ns()
+    for timing in timings:
+        timing.add("commit", committed - start)
+        timing.add("ack", acknowledged - committed)
+        timing.finish(acknowledged)
+
+def dispatch_frames(s: socket.socket,
+                    frames: list,
+                    storage_manager: StorageManager,
+                    alert_manager: AlertManager,
+                    time_message_received: float,
+                    received_ns: int = None,
+                    framing_ns: int = 0) -> None:
+    """
+    Handles and acknowledges every complete MLLP frame drained from one socket read.
+
+    Frames are applied to the state and logged strictly in the order they were
+    received. Test results needing a prediction are grouped so that the model is
+    called once per read; the group is predicted early whenever a later frame
+    concerns a patient already in it, so each prediction sees the same state as
+    if it had been made straight after its test result. The frames are
+    acknowledged in order once the message log has been committed, the
+    oversized ones with an AE ACK.
+
+    If handling fails with anything but a ValueError, only the frames handled
+    before the failure are acknowledged, up to the first test result still
+    waiting for its prediction, and the exception is raised again so that the
+    connection is dropped and the peer sends the others again.
+
+    Args:
+        s (socket.socket): The socket the frames were read from.
+        frames (list): The complete MLLP frames, without framing bytes.
+        storage_manager (StorageManager): The storage manager object.
+        alert_manager (AlertManager): The alert manager object.
+        time_message_received (float): The time at which the frames were read from the socket.
+        received_ns (int): The perf_counter_ns at which the frames were read, from
+                           which the stages of each message are timed.
+        framing_ns (int): The time taken to frame the read.
+    """
+    if received_ns is None:
+        received_ns = time.perf_counter_ns()
+    pending = dict()
+    timings = []
+    pending_timings = dict()
+    handled = 0
+    try:
+        for frame in frames:
+            p_sum_of_all_messages.inc()
+            p_overall_messages_received.inc()
+            timing = MessageTiming(received_ns)
+            timing.add("framing", framing_ns)
+            timings.append(timing)
+            if frame is OVERSIZED_FRAME:
+                p_oversized_frames.inc()
+            else:
+                try:
+                    start = time.perf_counter_ns()
+                    message_object = parse_frame(frame)
+                    timing.add("parse", time.perf_counter_ns() - start)
+                    timing.identify(message_object)
+                    handle_message(storage_manager, alert_manager, message_object, pending, time_message_received,
+                                   timing, pending_timings)
+
+                except ValueError:
+                    p_message_errors.inc()
+            handled += 1
+
+        predict_pending(storage_manager, alert_manager, pending, time_message_received, pending_timings)
+
+    except BaseException:
+        for timing in pending_timings.values():
+            handled = min(handled, timings.index(timing))
+        acknowledge_frames(s, frames[:handled], timings[:handled], storage_manager, time_message_received)
+        raise
+    acknowledge_frames(s, frames, timings, storage_manager, time_message_received)
 
 def listen_for_messages(storage_manager: StorageManager, 
                         alert_manager: AlertManager,
@@ -150,8 +382,7 @@ def listen_for_messages(storage_manager: StorageManager,
                            in seconds.
     """
     global stopping_condition
-    source = f"{MLLP_ADDRESS}:{MLLP_PORT}"
-    buffer = b""
+    source = f"{address[0]}:{address[1]}"
     attempt_count = 0
     delay = start_delay
     while not stopping_condition and attempt_count < retries:
@@ -164,62 +395,23 @@ def listen_for_messages(storage_manager: StorageManager,
                 attempt_count = 0
                 delay = start_delay
                 
+                framer = MLLPFramer(source)
+                buffered_bytes = p_feed_buffered_bytes.labels(source)
+
                 while not stopping_condition:
                     r = s.recv(1024)
                     if len(r) == 0:
-                        continue
+                        p_connection_closed_error.inc()
+                        raise ConnectionError(f"{source}: connection closed by peer")
                     time_message_received = time.time()
-                    p_sum_of_all_messages.inc()
-                    p_overall_messages_received.inc()
-                    buffer += r
-                    received, buffer = parse_mllp_messages(buffer, source)
-                    try:
-                        message_object = parse_message(from_mllp(received[0]))
-                        
-                        if isinstance(message_object, PatientAdmissionMessage):
-                            p_admission_messages.inc()
-                            storage_manager.add_admitted_patient_to_current_patients(message_object)
-                            p_successful_admission_message_handlings.inc()
-                            
-                        elif isinstance(message_object, TestResultMessage):
-                            p_test_result_messages.inc()
-                            storage_manager.add_test_result_to_current_patients(message_object)
-                            p_successful_test_result_handlings.inc()
-
-                            if storage_manager.no_positive_aki_prediction_so_far(message_object.mrn):
-                                prediction_result = storage_manager.predict_aki(message_object.mrn)
-                                if prediction_result == 1:
-                                    p_positive_aki_predictions.inc()
-                                    p_sum_of_positive_aki_predictions.inc()
-                                    try:
-                                        alert_manager.send_alert(message_object.mrn, message_object.timestamp) 
-                                    except RuntimeError:
-                                        p_failed_pagings.inc()
-                                    p_number_of_pagings.inc()
-                                    time_latency_aki_paging = time.time() - time_message_received
-                                    p_paging_latency.observe(time_latency_aki_paging)
-                                    
-                                    storage_manager.update_positive_aki_prediction_to_current_patients(message_object.mrn)
-                                elif prediction_result == 0:
-                                    p_negative_aki_predictions.inc()
-                                        
-                        elif isinstance(message_object, PatientDischargeMessage):
-                            p_discharge_messages.inc()
-                            storage_manager.remove_patient_from_current_patients(message_object)
-                            p_successful_discharge_message_handlings.inc()
-                            
-                        storage_manager.add_message_to_log_csv(message_object)
-                        p_messages_added_to_log.inc()
-                        
-                    except ValueError:
-                        p_message_errors.inc()
-                        
-                    finally: 
-                        send_ack(s)
-                        p_overall_messages_acknowledged.inc()
-                        time_message_latency = time.time() - time_message_received
-                        p_message_latency.observe(time_message_latency)
-                      
+                    received_ns = time.perf_counter_ns()
+                    received = framer.feed(r)
+                    framing_ns = time.perf_counter_ns() - received_ns
+                    p_frames_per_read.observe(len(received))
+                    buffered_bytes.set(framer.buffered_bytes)
+                    dispatch_frames(s, received, storage_manager, alert_manager, time_message_received,
+                                    received_ns, framing_ns)
+
         except Exception as e:
             print(f"An error occurred: {e}")
             time.sleep(delay)
@@ -232,15 +424,436 @@ def listen_for_messages(storage_manager: StorageManager,
             stopping_condition = True
         print("Closing server socket.")
 
+class Feed:
+    """
+    One MLLP connection feeding the asyncio pipeline. Every feed has its own
+    framer and its own ACK path; its messages are acknowledged on its writer,
+    in the order it sent them. The metrics of a feed are labelled with its name:
+    the address connected to, or in server mode the address listened on, which
+    all the connections accepted there share.
+
+    A feed is not read while it is over its high watermarks: more than
+    LISTENER_HIGH_WATERMARK_MESSAGES messages waiting for their ACK, or more
+    than LISTENER_HIGH_WATERMARK_BYTES bytes waiting to be parsed. Reading
+    resumes once both are back down to the low watermarks, so the memory taken
+    by a feed stays bounded however fast it sends.
+    """
+    def __init__(self, name: str, writer: asyncio.StreamWriter) -> None:
+        self.name = name
+        self.writer = writer
+        self.framer = MLLPFramer(name)
+        # Set once the connection is gone: its queued messages are dropped
+        # unacknowledged, to be sent again by the peer
+        self.closed = False
+        self.unacknowledged = 0
+        # Bytes held by the framer and by the frames waiting to be parsed
+        self.buffered_bytes = 0
+        # Cleared while reading is paused
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.messages_received = p_feed_messages_received.labels(name)
+        self.messages_acknowledged = p_feed_messages_acknowledged.labels(name)
+        self.backlog = p_feed_backlog.labels(name)
+        self.lag = p_feed_lag.labels(name)
+        self.buffered = p_feed_buffered_bytes.labels(name)
+        self.paused = p_feed_paused.labels(name)
+
+    def add_buffered_bytes(self, count: int) -> None:
+        self.buffered_bytes += count
+        self.buffered.inc(count)
+
+    def release(self, messages: int = 0, buffered_bytes: int = 0) -> None:
+        """
+        Records that messages have been acknowledged, or bytes parsed, and
+        resumes reading if it was paused and the feed is under its low watermarks.
+        """
+        self.unacknowledged -= messages
+        if buffered_bytes:
+            self.add_buffered_bytes(-buffered_bytes)
+        if (not self.resumed.is_set() and self.unacknowledged <= LISTENER_LOW_WATERMARK_MESSAGES
+                and self.buffered_bytes <= LISTENER_LOW_WATERMARK_BYTES):
+            self.resumed.set()
+
+    async def wait_until_readable(self) -> None:
+        """
+        Waits, if the feed is over a high watermark, until it is under the low watermarks.
+        """
+        if (self.unacknowledged < LISTENER_HIGH_WATERMARK_MESSAGES
+                and self.buffered_bytes < LISTENER_HIGH_WATERMARK_BYTES):
+            return
+        self.resumed.clear()
+        self.paused.set(1)
+        try:
+            await self.resumed.wait()
+        finally:
+            self.paused.set(0)
+
+    def close(self) -> None:
+        self.closed = True
+        self.writer.close()
+
+async def _read_frames(reader: asyncio.StreamReader, feed: Feed, parse_queue: asyncio.Queue) -> None:
+    """
+    Reads from the socket and queues every complete MLLP frame for parsing.
+    """
+    while not stopping_condition:
+        await feed.wait_until_readable()
+        r = await reader.read(1024)
+        if len(r) == 0:
+            p_connection_closed_error.inc()
+            raise ConnectionError(f"{feed.name}: connection closed by peer")
+        time_message_received = time.time()
+        received_ns = time.perf_counter_ns()
+        buffered_before = feed.framer.buffered_bytes
+        received = feed.framer.feed(r)
+        framing_ns = time.perf_counter_ns() - received_ns
+        p_frames_per_read.observe(len(received))
+        feed.add_buffered_bytes(feed.framer.buffered_bytes - buffered_before + sum(map(len, received)))
+        feed.messages_received.inc(len(received))
+        feed.backlog.inc(len(received))
+        feed.unacknowledged += len(received)
+        for frame in received:
+            timing = MessageTiming(received_ns)
+            timing.add("framing", framing_ns)
+            await parse_queue.put((frame, time_message_received, timing))
+
+async def _parse_frames(feed: Feed, parse_queue: asyncio.Queue, process_queue: asyncio.Queue) -> None:
+    """
+    Parses the queued frames of a feed into message objects and hands them to the
+    processing task shared by all the feeds, with the code of their ACK. Frames
+    which cannot be parsed are passed on as None, so that they are still
+    acknowledged in order, and oversized frames are rejected with an AE ACK.
+    """
+    while True:
+        frame, time_message_received, timing = await parse_queue.get()
+        p_sum_of_all_messages.inc()
+        p_overall_messages_received.inc()
+        ack_code = "AA"
+        message_object = None
+        if frame is OVERSIZED_FRAME:
+            p_oversized_frames.inc()
+            ack_code = "AE"
+        else:
+            try:
+                start = time.perf_counter_ns()
+                message_object = parse_frame(frame)
+                timing.add("parse", time.perf_counter_ns() - start)
+                timing.identify(message_object)
+            except ValueError:
+                p_message_errors.inc()
+        feed.release(buffered_bytes=len(frame))
+        await process_queue.put((message_object, time_message_received, feed, timing, ack_code))
+
+async def _process_messages(storage_manager: StorageManager,
+                            process_queue: asyncio.Queue,
+                            prediction_queue: asyncio.Queue) -> None:
+    """
+    Applies queued messages to the state, logs them and acknowledges them once
+    the log is committed. All the messages waiting in the queue are handled
+    together and share a single commit. Test results which need a prediction
+    are then handed to the prediction task with a snapshot of the patient's
+    features, so that neither inference nor paging delays the ACK.
+
+    A single task processes the messages of every feed in the order they were
+    parsed, so the messages of a patient are applied in the order they arrived
+    whichever feed they came from. Each message is acknowledged on its own feed.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await process_queue.get()]
+        while not process_queue.empty():
+            batch.append(process_queue.get_nowait())
+        batch = [item for item in batch if not item[2].closed]
+        predictions = []
+        for message_object, time_message_received, _, timing, _ in batch:
+            if message_object is None:
+                continue
+            try:
+                start = time.perf_counter_ns()
+                if not apply_message(storage_manager, message_object):
+                    continue
+                applied = time.perf_counter_ns()
+                storage_manager.add_message_to_log_csv(message_object)
+                p_messages_added_to_log.inc()
+                timing.add("apply", applied - start)
+                timing.add("log", time.perf_counter_ns() - applied)
+                if isinstance(message_object, TestResultMessage) and storage_manager.no_positive_aki_prediction_so_far(message_object.mrn):
+                    features = storage_manager.build_features(message_object.mrn)
+                    predictions.append((message_object, features, time_message_received))
+            except ValueError:
+                p_message_errors.inc()
+        start = time.perf_counter_ns()
+        await loop.run_in_executor(None, functools.partial(storage_manager.commit_message_log, snapshot=False))
+        commit_ns = time.perf_counter_ns() - start
+        # Every message applied so far has been logged and the state only changes on
+        # this thread, so the snapshot matches the log; the feeds wait while it is written
+        storage_manager.snapshot_if_due()
+        for prediction in predictions:
+            await prediction_queue.put(prediction)
+        acknowledged = dict()
+        for _, time_message_received, feed, timing, ack_code in batch:
+            timing.add("commit", commit_ns)
+            acknowledged.setdefault(feed, []).append((time_message_received, timing, ack_code))
+        for feed, items in acknowledged.items():
+            if feed.closed:
+                continue
+            start = time.perf_counter_ns()
+            feed.writer.write(b"".join(build_ack(ack_code) for _, _, ack_code in items))
+            try:
+                await feed.writer.drain()
+            except ConnectionError:
+                continue
+            acknowledged_ns = time.perf_counter_ns()
+            for _, timing, _ in items:
+                timing.add("ack", acknowledged_ns - start)
+                timing.finish(acknowledged_ns)
+            times = [time_message_received for time_message_received, _, _ in items]
+            now = time.time()
+            for time_message_received in times:
+                p_overall_messages_acknowledged.inc()
+                p_message_latency.observe(now - time_message_received)
+            feed.messages_acknowledged.inc(len(times))
+            feed.backlog.dec(len(times))
+            feed.release(messages=len(times))
+            feed.lag.set(now - times[-1])
+
+async def _run_feed(reader: asyncio.StreamReader, feed: Feed, process_queue: asyncio.Queue, queue_size: int) -> None:
+    """
+    Reads and parses the messages of one connection until it fails or is closed.
+    """
+    parse_queue = asyncio.Queue(queue_size)
+    connection_tasks = [
+        asyncio.create_task(_read_frames(reader, feed, parse_queue)),
+        asyncio.create_task(_parse_frames(feed, parse_queue, process_queue)),
+    ]
+    try:
+        done, _ = await asyncio.wait(connection_tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in connection_tasks:
+            task.cancel()
+        await asyncio.gather(*connection_tasks, return_exceptions=True)
+        feed.close()
+        # Messages dropped with the connection are no longer waiting for an ACK
+        feed.backlog.dec(feed.unacknowledged)
+        feed.unacknowledged = 0
+        feed.add_buffered_bytes(-feed.buffered_bytes)
+
+async def _connect_feed(address: tuple[str, int],
+                        process_queue: asyncio.Queue,
+                        retries: int,
+                        start_delay: float,
+                        max_delay: float,
+                        queue_size: int) -> None:
+    """
+    Connects to an MLLP server as a client and feeds its messages to the
+    pipeline, reconnecting with exponential backoff until retries consecutive
+    attempts have failed.
+    """
+    source = f"{address[0]}:{address[1]}"
+    attempt_count = 0
+    delay = start_delay
+    while not stopping_condition and attempt_count < retries:
+        try:
+            print(f"Attempting to connect to {source}...")
+            p_number_of_connection_attempts.inc()
+            reader, writer = await asyncio.open_connection(*address)
+            print(f"Connected to {source}!")
+            attempt_count = 0
+            delay = start_delay
+            await _run_feed(reader, Feed(source, writer), process_queue, queue_size)
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+            attempt_count += 1
+            print(f"Attempting to reconnect to {source}, attempt {attempt_count}.")
+
+    if attempt_count == retries:
+        print(f"Maximum reconnection attempts to {source} reached, stopping.")
+    print("Closing server socket.")
+
+async def _serve_feeds(endpoints: list, process_queue: asyncio.Queue, queue_size: int) -> None:
+    """
+    Listens on every endpoint and feeds the messages of each accepted connection
+    to the pipeline, until the listener is stopped.
+    """
+    def acceptor(endpoint: str):
+        async def accept(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            print(f"Accepted connection from {writer.get_extra_info('peername')} on {endpoint}")
+            try:
+                await _run_feed(reader, Feed(endpoint, writer), process_queue, queue_size)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+        return accept
+
+    servers = [await asyncio.start_server(acceptor(f"{host}:{port}"), host, port) for host, port in endpoints]
+    try:
+        while not stopping_condition:
+            await asyncio.sleep(1)
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+
+async def _predict_aki(storage_manager: StorageManager,
+                       alert_manager: AlertManager,
+                       prediction_queue: asyncio.Queue,
+                       batch_size: int = ASYNC_PREDICTION_BATCH_SIZE) -> None:
+    """
+    Runs the model on queued feature snapshots and hands a page to the background
+    pager for every first positive prediction of an admitted patient. All the
+    snapshots waiting in the queue, up to batch_size, are predicted together.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await prediction_queue.get()]
+        while len(batch) < batch_size and not prediction_queue.empty():
+            batch.append(prediction_queue.get_nowait())
+        try:
+            start = time.perf_counter_ns()
+            predictions = await loop.run_in_executor(None, storage_manager.predict_features_batch, [features for _, features, _ in batch])
+            # Predictions are made after the ACK, so they are not part of the timing of their message
+            predict_ns = time.perf_counter_ns() - start
+            for _ in batch:
+                observe_stage("predict", MESSAGE_TYPES[TestResultMessage], predict_ns)
+            paged = set()
+            for (message_object, _, time_message_received), prediction_result in zip(batch, predictions):
+                mrn = message_object.mrn
+                if mrn in paged or (mrn in storage_manager.current_patients and not storage_manager.no_positive_aki_prediction_so_far(mrn)):
+                    continue
+                record_prediction(prediction_result)
+                if prediction_result == 1:
+                    paged.add(mrn)
+                    # The page is in the outbox before the prediction is logged, since a
+                    # logged prediction is not made again after a restart
+                    await loop.run_in_executor(None, page_positive_prediction, alert_manager, mrn, message_object.timestamp, time_message_received)
+                    # The patient may have been discharged while the model was running,
+                    # in which case there is no prediction to record
+                    lsn = storage_manager.record_positive_aki_prediction(mrn)
+                    if lsn is not None:
+                        await loop.run_in_executor(None, functools.partial(storage_manager.commit_message_log, lsn, snapshot=False))
+        finally:
+            for _ in batch:
+                prediction_queue.task_done()
+
+async def listen_for_feeds_async(storage_manager: StorageManager,
+                                 alert_manager: AlertManager,
+                                 endpoints: list = MLLP_ENDPOINTS,
+                                 mode: str = MLLP_MODE,
+                                 retries: int = 20,
+                                 start_delay: float = 1.0,
+                                 max_delay: float = 30.0,
+                                 queue_size: int = ASYNC_QUEUE_SIZE) -> None:
+    """Receives HL7 messages from several MLLP feeds with a pipeline of asyncio tasks.
+
+    Socket reads, HL7 parsing, state updates and prediction run as separate
+    tasks connected by bounded queues, and pages are delivered by the alert
+    manager's background workers. Each message is acknowledged as soon as it
+    has been logged, while prediction and paging continue in the background,
+    so a slow or unavailable pager does not delay the ACKs.
+
+    Every connection is read and parsed by its own tasks, and all of them feed
+    one processing task, which keeps the messages of each patient in order.
+   
+    Args:
+        endpoints (list): (hostname, port) of each MLLP endpoint.
+        mode (str): 'client' to connect to every endpoint, or 'server' to listen
+                    on every endpoint and accept any number of connections.
+        retries (int): number of reconnection attempts of each client feed.
+        start_delay (float): Initial delay between reconnection attempts
+                            in seconds. Delays increase exponentially.
+        max_delay (float): Maximum delay between reconnection attempts
+                           in seconds.
+        queue_size (int): Maximum number of items waiting in each queue.
+    """
+    global stopping_condition
+
+    # Processing and prediction outlive individual connections, so that work
+    # which has already been acknowledged is not lost on a reconnection
+    process_queue = asyncio.Queue(queue_size)
+    prediction_queue = asyncio.Queue(queue_size)
+    p_queue_depth.labels("process").set_function(process_queue.qsize)
+    p_queue_depth.labels("prediction").set_function(prediction_queue.qsize)
+    pipeline_tasks = [
+        asyncio.create_task(_process_messages(storage_manager, process_queue, prediction_queue)),
+        asyncio.create_task(_predict_aki(storage_manager, alert_manager, prediction_queue)),
+    ]
+
+    if mode == 'server':
+        feeds = _serve_feeds(endpoints, process_queue, queue_size)
+    else:
+        feeds = asyncio.gather(*[_connect_feed(tuple(address), process_queue, retries, start_delay, max_delay, queue_size)
+                                 for address in endpoints])
+    feeds_task = asyncio.ensure_future(feeds)
+    try:
+        # A failure of the shared pipeline stops every feed
+        done, _ = await asyncio.wait([feeds_task, *pipeline_tasks], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+        stopping_condition = True
+
+        # Let acknowledged messages finish prediction before returning
+        await prediction_queue.join()
+    finally:
+        for task in [feeds_task, *pipeline_tasks]:
+            task.cancel()
+        await asyncio.gather(feeds_task, *pipeline_tasks, return_exceptions=True)
+
+async def listen_for_messages_async(storage_manager: StorageManager,
+                                    alert_manager: AlertManager,
+                                    address: tuple[str, int] = (MLLP_ADDRESS, MLLP_PORT),
+                                    retries: int = 20,
+                                    start_delay: float = 1.0,
+                                    max_delay: float = 30.0,
+                                    queue_size: int = ASYNC_QUEUE_SIZE) -> None:
+    """Receives HL7 messages over a single client connection with the asyncio
+    pipeline of listen_for_feeds_async.
+   
+    Args:
+        address (tuple[str, int]): Hostname and port number for the socket
+                                   connection.
+        retries (int): number of reconnection attempts.
+        start_delay (float): Initial delay between reconnection attempts
+                            in seconds. Delays increase exponentially.
+        max_delay (float): Maximum delay between reconnection attempts
+                           in seconds.
+        queue_size (int): Maximum number of items waiting in each queue.
+    """
+    await listen_for_feeds_async(storage_manager, alert_manager, [address], 'client',
+                                 retries, start_delay, max_delay, queue_size)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='AKI Prediction System')
     parser.add_argument('--history-dir', type=str, help='Path to history CSV file')
+    parser.add_argument('--engine', type=str, choices=['threaded', 'asyncio'], default='threaded',
+                        help='Blocking socket loop, or a pipeline of asyncio tasks with non-blocking paging')
+    parser.add_argument('--feeds', type=str, nargs='+', help='MLLP endpoints as host:port, for the asyncio engine')
+    parser.add_argument('--mode', type=str, choices=['client', 'server'], default=MLLP_MODE,
+                        help='Connect to the MLLP endpoints, or listen on them for connections (asyncio engine)')
     args = parser.parse_args()
 
+    endpoints = MLLP_ENDPOINTS
+    if args.feeds:
+        endpoints = [(host, int(port)) for host, port in (feed.rsplit(':', 1) for feed in args.feeds)]
+    if args.engine == 'threaded' and (len(endpoints) > 1 or args.mode == 'server'):
+        parser.error('several feeds and server mode need --engine asyncio')
+
     if args.history_dir:
         HISTORY_CSV_PATH = args.history_dir
     else:
         pass
 
+    # Started here rather than on import, so that importing the module has no side effects.
+    # The metrics server also serves /profile, and SIGUSR1 writes a profile to PROFILE_OUTPUT_PATH
+    profiler.start_metrics_server(PROMETHEUS_PORT)
+    profiler.install_signal_handler()
+    signal.signal(signal.SIGTERM, shutdown)
+
     storage_manager, alert_manager = initialise_system()
-    listen_for_messages(storage_manager, alert_manager)
+    if args.engine == 'asyncio':
+        asyncio.run(listen_for_feeds_async(storage_manager, alert_manager, endpoints, args.mode))
+    else:
+        listen_for_messages(storage_manager, alert_manager, endpoints[0])
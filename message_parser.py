@@ -2,45 +2,131 @@ from typing import Union
 
 from hospital_message import PatientDischargeMessage, PatientAdmissionMessage, TestResultMessage
 
-from prometheus_client import Counter, start_http_server
+from prometheus_client import Counter
 
 p_successful_message_parsing = Counter("successful_message_parsing", "Number of successful message parsing")
 
-def parse_message(hl7_message_str: str) -> Union[PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage]:
+# Code of the observation holding the creatinine result, in OBX-3
+CREATININE_OBSERVATION = b"CREATININE"
+# Creatinine results above this value are capped
+MAX_CREATININE_VALUE = 200
+
+def _component(field: bytes) -> str:
+    """
+    Returns the first component of a field as a string.
+    """
+    return str(field.split(b"^", 1)[0], "ascii")
+
+def _index_segments(segments: list) -> tuple[dict, list]:
     """
-    Parse an HL7 message string into an HL7 message object.
+    Indexes the segments of a message by type in a single pass.
+
+    Returns:
+    The first segment of each type, by type, and the list of OBX segments.
+    """
+    index = {}
+    observations = []
+    for segment in segments:
+        segment_type = segment[:3]
+        if segment_type == b"OBX":
+            observations.append(segment)
+        elif segment_type not in index:
+            index[segment_type] = segment
+    return index, observations
+
+def _creatinine_observation(observations: list) -> list:
+    """
+    Returns the fields, up to the value, of the OBX segment holding the creatinine result.
+
+    Raises:
+    ValueError: If none of the observations is a creatinine result.
+    """
+    for segment in observations:
+        observation = segment.split(b"|", 6)
+        if observation[3].split(b"^", 1)[0] == CREATININE_OBSERVATION:
+            return observation
+    raise ValueError("No creatinine observation")
+
+def parse_frame(frame: bytes) -> Union[PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage]:
+    """
+    Parses an HL7 message, as the bytes of an MLLP frame, into an HL7 message object.
+
+    Only the fields needed are split and decoded. Messages laid out as the
+    hospital sends them (MSH, PID, then OBR and OBX for a test result) are read
+    from their positions; otherwise the segments are indexed by type, so extra
+    segments (EVN, PV1, NTE...) and their order do not matter. Among several OBX
+    segments, the creatinine observation is picked by its code.
 
     Parameters:
-    hl7_message_str (str): A string representation of an HL7 message.
+    frame (bytes): The segments of the message, each one ended or separated by a
+                   carriage return. A memoryview, as returned by MLLPFramer, is accepted.
 
     Returns:
     Instance of PatientAdmissionMessage, TestResultMessage, or PatientDischargeMessage.
+
+    Raises:
+    ValueError: If the message is malformed, of an unknown type, or has no creatinine result.
     """
-    message = hl7_message_str
-    message_type = message[0].split("|")[8]
-    if message_type == 'ADT^A01':
-        patient_info = message[1].split("|")
-        mrn = patient_info[3]
-        name = patient_info[5]
-        date_of_birth = patient_info[7]
-        date_of_birth = patient_info[7][0:4]+"-"+patient_info[7][4:6]+"-"+patient_info[7][6:8]
-        sex = patient_info[8]
-        message_object = PatientAdmissionMessage(mrn, name, date_of_birth, sex)
-
-    elif message_type == 'ORU^R01':
-        mrn = message[1].split("|")[3]
-        test_time = message[2].split("|")[7]
-        test_day = test_time[:4]+"-"+test_time[4:6]+"-"+test_time[6:8]
-        test_time = test_time[8:10]+":"+test_time[10:12]+":"+test_time[12:]
-        test_result = min(float(message[3].split("|")[5]),200)
-        message_object = TestResultMessage(mrn, test_day, test_time, test_result)
-        
-    elif message_type == 'ADT^A03': 
-        mrn = message[1].split("|")[3]
-        message_object = PatientDischargeMessage(mrn)
-    
-    else:
-        raise ValueError(f"Unknown message type: {message_type}")    
-    
+    segments = bytes(frame).split(b"\r")
+    index = None
+    try:
+        if segments[0][:4] == b"MSH|" and len(segments) > 1 and segments[1][:4] == b"PID|":
+            msh, pid = segments[0], segments[1]
+        else:
+            index, observations = _index_segments(segments)
+            msh, pid = index[b"MSH"], index[b"PID"]
+        message_type = msh.split(b"|", 9)[8]
+        patient_info = pid.split(b"|", 9)
+
+        if message_type == b"ADT^A01":
+            date_of_birth = str(patient_info[7], "ascii")
+            message_object = PatientAdmissionMessage(_component(patient_info[3]),
+                                                     str(patient_info[5], "ascii"),
+                                                     f"{date_of_birth[0:4]}-{date_of_birth[4:6]}-{date_of_birth[6:8]}",
+                                                     str(patient_info[8], "ascii"))
+
+        elif message_type == b"ORU^R01":
+            observation = None
+            if index is None and len(segments) > 3 and segments[2][:4] == b"OBR|" and segments[3][:4] == b"OBX|":
+                obr = segments[2]
+                observation = segments[3].split(b"|", 6)
+                if observation[3].split(b"^", 1)[0] != CREATININE_OBSERVATION:
+                    observation = None
+            if observation is None:
+                if index is None:
+                    index, observations = _index_segments(segments)
+                obr = index[b"OBR"]
+                observation = _creatinine_observation(observations)
+            test_time = str(obr.split(b"|", 8)[7], "ascii")
+            message_object = TestResultMessage(_component(patient_info[3]),
+                                               f"{test_time[:4]}-{test_time[4:6]}-{test_time[6:8]}",
+                                               f"{test_time[8:10]}:{test_time[10:12]}:{test_time[12:]}",
+                                               min(float(observation[5]), MAX_CREATININE_VALUE))
+
+        elif message_type == b"ADT^A03":
+            message_object = PatientDischargeMessage(_component(patient_info[3]))
+
+        else:
+            raise ValueError(f"Unknown message type: {str(message_type, 'ascii', 'replace')}")
+    except KeyError as e:
+        raise ValueError(f"Missing {str(e.args[0], 'ascii')} segment") from e
+    except IndexError as e:
+        raise ValueError("Missing field") from e
+
     p_successful_message_parsing.inc()
-    return message_object
\ No newline at end of file
+    return message_object
+
+def parse_message(hl7_message_str: list) -> Union[PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage]:
+    """
+    Parse an HL7 message, given as its list of segment strings, into an HL7 message object.
+
+    Parameters:
+    hl7_message_str (list): The segments of an HL7 message.
+
+    Returns:
+    Instance of PatientAdmissionMessage, TestResultMessage, or PatientDischargeMessage.
+
+    Raises:
+    ValueError: If the message cannot be parsed.
+    """
+    return parse_frame(bytes("\r".join(hl7_message_str), "ascii"))
@@ -0,0 +1,159 @@
+from config import MLLP_MAX_FRAME_BYTES
+
+MLLP_START_OF_BLOCK = 0x0b
+MLLP_END_OF_BLOCK = 0x1c
+MLLP_CARRIAGE_RETURN = 0x0d
+
+_END_OF_BLOCK = bytes([MLLP_END_OF_BLOCK])
+_END_OF_FRAME = bytes([MLLP_END_OF_BLOCK, MLLP_CARRIAGE_RETURN])
+
+# Returned by MLLPFramer.feed in place of a frame over its maximum size, which
+# is to be rejected; it is empty, so it does not parse as a message either
+OVERSIZED_FRAME = memoryview(b"")
+
+class MLLPEncodingError(Exception):
+    """
+    Raised when a byte stream does not follow the MLLP framing rules.
+    """
+
+class MLLPFramer:
+    """
+    Incremental MLLP framer for a single byte stream.
+
+    Data is fed in as it is read from the socket and complete frames are returned
+    as memoryview slices over the received bytes, so frame payloads are never copied.
+    Only the unconsumed tail is kept between calls, and the search for the end of
+    block resumes from where the previous call stopped, so a large message arriving
+    in many pieces is scanned once in total.
+
+    Frames larger than max_frame_size are not kept: once a partial frame grows
+    past it, its bytes are dropped as they arrive until its end of block, and
+    OVERSIZED_FRAME is returned in its place, so that the framer never holds
+    more than max_frame_size bytes plus one read, whatever the peer sends.
+    """
+    def __init__(self, source: str, max_frame_size: int = MLLP_MAX_FRAME_BYTES) -> None:
+        """
+        Initializes the framer.
+
+        Args:
+            source (str): A description of the stream, used in error messages.
+            max_frame_size (int): The maximum size of a frame, without framing bytes.
+        """
+        self.source = source
+        self.max_frame_size = max_frame_size
+        # Unconsumed data, always starting at a frame boundary
+        self._buffer = b""
+        # Offset in _buffer from which the search for the end of block resumes
+        self._scan_from = 0
+        # Set while the rest of an oversized frame is being dropped
+        self._discarding = False
+
+    @property
+    def buffered_bytes(self) -> int:
+        """
+        Number of bytes received but not yet returned as part of a complete frame.
+        """
+        return len(self._buffer)
+
+    def reset(self) -> None:
+        """
+        Discards any partially received frame, e.g. after a reconnection.
+        """
+        self._buffer = b""
+        self._scan_from = 0
+        self._discarding = False
+
+    def _discard(self, data: bytes, frames: list) -> bytes:
+        """
+        Drops the data of an oversized frame up to its end of block, and returns
+        the data after it, once it is found.
+        """
+        # The end of block may have been the last byte of the previous read
+        if self._buffer:
+            data = self._buffer + data
+        end = data.find(_END_OF_FRAME)
+        if end == -1:
+            self._buffer = data[-1:] if data.endswith(_END_OF_BLOCK) else b""
+            return b""
+        self._buffer = b""
+        self._discarding = False
+        frames.append(OVERSIZED_FRAME)
+        return data[end + 2:]
+
+    def feed(self, data: bytes) -> list:
+        """
+        Adds received data to the stream and returns every frame it completes.
+
+        Args:
+            data (bytes): The bytes read from the stream.
+
+        Returns:
+            list: memoryview slices of the complete frames, in order, without the
+                  start of block, end of block and carriage return bytes, with
+                  OVERSIZED_FRAME in place of the frames over max_frame_size.
+
+        Raises:
+            MLLPEncodingError: If the data violates the MLLP framing.
+        """
+        frames = []
+        if self._discarding:
+            data = self._discard(data, frames)
+            if not data:
+                return frames
+
+        if len(self._buffer) == 0:
+            buffer = data
+        else:
+            if not isinstance(self._buffer, bytearray):
+                self._buffer = bytearray(self._buffer)
+            self._buffer += data
+            buffer = self._buffer
+
+        view = None
+        start = 0
+        scan = self._scan_from
+        length = len(buffer)
+        while start < length:
+            if buffer[start] != MLLP_START_OF_BLOCK:
+                raise MLLPEncodingError(f"{self.source}: bad MLLP encoding: want {hex(MLLP_START_OF_BLOCK)}, found {hex(buffer[start])}")
+            end = buffer.find(_END_OF_BLOCK, max(scan, start + 1))
+            if end == -1:
+                scan = length
+                if length - start - 1 > self.max_frame_size:
+                    self._discarding = True
+                    start = scan = length
+                break
+            if end + 1 == length:
+                scan = end
+                break
+            if buffer[end + 1] != MLLP_CARRIAGE_RETURN:
+                raise MLLPEncodingError(f"{self.source}: bad MLLP encoding: want {hex(MLLP_CARRIAGE_RETURN)}, found {hex(buffer[end + 1])}")
+            if end - start - 1 > self.max_frame_size:
+                frames.append(OVERSIZED_FRAME)
+            else:
+                if view is None:
+                    view = memoryview(buffer)
+                frames.append(view[start + 1:end])
+            start = end + 2
+            scan = start
+
+        # The returned views keep the old buffer alive, so it must never be
+        # extended again: the remainder is moved into a fresh buffer instead
+        self._buffer = buffer if start == 0 else buffer[start:]
+        self._scan_from = scan - start
+        return frames
+
+def parse_mllp_messages(buffer: bytes, source: str) -> tuple:
+    """
+    Splits a complete buffer into MLLP frames.
+
+    Args:
+        buffer (bytes): The data to split.
+        source (str): A description of the data, used in error messages.
+
+    Returns:
+        tuple: The list of frames as bytes, and the bytes left after the last complete frame.
+    """
+    framer = MLLPFramer(source)
+    frames = [bytes(frame) for frame in framer.feed(buffer)]
+    return frames, bytes(framer._buffer)
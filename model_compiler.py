@@ -0,0 +1,55 @@
+import argparse
+
+import numpy as np
+
+from compiled_forest import CompiledForest
+from config import MODEL_PATH, SKLEARN_MODEL_PATH
+
+# Marks a leaf in sklearn's tree arrays
+TREE_LEAF = -1
+
+def compile_forest(model) -> CompiledForest:
+    """
+    Exports the trees of a fitted RandomForestClassifier into flat NumPy arrays.
+
+    Args:
+        model (RandomForestClassifier): The fitted sklearn model.
+
+    Returns:
+        CompiledForest: A forest giving the same predictions without sklearn.
+    """
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == TREE_LEAF
+        node_ids = np.arange(tree.node_count) + offset
+        # Leaves loop back to themselves so that every sample can take max_depth steps
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+        left.append(np.where(is_leaf, node_ids, tree.children_left + offset))
+        right.append(np.where(is_leaf, node_ids, tree.children_right + offset))
+        counts = tree.value[:, 0, :]
+        value.append(counts / counts.sum(axis=1, keepdims=True))
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+    return CompiledForest(np.concatenate(feature).astype(np.intp),
+                          np.concatenate(threshold).astype(np.float64),
+                          np.concatenate(left).astype(np.intp),
+                          np.concatenate(right).astype(np.intp),
+                          np.concatenate(value).astype(np.float64),
+                          np.array(roots, dtype=np.intp),
+                          np.asarray(model.classes_),
+                          max_depth)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile the sklearn random forest into NumPy arrays')
+    parser.add_argument('--input', type=str, default=SKLEARN_MODEL_PATH, help='Path to the joblib model')
+    parser.add_argument('--output', type=str, default=MODEL_PATH, help='Path of the compiled .npz model')
+    args = parser.parse_args()
+
+    import joblib
+    compile_forest(joblib.load(args.input)).save(args.output)
+    print(f"Compiled {args.input} into {args.output}")
@@ -0,0 +1,268 @@
+import http.client
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from config import PAGER_ADDRESS, PAGER_PORT
+
+p_pager_requests = Counter("pager_requests", "Number of HTTP requests sent to the pager, including retries")
+p_pager_request_errors = Counter("pager_request_errors", "Number of HTTP requests to the pager which failed")
+p_pager_delivered = Counter("pager_pages_delivered", "Number of pages accepted by the pager")
+p_pager_rejected = Counter("pager_pages_rejected", "Number of pages permanently rejected by the pager")
+p_pager_outbox_pending = Gauge("pager_outbox_pending", "Number of pages waiting in the outbox")
+p_pager_request_latency = Histogram("pager_request_latency", "Round trip time of a single HTTP request to the pager",
+                                    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5])
+p_pager_delivery_latency = Histogram("pager_delivery_latency", "Time from a page entering the outbox to its delivery",
+                                     buckets=[0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300])
+
+class PagerRejectedError(Exception):
+    """
+    Raised when the pager refuses a page with a client error, so retrying cannot succeed.
+    """
+
+class PagerClient:
+    """
+    Sends pages over a persistent HTTP connection to the pager.
+
+    The connection is kept alive between pages and reopened transparently when the
+    pager closes it. The timeout applies to this connection only.
+    """
+    def __init__(self, host: str = PAGER_ADDRESS, port: int = PAGER_PORT, timeout: float = 1.0) -> None:
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def page(self, patient_mrn: str, timestamp: str) -> None:
+        """
+        Sends a single page request.
+
+        Parameters:
+        patient_mrn (str): The medical record number of the patient.
+        timestamp (str): The timestamp of the alert in the format YYYYMMDDHHMMSS
+
+        Raises:
+        PagerRejectedError: If the pager rejects the page as invalid.
+        OSError, http.client.HTTPException: If the request fails and may be retried.
+        """
+        p_pager_requests.inc()
+        start = time.perf_counter()
+        try:
+            self.connection.request("POST", "/page", body=bytes(patient_mrn + ',' + timestamp, 'utf-8'),
+                                    headers={"Content-Type": "text/plain"})
+            r = self.connection.getresponse()
+            r.read()
+        except (OSError, http.client.HTTPException):
+            p_pager_request_errors.inc()
+            self.connection.close()
+            raise
+        finally:
+            p_pager_request_latency.observe(time.perf_counter() - start)
+        if 400 <= r.status < 500:
+            raise PagerRejectedError(f"Pager rejected page for {patient_mrn}: {r.status} {r.reason}")
+        if not 200 <= r.status < 300:
+            p_pager_request_errors.inc()
+            raise http.client.HTTPException(f"Pager returned {r.status} {r.reason}")
+
+    def close(self) -> None:
+        self.connection.close()
+
+def backoff_delays(base_delay: float, max_delay: float):
+    """
+    Yields jittered exponential backoff delays ("full jitter"): each delay is drawn
+    uniformly between zero and an exponentially growing cap.
+    """
+    cap = base_delay
+    while True:
+        yield random.uniform(0, cap)
+        cap = min(cap * 2, max_delay)
+
+class PagerOutbox:
+    """
+    On-disk outbox of pages which have not been delivered yet.
+
+    Each page is stored as its own small file, written atomically, and removed
+    once the pager has accepted it, so pending pages survive a crash.
+    """
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, patient_mrn: str, timestamp: str) -> dict:
+        """
+        Durably records a page and returns it.
+        """
+        created = time.time()
+        page = {'id': f"{time.time_ns():020d}-{uuid.uuid4().hex}", 'mrn': patient_mrn,
+                'timestamp': timestamp, 'created': created}
+        path = os.path.join(self.directory, page['id'] + '.page')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(page, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        self._sync_directory()
+        p_pager_outbox_pending.inc()
+        return page
+
+    def remove(self, page: dict) -> None:
+        """
+        Removes a delivered page.
+        """
+        try:
+            os.remove(os.path.join(self.directory, page['id'] + '.page'))
+            p_pager_outbox_pending.dec()
+        except FileNotFoundError:
+            pass
+
+    def pending(self) -> list:
+        """
+        Returns the pages still waiting for delivery, oldest first.
+        """
+        pages = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.page'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r') as file:
+                    pages.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return pages
+
+    def _sync_directory(self) -> None:
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+class PagerPool:
+    """
+    Pool of background workers delivering pages from the outbox.
+
+    Every worker owns a keep-alive connection to the pager and retries failed
+    requests with jittered exponential backoff until the page is delivered or
+    permanently rejected. Pages left in the outbox by a previous run are queued
+    again when the pool starts.
+    """
+    def __init__(self,
+                 outbox: PagerOutbox,
+                 num_workers: int = 4,
+                 host: str = PAGER_ADDRESS,
+                 port: int = PAGER_PORT,
+                 timeout: float = 1.0,
+                 base_delay: float = 0.1,
+                 max_delay: float = 10.0,
+                 failure_threshold: int = 10) -> None:
+        """
+        Initializes the pool.
+
+        Args:
+            outbox (PagerOutbox): Durable storage of pending pages.
+            num_workers (int): Number of worker threads, each with its own connection.
+            host (str), port (int): Address of the pager.
+            timeout (float): Timeout of a single HTTP request in seconds.
+            base_delay (float): Initial backoff cap in seconds.
+            max_delay (float): Maximum backoff cap in seconds.
+            failure_threshold (int): Number of failed attempts after which a page is
+                                     reported as failed; it is still retried afterwards.
+        """
+        self.outbox = outbox
+        self.num_workers = num_workers
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._workers = []
+
+    def start(self) -> None:
+        """
+        Starts the workers and queues the pages left over from a previous run.
+        """
+        pending = self.outbox.pending()
+        p_pager_outbox_pending.set(len(pending))
+        for page in pending:
+            self._queue.put((page, None))
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._run, name=f"pager-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, patient_mrn: str, timestamp: str, on_done=None) -> None:
+        """
+        Durably records a page and queues it for delivery.
+
+        Args:
+            patient_mrn (str): The medical record number of the patient.
+            timestamp (str): The timestamp of the alert in the format YYYYMMDDHHMMSS
+            on_done (callable): Called from the worker with True once the page is
+                                delivered, or False once it is rejected or has
+                                failed failure_threshold times.
+        """
+        page = self.outbox.add(patient_mrn, timestamp)
+        self._queue.put((page, on_done))
+
+    def join(self) -> None:
+        """
+        Blocks until every queued page has been delivered or rejected.
+        """
+        self._queue.join()
+
+    def stop(self) -> None:
+        """
+        Stops the workers. Undelivered pages stay in the outbox.
+        """
+        self._stopping.set()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _run(self) -> None:
+        client = PagerClient(self.host, self.port, self.timeout)
+        try:
+            while not self._stopping.is_set():
+                try:
+                    page, on_done = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                try:
+                    self._deliver(client, page, on_done)
+                finally:
+                    self._queue.task_done()
+        finally:
+            client.close()
+
+    def _deliver(self, client: PagerClient, page: dict, on_done) -> None:
+        attempts = 0
+        delays = backoff_delays(self.base_delay, self.max_delay)
+        while not self._stopping.is_set():
+            attempts += 1
+            try:
+                client.page(page['mrn'], page['timestamp'])
+            except PagerRejectedError as e:
+                print(e)
+                p_pager_rejected.inc()
+                self.outbox.remove(page)
+                if on_done is not None:
+                    on_done(False)
+                return
+            except (OSError, http.client.HTTPException):
+                if attempts == self.failure_threshold and on_done is not None:
+                    on_done(False)
+                    on_done = None
+                self._stopping.wait(next(delays))
+                continue
+            p_pager_delivered.inc()
+            p_pager_delivery_latency.observe(max(time.time() - page['created'], 0))
+            self.outbox.remove(page)
+            if on_done is not None:
+                on_done(True)
+            return
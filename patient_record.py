@@ -0,0 +1,123 @@
+import datetime
+from array import array
+
+# Sex as encoded for the model
+SEX_MALE = 0
+SEX_FEMALE = 1
+
+# Number of most recent creatinine results in the model features
+FEATURE_RESULTS = 5
+
+def encode_sex(sex: str) -> int:
+    """
+    Encodes the sex of an admission message ('M' or 'F') as the model expects it.
+    """
+    return SEX_MALE if sex.lower() == 'm' else SEX_FEMALE
+
+def encode_date_of_birth(date_of_birth: str) -> int:
+    """
+    Encodes a date of birth in the format '2021-01-01' as a proleptic Gregorian ordinal.
+
+    Raises:
+        ValueError: If the date is not in the expected format.
+    """
+    return datetime.datetime.strptime(date_of_birth, "%Y-%m-%d").toordinal()
+
+class PatientRecord():
+    """
+    Holds the data of a patient currently admitted in the hospital.
+
+    The record owns its creatinine results, stored unboxed in an array of doubles:
+    results taken from the history on admission are copied in. It also keeps the
+    model features of the patient up to date as results arrive: the age, the sex
+    and the FEATURE_RESULTS most recent results, padded with the last one when
+    there are fewer. The age is only recomputed when the day changes.
+
+    The timestamp and value of every result received during the admission are kept,
+    so that a test result received again can be recognised.
+    """
+    __slots__ = ('name', 'sex', 'date_of_birth', 'creatinine_results', 'previous_positive_aki_prediction',
+                 '_features', '_age_day', 'received_results')
+
+    def __init__(self, name: str, date_of_birth: str, sex: str, creatinine_results=(),
+                 previous_positive_aki_prediction: bool = False) -> None:
+        """
+        Initializes a patient record.
+
+        Args:
+            name (str): The name of the patient.
+            date_of_birth (str): The date of birth of the patient, in the format '2021-01-01'.
+            sex (str): The sex of the patient: 'M' or 'F'.
+            creatinine_results: The creatinine results of the patient so far; they are copied.
+            previous_positive_aki_prediction (bool): Whether AKI was already predicted.
+
+        Raises:
+            ValueError: If the date of birth is not in the expected format.
+        """
+        self.name = name
+        self.sex = encode_sex(sex)
+        self.date_of_birth = encode_date_of_birth(date_of_birth)
+        self.creatinine_results = array('d', creatinine_results)
+        self.previous_positive_aki_prediction = previous_positive_aki_prediction
+        recent_results = self.creatinine_results[-FEATURE_RESULTS:]
+        if recent_results:
+            recent_results.extend([recent_results[-1]] * (FEATURE_RESULTS - len(recent_results)))
+        else:
+            recent_results = array('d', [0.0] * FEATURE_RESULTS)
+        self._features = array('d', [0.0, float(self.sex)]) + recent_results
+        self._age_day = None
+        self.received_results = set()
+
+    def add_result(self, creatinine_value: float, timestamp: str = None) -> None:
+        """
+        Appends a creatinine result and updates the features in constant time. When
+        the timestamp of the result, in the format YYYYMMDDHHMMSS, is given, the
+        result is recorded as received.
+        """
+        if timestamp is not None:
+            self.received_results.add((timestamp, creatinine_value))
+        results = self.creatinine_results
+        results.append(creatinine_value)
+        features = self._features
+        if len(results) > FEATURE_RESULTS:
+            # Shift out the oldest of the recent results
+            features[2:-1] = features[3:]
+            features[-1] = creatinine_value
+        else:
+            # The new result replaces the padding from its position onwards
+            for position in range(len(results) + 1, FEATURE_RESULTS + 2):
+                features[position] = creatinine_value
+
+    def features(self, today: datetime.date) -> list:
+        """
+        Returns the model features of the patient: age on the given day, sex and the
+        most recent creatinine results, padded with the last one.
+
+        Raises:
+            IndexError: If the patient has no creatinine results.
+        """
+        if not self.creatinine_results:
+            raise IndexError("The patient has no creatinine results")
+        day = today.toordinal()
+        if self._age_day != day:
+            self._features[0] = self.age(today)
+            self._age_day = day
+        return self._features.tolist()
+
+    def age(self, today: datetime.date) -> int:
+        """
+        Returns the age of the patient in whole years on the given day.
+        """
+        dob = datetime.date.fromordinal(self.date_of_birth)
+        return int(today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day)))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PatientRecord):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__[:5])
+
+    def __repr__(self) -> str:
+        return (f"PatientRecord(name={self.name!r}, sex={self.sex}, "
+                f"date_of_birth={datetime.date.fromordinal(self.date_of_birth)}, "
+                f"creatinine_results={self.creatinine_results.tolist()}, "
+                f"previous_positive_aki_prediction={self.previous_positive_aki_prediction})")
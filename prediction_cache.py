@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+from prometheus_client import Counter, Gauge
+
+p_prediction_cache_hits = Counter("prediction_cache_hits", "Number of predictions answered from the prediction cache")
+p_prediction_cache_misses = Counter("prediction_cache_misses", "Number of predictions which had to run the model")
+p_prediction_cache_evictions = Counter("prediction_cache_evictions", "Number of least recently used entries evicted from the prediction cache")
+p_prediction_cache_size = Gauge("prediction_cache_size", "Number of feature vectors in the prediction cache")
+
+class PredictionCache:
+    """
+    Bounded least recently used cache of model predictions.
+
+    Entries are keyed on the model input features, quantized to a fixed number of
+    decimals. The model should be run on the quantized features (see key), so that
+    a cached prediction is exactly the one the model would have made. Creatinine
+    results arrive with two decimals, so quantizing to two decimals loses nothing.
+    A max_size of 0 disables the cache.
+    """
+    def __init__(self, max_size: int, decimals: int = 2) -> None:
+        self.max_size = max_size
+        self.decimals = decimals
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, features: list) -> tuple:
+        """
+        Returns the quantized features, used as the key of their prediction.
+        """
+        decimals = self.decimals
+        return tuple([round(value, decimals) for value in features])
+
+    def get(self, key: tuple):
+        """
+        Returns the prediction cached for key and marks it as recently used, or
+        None when there is none.
+        """
+        with self._lock:
+            prediction = self._entries.get(key)
+            if prediction is None:
+                p_prediction_cache_misses.inc()
+                return None
+            self._entries.move_to_end(key)
+        p_prediction_cache_hits.inc()
+        return prediction
+
+    def put(self, key: tuple, prediction: int) -> None:
+        """
+        Caches a prediction, evicting the least recently used one when full.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = prediction
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            size = len(self._entries)
+        if evicted:
+            p_prediction_cache_evictions.inc(evicted)
+        p_prediction_cache_size.set(size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        p_prediction_cache_size.set(0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,190 @@
+import collections
+import datetime
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+import wsgiref.simple_server
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, make_wsgi_app
+
+from config import PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_OUTPUT_PATH
+
+p_profiles = Counter("profiles", "Number of profiling sessions run")
+p_profiler_running = Gauge("profiler_running", "1 while a profiling session is sampling the stacks")
+
+class ProfilerBusyError(Exception):
+    """
+    Raised when a profiling session is requested while another one is running.
+    """
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling the stacks of every thread of the process.
+
+    A session samples the stack of each thread every interval seconds for a
+    fixed time, from a thread of its own, and counts identical stacks. Nothing
+    runs between sessions, so the profiler costs nothing when it is not used;
+    during a session, taking a sample holds the GIL for a few microseconds per
+    thread. Only one session runs at a time.
+    """
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL_MS / 1000) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self, stacks: collections.Counter, ignored: set) -> None:
+        """
+        Adds the current stack of every thread but the ignored ones to stacks,
+        each one a tuple of frame labels, outermost first, under the thread's name.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in ignored:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[tuple(reversed(stack))] += 1
+
+    def run(self, seconds: float) -> collections.Counter:
+        """
+        Samples the stacks for the given time from the calling thread, which is
+        not sampled itself.
+
+        Returns:
+            The number of samples of each stack.
+
+        Raises:
+            ProfilerBusyError: If another session is running.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profiling session is already running")
+        try:
+            p_profiles.inc()
+            p_profiler_running.set(1)
+            stacks = collections.Counter()
+            ignored = {threading.get_ident()}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                self.sample(stacks, ignored)
+                time.sleep(self.interval)
+            return stacks
+        finally:
+            p_profiler_running.set(0)
+            self._lock.release()
+
+def collapsed(stacks: collections.Counter) -> str:
+    """
+    Formats stacks as collapsed stacks, one "thread;outer;...;inner count" line
+    per stack, as read by flamegraph.pl and speedscope.
+    """
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+def top(stacks: collections.Counter, limit: int = 30) -> str:
+    """
+    Formats stacks as a table of the functions with the most samples, where they
+    were running (own) or anywhere on the stack (cumulative), like pstats.
+    """
+    total = sum(stacks.values()) or 1
+    own = collections.Counter()
+    cumulative = collections.Counter()
+    for stack, count in stacks.items():
+        # The first item is the thread name
+        if len(stack) > 1:
+            own[stack[-1]] += count
+        for label in set(stack[1:]):
+            cumulative[label] += count
+    lines = [f"{total} samples", f"{'own':>7} {'own%':>6} {'cum':>7} {'cum%':>6}  function"]
+    for label, count in cumulative.most_common(limit):
+        lines.append(f"{own[label]:7d} {own[label] / total:6.1%} {count:7d} {count / total:6.1%}  {label}")
+    return "\n".join(lines) + "\n"
+
+FORMATS = {"collapsed": collapsed, "top": top}
+
+profiler = SamplingProfiler()
+
+def profile_app(metrics_app):
+    """
+    Returns a WSGI application answering /profile with a profiling session and
+    every other path with metrics_app.
+
+    GET /profile?seconds=10&format=collapsed samples the stacks for the given
+    time (at most PROFILE_MAX_SECONDS) and returns them as collapsed stacks, or
+    as a table of functions with format=top.
+    """
+    def app(environ, start_response):
+        if environ.get("PATH_INFO") != "/profile":
+            return metrics_app(environ, start_response)
+        query = urllib.parse.parse_qs(environ.get("QUERY_STRING", ""))
+        try:
+            seconds = float(query.get("seconds", [PROFILE_DEFAULT_SECONDS])[0])
+            output_format = FORMATS[query.get("format", ["collapsed"])[0]]
+            if not 0 < seconds <= PROFILE_MAX_SECONDS:
+                raise ValueError(f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+        except (KeyError, ValueError) as e:
+            start_response("400 Bad Request", [("Content-Type", "text/plain")])
+            return [f"Bad profiling request: {e}\n".encode()]
+        try:
+            body = output_format(profiler.run(seconds)).encode()
+        except ProfilerBusyError as e:
+            start_response("409 Conflict", [("Content-Type", "text/plain")])
+            return [f"{e}\n".encode()]
+        start_response("200 OK", [("Content-Type", "text/plain; charset=utf-8")])
+        return [body]
+    return app
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+    daemon_threads = True
+
+class _SilentHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, address: str = "0.0.0.0",
+                         registry: CollectorRegistry = REGISTRY) -> wsgiref.simple_server.WSGIServer:
+    """
+    Serves the Prometheus metrics of the registry, and the /profile endpoint,
+    from a daemon thread, in place of prometheus_client.start_http_server.
+    """
+    server = wsgiref.simple_server.make_server(address, port, profile_app(make_wsgi_app(registry)),
+                                               _ThreadingWSGIServer, handler_class=_SilentHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+def write_profile(seconds: float = PROFILE_DEFAULT_SECONDS, output_path: str = PROFILE_OUTPUT_PATH) -> str:
+    """
+    Runs a profiling session and writes its collapsed stacks to a new file in
+    output_path.
+
+    Returns:
+        The path of the file, or None if another session was running.
+    """
+    try:
+        stacks = profiler.run(seconds)
+    except ProfilerBusyError:
+        return None
+    os.makedirs(output_path, exist_ok=True)
+    path = os.path.join(output_path, f"profile-{os.getpid()}-{datetime.datetime.now():%Y%m%d-%H%M%S}.txt")
+    with open(path, "w") as file:
+        file.write(collapsed(stacks))
+    print(f"Profile written to {path}")
+    return path
+
+def install_signal_handler(signum: int = signal.SIGUSR1) -> None:
+    """
+    Makes the signal start a profiling session of PROFILE_DEFAULT_SECONDS in the
+    background, written to PROFILE_OUTPUT_PATH, e.g. with kill -USR1 <pid>.
+    """
+    def handler(*args):
+        threading.Thread(target=write_profile, name="profiler", daemon=True).start()
+    signal.signal(signum, handler)
@@ -0,0 +1,58 @@
+from prometheus_client import Counter
+
+p_prediction_path = Counter("prediction_path", "Number of predictions by the path which settled them: "
+                            "rule_negative or model", ["path"])
+p_rule_negative = p_prediction_path.labels("rule_negative")
+p_model = p_prediction_path.labels("model")
+
+class RuleClassifier:
+    """
+    Cheap pre-classifier settling the clear-cut predictions before the model, in
+    the spirit of the NICE AKI algorithm: the most recent creatinine result is
+    compared with the patient's baseline, taken as the lowest of the recent
+    results in the model features.
+
+    A patient whose recent results are stable (the highest at most
+    negative_max_ratio times the lowest) and all below negative_max_value is
+    predicted negative. Anything else, including every positive prediction, is
+    left to the model: a rise over the baseline by a fixed ratio does not
+    always agree with it. The thresholds were chosen so that these decisions
+    agree with the model on history.csv and on generated features, as checked
+    by benchmarks/rule_fast_path.py, which should be run again when the model or
+    the thresholds change.
+    """
+    def __init__(self,
+                 negative_max_ratio: float,
+                 negative_max_value: float,
+                 enabled: bool = True) -> None:
+        self.negative_max_ratio = negative_max_ratio
+        self.negative_max_value = negative_max_value
+        self.enabled = enabled
+
+    def decide(self, features: list):
+        """
+        Returns 0 for features built by StorageManager.build_features (age, sex
+        and the most recent creatinine results, the latest last) which are
+        clearly negative, or None when the model has to be run.
+        """
+        if not self.enabled:
+            return None
+        results = features[2:]
+        baseline = min(results)
+        if baseline <= 0:
+            return None
+        highest = max(results)
+        if highest < self.negative_max_value and highest <= self.negative_max_ratio * baseline:
+            return 0
+        return None
+
+    def classify(self, features: list):
+        """
+        Same as decide, counting the path taken by the prediction.
+        """
+        prediction = self.decide(features)
+        if prediction is None:
+            p_model.inc()
+        else:
+            p_rule_negative.inc()
+        return prediction
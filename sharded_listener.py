@@ -0,0 +1,458 @@
+"""
+Sharded message listener.
+
+A front-end process reads the MLLP stream, frames and parses the messages and
+routes each one by its MRN to one of several worker processes. Every worker owns
+a shard of the patients, with its own StorageManager, message log and snapshot,
+and its own pager outbox; it applies, logs, predicts and pages exactly like the
+threaded engine, then reports back which messages it has committed. The
+front-end acknowledges messages in the order they were received, each one only
+once the shard owning it has committed it.
+
+All the messages of a patient go to the same worker, which handles them in the
+order they were received, so the per-patient ordering of the stream is kept.
+The routing depends on the number of workers, so the same number must be used
+for as long as the state is kept.
+
+The metrics of the workers are collected from them over a second pipe whenever
+the front-end's metrics are scraped, and served with a shard label.
+
+Usage:
+    python sharded_listener.py --workers 4
+"""
+import argparse
+import collections
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import threading
+import time
+import zlib
+
+import message_listener
+from message_listener import (build_ack, handle_message, predict_pending,
+                              p_overall_messages_received, p_overall_messages_acknowledged,
+                              p_message_latency, p_message_errors, p_frames_per_read, p_oversized_frames,
+                              p_feed_buffered_bytes, p_feed_paused,
+                              p_connection_closed_error, p_number_of_connection_attempts)
+from config import (MLLP_ADDRESS, MLLP_PORT, HISTORY_CSV_PATH, HISTORY_CACHE_PATH, PAGER_OUTBOX_PATH,
+                    PROMETHEUS_PORT, SHARD_WORKERS, SHARD_MAX_IN_FLIGHT, SHARD_RESUME_IN_FLIGHT)
+from storage_manager import StorageManager, p_sum_of_all_messages
+from alert_manager import AlertManager
+from message_parser import parse_frame
+import profiler
+from mllp import MLLPFramer, OVERSIZED_FRAME
+from stage_timing import MessageTiming
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge
+from prometheus_client.metrics_core import Metric
+
+p_shard_messages_in_flight = Gauge("shard_messages_in_flight", "Number of messages routed to a shard and not yet acknowledged")
+p_shard_restarts = Counter("shard_restarts", "Number of worker processes restarted after they stopped")
+
+# Time the front-end waits for the metrics of a worker when it is scraped
+SHARD_METRICS_TIMEOUT_SECONDS = 2
+
+def shard_of(mrn: str, num_shards: int) -> int:
+    """
+    Returns the shard owning a patient. The hash is stable across processes and runs.
+    """
+    return zlib.crc32(mrn.encode()) % num_shards
+
+def shard_message_log_path(message_log_filepath: str, shard: int) -> str:
+    """
+    Returns the message log of a shard, e.g. /state/message_log.shard1.bin for
+    /state/message_log.bin, keeping the extension which selects the log format.
+    """
+    root, extension = os.path.splitext(message_log_filepath)
+    return f"{root}.shard{shard}{extension}"
+
+def check_shard_count(message_log_filepath: str, num_shards: int) -> None:
+    """
+    Records the number of shards next to the message logs on the first start and
+    refuses to start with a different number, which would route patients to
+    shards that do not hold their state.
+
+    Raises:
+        ValueError: If the state was written by a different number of shards.
+    """
+    path = message_log_filepath + '.shards'
+    if os.path.exists(path):
+        with open(path) as file:
+            recorded = int(file.read())
+        if recorded != num_shards:
+            raise ValueError(f"The state in {os.path.dirname(path) or '.'} was written by {recorded} shards, not {num_shards}")
+        return
+    with open(path, 'w') as file:
+        file.write(str(num_shards))
+
+def serve_shard_metrics(connection: multiprocessing.connection.Connection) -> None:
+    """
+    Answers every request of the front-end with the metric families of the worker
+    process, until the front-end closes the pipe.
+    """
+    while True:
+        try:
+            connection.recv()
+            connection.send(list(REGISTRY.collect()))
+        except (EOFError, OSError):
+            return
+
+def run_shard(connection: multiprocessing.connection.Connection,
+              metrics_connection: multiprocessing.connection.Connection,
+              message_log_filepath: str,
+              history_csv_path: str,
+              history_cache_path: str,
+              outbox_path: str,
+              pager_address: tuple = None) -> None:
+    """
+    Main loop of a worker process. Receives batches of (sequence number, message)
+    from the front-end, handles them, commits the shard's message log and sends
+    back the sequence numbers of the batch once they are all handled. Stops when
+    it receives None; any other failure ends the process, which the front-end
+    restarts. Its metrics are sent on metrics_connection when asked for.
+    """
+    threading.Thread(target=serve_shard_metrics, args=(metrics_connection,), name="shard-metrics", daemon=True).start()
+    storage_manager = StorageManager(message_log_filepath=message_log_filepath, history_cache_path=history_cache_path,
+                                     load_model_in_background=True)
+    storage_manager.initialise_database(history_csv_path=history_csv_path)
+    if pager_address is None:
+        alert_manager = AlertManager(outbox_path=outbox_path)
+    else:
+        alert_manager = AlertManager(outbox_path=outbox_path, address=pager_address)
+    alert_manager.start()
+    connection.send(True)
+
+    try:
+        while True:
+            batch = connection.recv()
+            if batch is None:
+                break
+            time_message_received, messages = batch
+            pending = dict()
+            for _, message_object in messages:
+                try:
+                    handle_message(storage_manager, alert_manager, message_object, pending, time_message_received)
+                except ValueError:
+                    p_message_errors.inc()
+            predict_pending(storage_manager, alert_manager, pending, time_message_received)
+            storage_manager.commit_message_log()
+            connection.send([sequence for sequence, _ in messages])
+    finally:
+        storage_manager.close_message_log()
+        alert_manager.pool.stop()
+
+class ShardFailedError(Exception):
+    """
+    Raised when a worker process cannot be started.
+    """
+
+class ShardPool:
+    """
+    The worker processes of the sharded listener, each one connected to the
+    front-end by a pipe. A worker which has stopped is replaced with restart,
+    which recovers the shard from its snapshot and message log.
+    """
+    def __init__(self,
+                 num_shards: int,
+                 message_log_filepath: str,
+                 history_csv_path: str = HISTORY_CSV_PATH,
+                 history_cache_path: str = HISTORY_CACHE_PATH,
+                 outbox_path: str = PAGER_OUTBOX_PATH,
+                 pager_address: tuple = None) -> None:
+        check_shard_count(message_log_filepath, num_shards)
+        self.message_log_filepath = message_log_filepath
+        self.history_csv_path = history_csv_path
+        self.history_cache_path = history_cache_path
+        self.outbox_path = outbox_path
+        self.pager_address = pager_address
+        # Workers are forked, so that they inherit the loaded modules and the
+        # history cache mapping instead of importing and loading them again.
+        # This must happen before the front-end starts any thread, such as the
+        # metrics server, whose locks the workers would inherit in any state
+        self.connections = []
+        self.metrics_connections = []
+        self.processes = []
+        for shard in range(num_shards):
+            connection, metrics_connection, process = self._start(shard, multiprocessing.get_context('fork'))
+            self.connections.append(connection)
+            self.metrics_connections.append(metrics_connection)
+            self.processes.append(process)
+        # Wait until every shard has recovered its state
+        for shard in range(num_shards):
+            self._wait_until_ready(shard)
+
+    def _start(self, shard: int, context) -> tuple:
+        parent, child = context.Pipe()
+        metrics_parent, metrics_child = context.Pipe()
+        process = context.Process(target=run_shard, name=f"shard-{shard}", daemon=True,
+                                  args=(child, metrics_child, shard_message_log_path(self.message_log_filepath, shard),
+                                        self.history_csv_path, self.history_cache_path,
+                                        os.path.join(self.outbox_path, f"shard{shard}"), self.pager_address))
+        process.start()
+        child.close()
+        metrics_child.close()
+        return parent, metrics_parent, process
+
+    def _wait_until_ready(self, shard: int) -> None:
+        try:
+            self.connections[shard].recv()
+        except (EOFError, OSError) as e:
+            raise ShardFailedError(f"Shard {shard} stopped while recovering its state") from e
+
+    def restart(self, shard: int) -> None:
+        """
+        Replaces a worker which has stopped, and waits until the new one has
+        recovered the shard's state. The new worker is spawned rather than
+        forked, since the front-end is running threads by then.
+
+        Raises:
+            ShardFailedError: If the new worker stops before it is ready.
+        """
+        print(f"Shard {shard} stopped with exit code {self.processes[shard].exitcode}, restarting it")
+        p_shard_restarts.inc()
+        self.connections[shard].close()
+        self.metrics_connections[shard].close()
+        self.processes[shard].join()
+        (self.connections[shard], self.metrics_connections[shard],
+         self.processes[shard]) = self._start(shard, multiprocessing.get_context('spawn'))
+        self._wait_until_ready(shard)
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def stop(self) -> None:
+        """
+        Asks the workers to stop once they have handled what was sent to them, and waits for them.
+        """
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join()
+
+class ShardMetricsCollector:
+    """
+    Collects the metrics of the front-end together with those of every worker,
+    which are labelled with their shard. Each worker updates its own copy of the
+    metrics of the listener, the storage manager, the log and the pager, so they
+    are fetched from it at every scrape. A worker which does not answer within
+    SHARD_METRICS_TIMEOUT_SECONDS, as while it is restarted, is left out.
+    """
+    def __init__(self, shards: ShardPool, registry: CollectorRegistry = REGISTRY) -> None:
+        self.shards = shards
+        self.registry = registry
+        self._lock = threading.Lock()
+
+    def shard_families(self, shard: int) -> list:
+        """
+        Returns the metric families of a worker, or an empty list if it does not answer.
+        """
+        connection = self.shards.metrics_connections[shard]
+        try:
+            # An answer to an earlier request which timed out is not current
+            while connection.poll():
+                connection.recv()
+            connection.send(True)
+            if connection.poll(SHARD_METRICS_TIMEOUT_SECONDS):
+                return connection.recv()
+        except (EOFError, OSError):
+            pass
+        return []
+
+    def collect(self):
+        families = {}
+        for family in self.registry.collect():
+            families[family.name] = family
+        with self._lock:
+            for shard in range(len(self.shards)):
+                for family in self.shard_families(shard):
+                    if family.name not in families:
+                        families[family.name] = Metric(family.name, family.documentation, family.type, family.unit)
+                    families[family.name].samples.extend(
+                        sample._replace(labels={**sample.labels, "shard": str(shard)}) for sample in family.samples)
+        return families.values()
+
+def listen_for_messages_sharded(shards: ShardPool,
+                                address: tuple[str, int] = (MLLP_ADDRESS, MLLP_PORT),
+                                retries: int = 20,
+                                start_delay: float = 1.0,
+                                max_delay: float = 30.0,
+                                max_in_flight: int = SHARD_MAX_IN_FLIGHT,
+                                resume_in_flight: int = SHARD_RESUME_IN_FLIGHT) -> None:
+    """Receives HL7 messages over a socket and routes them to the shards.
+
+    Messages which cannot be parsed are not routed, and are acknowledged in
+    their turn like the others; oversized frames are rejected with an AE ACK.
+    Once max_in_flight messages wait for their shard, the socket is not read
+    until no more than resume_in_flight are left.
+
+    When a worker stops, it is restarted and the connection is dropped, so
+    that the peer sends again the messages which were not acknowledged. If it
+    cannot be restarted, ShardFailedError is raised.
+
+    Args:
+        shards (ShardPool): The started worker processes.
+        address (tuple[str, int]): Hostname and port number for the socket
+                                   connection.
+        retries (int): number of reconnection attempts.
+        start_delay (float): Initial delay between reconnection attempts
+                            in seconds. Delays increase exponentially.
+        max_delay (float): Maximum delay between reconnection attempts
+                           in seconds.
+        max_in_flight (int): Maximum number of messages waiting for a shard.
+        resume_in_flight (int): Number of messages waiting for a shard under
+                                which reading resumes.
+    """
+    source = f"{address[0]}:{address[1]}"
+    attempt_count = 0
+    delay = start_delay
+    sequence = 0
+    while not message_listener.stopping_condition and attempt_count < retries:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                print("Attempting to connect...")
+                p_number_of_connection_attempts.inc()
+                s.connect(address)
+                print("Connected!")
+                attempt_count = 0
+                delay = start_delay
+
+                framer = MLLPFramer(source)
+                # Sequence numbers of the messages waiting for an ACK, in the order
+                # they were received, with the time they were received, their
+                # stage timing and when they were routed to their shard
+                in_flight = collections.deque()
+                committed = set()
+                # Sequence numbers of the oversized frames, acknowledged with AE
+                rejected = set()
+                first_sequence = sequence
+                buffered_bytes = p_feed_buffered_bytes.labels(source)
+                paused = p_feed_paused.labels(source)
+                paused.set(0)
+                reading = True
+
+                while not message_listener.stopping_condition:
+                    if reading and len(in_flight) >= max_in_flight:
+                        reading = False
+                        paused.set(1)
+                    elif not reading and len(in_flight) <= resume_in_flight:
+                        reading = True
+                        paused.set(0)
+                    waiting = list(shards.connections)
+                    if reading:
+                        waiting.append(s)
+                    for ready in multiprocessing.connection.wait(waiting):
+                        if ready is s:
+                            r = s.recv(65536)
+                            if len(r) == 0:
+                                p_connection_closed_error.inc()
+                                raise ConnectionError(f"{source}: connection closed by peer")
+                            time_message_received = time.time()
+                            received_ns = time.perf_counter_ns()
+                            received = framer.feed(r)
+                            framing_ns = time.perf_counter_ns() - received_ns
+                            p_frames_per_read.observe(len(received))
+                            buffered_bytes.set(framer.buffered_bytes)
+                            batches = collections.defaultdict(list)
+                            for frame in received:
+                                p_sum_of_all_messages.inc()
+                                p_overall_messages_received.inc()
+                                timing = MessageTiming(received_ns)
+                                timing.add("framing", framing_ns)
+                                if frame is OVERSIZED_FRAME:
+                                    p_oversized_frames.inc()
+                                    committed.add(sequence)
+                                    rejected.add(sequence)
+                                    in_flight.append((sequence, time_message_received, timing, time.perf_counter_ns()))
+                                    sequence += 1
+                                    continue
+                                try:
+                                    start = time.perf_counter_ns()
+                                    message_object = parse_frame(frame)
+                                    routed = time.perf_counter_ns()
+                                    timing.add("parse", routed - start)
+                                    timing.identify(message_object)
+                                    batches[shard_of(message_object.mrn, len(shards))].append((sequence, message_object))
+                                except ValueError:
+                                    p_message_errors.inc()
+                                    committed.add(sequence)
+                                    routed = time.perf_counter_ns()
+                                in_flight.append((sequence, time_message_received, timing, routed))
+                                sequence += 1
+                            for shard, messages in batches.items():
+                                try:
+                                    shards.connections[shard].send((time_message_received, messages))
+                                except OSError:
+                                    shards.restart(shard)
+                                    raise ConnectionError(f"shard {shard} stopped")
+                        else:
+                            try:
+                                numbers = ready.recv()
+                            except (EOFError, OSError):
+                                shard = shards.connections.index(ready)
+                                shards.restart(shard)
+                                raise ConnectionError(f"shard {shard} stopped")
+                            # Sequence numbers from an earlier connection are not acknowledged
+                            committed.update(n for n in numbers if n >= first_sequence)
+
+                    acks = []
+                    timings = []
+                    start = time.perf_counter_ns()
+                    while in_flight and in_flight[0][0] in committed:
+                        n, time_message_received, timing, routed = in_flight.popleft()
+                        committed.discard(n)
+                        if n in rejected:
+                            rejected.discard(n)
+                            acks.append(build_ack("AE"))
+                        else:
+                            acks.append(build_ack())
+                        # The time taken by the shard, and waiting for the messages before it
+                        timing.add("shard", start - routed)
+                        timings.append(timing)
+                        p_overall_messages_acknowledged.inc()
+                        p_message_latency.observe(time.time() - time_message_received)
+                    if acks:
+                        s.sendall(b"".join(acks))
+                        acknowledged = time.perf_counter_ns()
+                        for timing in timings:
+                            timing.add("ack", acknowledged - start)
+                            timing.finish(acknowledged)
+                    p_shard_messages_in_flight.set(len(in_flight))
+
+        except ShardFailedError:
+            raise
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+            attempt_count += 1
+            print(f"Attempting to reconnect, attempt {attempt_count}.")
+
+        if attempt_count == retries:
+            print("Maximum reconnection attempts reached, stopping.")
+            message_listener.stopping_condition = True
+        print("Closing server socket.")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sharded AKI Prediction System')
+    parser.add_argument('--workers', type=int, default=SHARD_WORKERS, help='Number of worker processes')
+    parser.add_argument('--history-dir', type=str, default=HISTORY_CSV_PATH, help='Path to history CSV file')
+    args = parser.parse_args()
+
+    # The workers are forked before the metrics server thread and the signal
+    # handlers exist, so that they inherit neither
+    shards = ShardPool(args.workers, message_listener.default_message_log_path(), history_csv_path=args.history_dir)
+    registry = CollectorRegistry()
+    registry.register(ShardMetricsCollector(shards))
+    profiler.start_metrics_server(PROMETHEUS_PORT, registry=registry)
+    profiler.install_signal_handler()
+    signal.signal(signal.SIGTERM, message_listener.shutdown)
+    try:
+        listen_for_messages_sharded(shards)
+    finally:
+        shards.stop()
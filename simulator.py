@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+import csv
 import datetime
 import http.server
+import json
+import random
 import signal
 import socket
 import threading
 import time
 
+from mllp import MLLPFramer, parse_mllp_messages, MLLP_START_OF_BLOCK, MLLP_END_OF_BLOCK, MLLP_CARRIAGE_RETURN
+
 VERSION = "0.0.0"
 MLLP_BUFFER_SIZE = 1024
 MLLP_TIMEOUT_SECONDS = 10
@@ -15,7 +21,7 @@ SHUTDOWN_POLL_INTERVAL_SECONDS = 2
 
 def serve_mllp_client(client, source, messages, shutdown_mllp, short_messages):
     i = 0
-    buffer = b""
+    framer = MLLPFramer(source)
     while i < len(messages) and not shutdown_mllp.is_set():
         try:
             mllp = bytes(chr(MLLP_START_OF_BLOCK), "ascii")
@@ -32,8 +38,7 @@ def serve_mllp_client(client, source, messages, shutdown_mllp, short_messages):
                 r = client.recv(MLLP_BUFFER_SIZE)
                 if len(r) == 0:
                     raise Exception("client closed connection")
-                buffer += r
-                received, buffer = parse_mllp_messages(buffer, source)
+                received = framer.feed(r)
             acked, error = verify_ack(received)
             if error:
                 raise Exception(error)
@@ -58,7 +63,7 @@ HL7_MSA_ACK_CODE_ACCEPT = b"AA"
 def verify_ack(messages):
     if len(messages) != 1:
         return False, f"Expected 1 ack message, found {len(messages)}"
-    segments =  messages[0].split(b"\r")
+    segments =  bytes(messages[0]).split(b"\r")
     segment_types = [s.split(b"|")[0] for s in segments]
     if b"MSH" not in segment_types:
         return False, "Expected MSH segment"
@@ -88,31 +93,217 @@ def run_mllp_server(host, port, hl7_messages, shutdown_mllp, short_messages):
             t.start()
         print("mllp: graceful shutdown")
 
-MLLP_START_OF_BLOCK = 0x0b
-MLLP_END_OF_BLOCK = 0x1c
-MLLP_CARRIAGE_RETURN = 0x0d
+# Load generation: synthetic ADT^A01, ORU^R01 and ADT^A03 streams for the MRNs of
+# history.csv, sent at a target rate with up to a window of unacknowledged messages.
 
-def parse_mllp_messages(buffer, source):
-    i = 0
-    messages = []
-    consumed = 0
-    expect = MLLP_START_OF_BLOCK
-    while i < len(buffer):
-        if expect is not None:
-            if buffer[i] != expect:
-                raise Exception(f"{source}: bad MLLP encoding: want {hex(expect)}, found {hex(buffer[i])}")
-            if expect == MLLP_START_OF_BLOCK:
-                expect = None
-                consumed = i
-            elif expect == MLLP_CARRIAGE_RETURN:
-                messages.append(buffer[consumed+1:i-1])
-                expect = MLLP_START_OF_BLOCK
-                consumed = i + 1
-        else:
-            if buffer[i] == MLLP_END_OF_BLOCK:
-                expect = MLLP_CARRIAGE_RETURN
-        i += 1
-    return messages, buffer[consumed:]
+LOAD_ACTIVE_PATIENTS = 20
+
+def read_history_mrns(filename):
+    with open(filename, "r") as r:
+        reader = csv.reader(r)
+        next(reader, None)
+        return [row[0] for row in reader if row]
+
+def patient_messages(mrn, rng):
+    sex = rng.choice("MF")
+    dob = f"{rng.randint(1930, 2005)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+    yield ["MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||{now}||ADT^A01|||2.5",
+           f"PID|1||{mrn}||PATIENT {mrn}||{dob}|{sex}"]
+    baseline = rng.uniform(50, 120)
+    for _ in range(rng.randint(1, 4)):
+        value = baseline * rng.choice([1.0, 1.0, 1.1, 1.6, 2.2])
+        yield ["MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||{now}||ORU^R01|||2.5",
+               f"PID|1||{mrn}",
+               "OBR|1||||||{now}",
+               f"OBX|1|SN|CREATININE||{value:.2f}"]
+    yield ["MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||{now}||ADT^A03|||2.5",
+           f"PID|1||{mrn}"]
+
+def generate_messages(mrns, seed):
+    """
+    Yields (mrn, message type, segments) forever, interleaving the stays of up to
+    LOAD_ACTIVE_PATIENTS patients admitted at the same time. A patient is only
+    admitted again once discharged, so every stream is valid for the detector.
+    """
+    rng = random.Random(seed)
+    waiting = collections.deque(mrns)
+    active = []
+    while True:
+        while len(active) < LOAD_ACTIVE_PATIENTS and waiting:
+            mrn = waiting.popleft()
+            active.append((mrn, patient_messages(mrn, rng)))
+        i = rng.randrange(len(active))
+        mrn, messages = active[i]
+        segments = next(messages, None)
+        if segments is None:
+            active.pop(i)
+            waiting.append(mrn)
+            continue
+        yield mrn, segments[0].split("|")[8], segments
+
+class LoadStats:
+    """
+    Measurements shared by the connections and the pager.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = None
+        self.end = None
+        self.sent = 0
+        self.acked = 0
+        self.ack_latencies = []
+        self.paging_latencies = []
+        self.pages = 0
+        # Time at which the latest test result of each patient was sent
+        self.last_result_sent = {}
+        self.connections_done = 0
+
+    def record_page(self, mrn, received_at):
+        with self.lock:
+            self.pages += 1
+            sent_at = self.last_result_sent.get(mrn)
+            if sent_at is not None:
+                self.paging_latencies.append(received_at - sent_at)
+
+    def report(self):
+        with self.lock:
+            end = self.end or time.monotonic()
+            elapsed = end - self.start if self.start else 0
+            return {
+                "messages_sent": self.sent,
+                "messages_acked": self.acked,
+                "elapsed_seconds": elapsed,
+                "throughput": self.acked / elapsed if elapsed else 0,
+                "ack_latency_seconds": latency_summary(self.ack_latencies),
+                "pages": self.pages,
+                "paging_latency_seconds": latency_summary(self.paging_latencies),
+            }
+
+def latency_summary(latencies):
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+    return {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99), "max": ordered[-1]}
+
+def serve_load_client(client, source, stream, count, rate, window, poisson, stats, shutdown_mllp):
+    """
+    Sends count messages of stream on one connection. Messages are sent at rate
+    messages per second (as fast as possible when 0), evenly spaced or with
+    Poisson arrivals, while fewer than window are waiting for their ACK (no limit
+    when 0). ACKs are read by a second thread and matched to messages in order.
+    """
+    framer = MLLPFramer(source)
+    in_flight = collections.deque()
+    window_open = threading.Condition()
+    rng = random.Random(source)
+    failed = threading.Event()
+
+    def read_acks():
+        received = 0
+        try:
+            while received < count and not shutdown_mllp.is_set():
+                r = client.recv(MLLP_BUFFER_SIZE)
+                if len(r) == 0:
+                    raise Exception("client closed connection")
+                now = time.monotonic()
+                for frame in framer.feed(r):
+                    acked, error = verify_ack([frame])
+                    if error:
+                        raise Exception(error)
+                    if not acked:
+                        print(f"mllp: {source}: message not acknowledged")
+                    with window_open:
+                        sent_at = in_flight.popleft()
+                        window_open.notify()
+                    received += 1
+                    with stats.lock:
+                        stats.acked += 1
+                        stats.ack_latencies.append(now - sent_at)
+        except Exception as e:
+            print(f"mllp: {source}: {e}")
+            failed.set()
+            with window_open:
+                window_open.notify()
+
+    reader = threading.Thread(target=read_acks, daemon=True)
+    reader.start()
+    next_send = time.monotonic()
+    for _ in range(count):
+        if shutdown_mllp.is_set() or failed.is_set():
+            break
+        if rate > 0:
+            next_send += rng.expovariate(rate) if poisson else 1 / rate
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        with window_open:
+            while window > 0 and len(in_flight) >= window and not failed.is_set():
+                window_open.wait()
+        mrn, message_type, segments = next(stream)
+        now = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        mllp = bytes(chr(MLLP_START_OF_BLOCK), "ascii")
+        mllp += bytes("\r".join(segments).replace("{now}", now) + "\r", "ascii")
+        mllp += bytes(chr(MLLP_END_OF_BLOCK) + chr(MLLP_CARRIAGE_RETURN), "ascii")
+        sent_at = time.monotonic()
+        with window_open:
+            in_flight.append(sent_at)
+        with stats.lock:
+            stats.sent += 1
+            if message_type == "ORU^R01":
+                stats.last_result_sent[mrn] = sent_at
+        try:
+            client.sendall(mllp)
+        except OSError as e:
+            print(f"mllp: {source}: {e}")
+            break
+    reader.join()
+    print(f"mllp: {source}: closing connection: end of load")
+    client.close()
+
+def run_load_server(host, port, mrns, flags, stats, shutdown_mllp):
+    """
+    Accepts flags.connections connections, each one fed with the messages of its
+    own share of the patients, and prints the report once all of them are done.
+    """
+    per_connection = [flags.count // flags.connections + (i < flags.count % flags.connections)
+                      for i in range(flags.connections)]
+    rate = flags.rate / flags.connections
+    threads = []
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((host, port))
+        s.settimeout(SHUTDOWN_POLL_INTERVAL_SECONDS)
+        s.listen(flags.connections)
+        print(f"mllp: listening on {host}:{port}, generating load")
+        while len(threads) < flags.connections and not shutdown_mllp.is_set():
+            try:
+                client, (client_host, client_port) = s.accept()
+            except TimeoutError:
+                continue
+            source = f"{client_host}:{client_port}"
+            print(f"mllp: {source}: accepted connection")
+            client.settimeout(MLLP_TIMEOUT_SECONDS)
+            i = len(threads)
+            with stats.lock:
+                if stats.start is None:
+                    stats.start = time.monotonic()
+            stream = generate_messages(mrns[i::flags.connections], seed=i)
+            t = threading.Thread(target=serve_load_client, daemon=True,
+                                 args=(client, source, stream, per_connection[i], rate, flags.window,
+                                       flags.arrivals == "poisson", stats, shutdown_mllp))
+            t.start()
+            threads.append(t)
+    for t in threads:
+        t.join()
+    with stats.lock:
+        stats.end = time.monotonic()
+    report = json.dumps(stats.report(), indent=2)
+    print(report)
+    if flags.report:
+        with open(flags.report, "w") as w:
+            w.write(report)
 
 def read_hl7_messages(filename):
     with open(filename, "rb") as r:
@@ -124,8 +315,9 @@ def read_hl7_messages(filename):
 
 class PagerRequestHandler(http.server.BaseHTTPRequestHandler):
 
-    def __init__(self, shutdown, *args, **kwargs):
+    def __init__(self, shutdown, stats, *args, **kwargs):
         self.shutdown = shutdown
+        self.stats = stats
         super().__init__(*args, **kwargs)
 
     def do_POST(self):
@@ -136,6 +328,8 @@ class PagerRequestHandler(http.server.BaseHTTPRequestHandler):
             self.do_POST_healthy()
         elif self.path == "/shutdown":
             self.do_POST_shutdown()
+        elif self.path == "/stats" and self.stats is not None:
+            self.do_GET_stats()
         else:
             print("pager: bad request: not /page")
             self.send_response(http.HTTPStatus.BAD_REQUEST)
@@ -175,7 +369,9 @@ class PagerRequestHandler(http.server.BaseHTTPRequestHandler):
                 self.send_response(http.HTTPStatus.BAD_REQUEST, error)
                 self.end_headers()
                 return
-        if timestamp:
+        if self.stats is not None:
+            self.stats.record_page(parts[0], time.monotonic())
+        elif timestamp:
             print(f"pager: paging for MRN {mrn} at {timestamp}")
         else:
             print(f"pager: paging for MRN {mrn}")
@@ -190,6 +386,12 @@ class PagerRequestHandler(http.server.BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(b"ok\n")
 
+    def do_GET_stats(self):
+        self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(bytes(json.dumps(self.stats.report()), "ascii"))
+
     def do_POST_shutdown(self):
         self.send_response(http.HTTPStatus.OK)
         self.send_header("Content-Type", "text/plain")
@@ -206,10 +408,24 @@ def main():
     parser.add_argument("--mllp", default=8440, type=int, help="Port on which to replay HL7 messages via MLLP")
     parser.add_argument("--pager", default=8441, type=int, help="Post on which to listen for pager requests via HTTP")
     parser.add_argument("--short_messages", default=False, action="store_true", help="Encourage all outgoing messages to be split in two")
+    parser.add_argument("--generate", default=False, action="store_true", help="Generate synthetic load instead of replaying --messages")
+    parser.add_argument("--history", default="history.csv", help="With --generate: the patients whose messages are generated")
+    parser.add_argument("--count", default=10000, type=int, help="With --generate: number of messages to send in total")
+    parser.add_argument("--rate", default=0, type=float, help="With --generate: target messages per second in total, 0 for as fast as possible")
+    parser.add_argument("--arrivals", default="uniform", choices=["uniform", "poisson"], help="With --generate and --rate: evenly spaced or Poisson (open loop) arrivals")
+    parser.add_argument("--connections", default=1, type=int, help="With --generate: number of concurrent connections to feed")
+    parser.add_argument("--window", default=1, type=int, help="With --generate: maximum unacknowledged messages per connection, 0 for no limit")
+    parser.add_argument("--report", default=None, help="With --generate: also write the report to this JSON file")
     flags = parser.parse_args()
-    hl7_messages = read_hl7_messages(flags.messages)
     shutdown_event = threading.Event()
-    mllp_thread = threading.Thread(target=run_mllp_server, args=("0.0.0.0", flags.mllp, hl7_messages, shutdown_event, flags.short_messages), daemon=True)
+    stats = None
+    if flags.generate:
+        stats = LoadStats()
+        mrns = read_history_mrns(flags.history)
+        mllp_thread = threading.Thread(target=run_load_server, args=("0.0.0.0", flags.mllp, mrns, flags, stats, shutdown_event), daemon=True)
+    else:
+        hl7_messages = read_hl7_messages(flags.messages)
+        mllp_thread = threading.Thread(target=run_mllp_server, args=("0.0.0.0", flags.mllp, hl7_messages, shutdown_event, flags.short_messages), daemon=True)
     mllp_thread.start()
     pager = None
     def shutdown():
@@ -218,7 +434,7 @@ def main():
         pager.shutdown()
     signal.signal(signal.SIGTERM, lambda signal, frame: shutdown())
     def new_pager_handler(*args, **kwargs):
-        return PagerRequestHandler(shutdown, *args, **kwargs)
+        return PagerRequestHandler(shutdown, stats, *args, **kwargs)
     pager = http.server.ThreadingHTTPServer(("0.0.0.0", flags.pager), new_pager_handler)
     print(f"pager: listening on 0.0.0.0:{flags.pager}")
     pager_thread = threading.Thread(target=pager.serve_forever, args=(), kwargs={"poll_interval": SHUTDOWN_POLL_INTERVAL_SECONDS}, daemon=True)
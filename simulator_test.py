@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import http
+import json
 import os
 import shutil
 import socket
@@ -178,5 +179,69 @@ class SimulatorTest(unittest.TestCase):
                 self.simulator.kill()
             shutil.rmtree(self.directory)
 
+class LoadGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.simulator = subprocess.Popen([
+            "./simulator.py",
+            f"--mllp={TEST_MLLP_PORT}",
+            f"--pager={TEST_PAGER_PORT}",
+            "--generate",
+            "--history=history.csv",
+            "--count=50",
+            "--window=10",
+            f"--report={os.path.join(self.directory, 'report.json')}",
+        ], stdout=subprocess.DEVNULL)
+        self.assertTrue(wait_until_healthy(self.simulator, f"localhost:{TEST_PAGER_PORT}"))
+
+    def test_generated_stream_is_valid_and_reported(self):
+        framer = simulator.MLLPFramer("test")
+        messages = []
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.connect(("localhost", TEST_MLLP_PORT))
+            while True:
+                buffer = s.recv(1024)
+                if len(buffer) == 0:
+                    break
+                for frame in framer.feed(buffer):
+                    messages.append(str(frame[:-1], "ascii").split("\r"))
+                    s.sendall(to_mllp(ACK))
+        self.assertEqual(len(messages), 50)
+
+        # Every patient is admitted before their results and discharge
+        admitted = set()
+        for segments in messages:
+            message_type = segments[0].split("|")[8]
+            mrn = segments[1].split("|")[3]
+            if message_type == "ADT^A01":
+                self.assertNotIn(mrn, admitted)
+                admitted.add(mrn)
+            else:
+                self.assertIn(mrn, admitted)
+                if message_type == "ADT^A03":
+                    admitted.remove(mrn)
+
+        urllib.request.urlopen(f"http://localhost:{TEST_PAGER_PORT}/page", data=bytes(mrn, "ascii"))
+        for _ in range(20):
+            if os.path.exists(os.path.join(self.directory, "report.json")):
+                break
+            time.sleep(0.1)
+        stats = json.loads(urllib.request.urlopen(f"http://localhost:{TEST_PAGER_PORT}/stats").read())
+        self.assertEqual(stats["messages_acked"], 50)
+        self.assertEqual(stats["pages"], 1)
+        self.assertLessEqual(stats["ack_latency_seconds"]["p50"], stats["ack_latency_seconds"]["max"])
+
+    def tearDown(self):
+        try:
+            r = urllib.request.urlopen(f"http://localhost:{TEST_PAGER_PORT}/shutdown")
+            self.assertEqual(r.status, http.HTTPStatus.OK)
+            self.simulator.wait()
+            self.assertEqual(self.simulator.returncode, 0)
+        finally:
+            if self.simulator.poll() is None:
+                self.simulator.kill()
+            shutil.rmtree(self.directory)
+
 if __name__ == "__main__":
     unittest.main()
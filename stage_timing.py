@@ -0,0 +1,149 @@
+import bisect
+import threading
+import time
+
+from prometheus_client import Counter
+from prometheus_client.core import REGISTRY, HistogramMetricFamily
+
+from config import SLOW_MESSAGE_BUDGET_MS, SLOW_MESSAGE_LOG_INTERVAL_SECONDS
+from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
+
+p_slow_messages = Counter("slow_messages", "Number of messages acknowledged later than SLOW_MESSAGE_BUDGET_MS after they were read")
+
+# The label of each message type; messages which could not be parsed are "invalid"
+MESSAGE_TYPES = {
+    PatientAdmissionMessage: "ADT^A01",
+    TestResultMessage: "ORU^R01",
+    PatientDischargeMessage: "ADT^A03",
+}
+INVALID = "invalid"
+
+STAGE_BUCKETS = [0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5]
+
+class StageHistograms:
+    """
+    Histograms of the time spent by messages in each stage, by stage and message
+    type, exported to Prometheus as message_stage_duration_seconds.
+
+    A prometheus_client Histogram takes microseconds per observation, which
+    adds up over the stages of every message; these histograms only count
+    observations in plain lists, and are turned into a histogram when scraped.
+    """
+    def __init__(self, buckets: list = STAGE_BUCKETS) -> None:
+        self.buckets = buckets
+        self.bounds_ns = [int(bound * 1e9) for bound in buckets]
+        # The count of each bucket, the last one unbounded, and the sum in
+        # nanoseconds, by (stage, message type)
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, message_type: str, duration_ns: int) -> None:
+        with self._lock:
+            self._observe(stage, message_type, duration_ns)
+
+    def observe_all(self, message_type: str, stages: dict) -> None:
+        """
+        Records the duration of several stages of one message, as {stage: nanoseconds}.
+        """
+        with self._lock:
+            for stage, duration_ns in stages.items():
+                self._observe(stage, message_type, duration_ns)
+
+    def _observe(self, stage: str, message_type: str, duration_ns: int) -> None:
+        series = self._series.get((stage, message_type))
+        if series is None:
+            series = self._series[(stage, message_type)] = [[0] * (len(self.bounds_ns) + 1), 0]
+        series[0][bisect.bisect_left(self.bounds_ns, duration_ns)] += 1
+        series[1] += duration_ns
+
+    def collect(self):
+        histogram = HistogramMetricFamily("message_stage_duration_seconds",
+                                          "Time spent by a message in each stage of the listener, by message type",
+                                          labels=["stage", "message_type"])
+        with self._lock:
+            series = [(labels, list(counts), total_ns) for labels, (counts, total_ns) in self._series.items()]
+        for labels, counts, total_ns in series:
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+            histogram.add_metric(list(labels), buckets, total_ns / 1e9)
+        yield histogram
+
+stage_histograms = StageHistograms()
+REGISTRY.register(stage_histograms)
+
+def observe_stage(stage: str, message_type: str, duration_ns: int) -> None:
+    """
+    Records the time spent by one message in a stage.
+    """
+    stage_histograms.observe(stage, message_type, duration_ns)
+
+class SlowMessageLog:
+    """
+    Prints the stage breakdown of messages over budget, no more than once every
+    interval seconds so that a stall does not flood the output; the messages
+    not printed are counted in the next line.
+    """
+    def __init__(self, budget_ms: float = SLOW_MESSAGE_BUDGET_MS, interval: float = SLOW_MESSAGE_LOG_INTERVAL_SECONDS) -> None:
+        self.budget_ns = int(budget_ms * 1e6)
+        self.interval = interval
+        self.last_logged = float("-inf")
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def record(self, timing: "MessageTiming", total_ns: int) -> None:
+        if total_ns <= self.budget_ns:
+            return
+        p_slow_messages.inc()
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_logged < self.interval:
+                self.suppressed += 1
+                return
+            self.last_logged = now
+            suppressed, self.suppressed = self.suppressed, 0
+        print(f"Slow message: {timing.describe(total_ns)}"
+              + (f" ({suppressed} more slow messages since the last report)" if suppressed else ""))
+
+slow_message_log = SlowMessageLog()
+
+class MessageTiming:
+    """
+    The time one message spends in each stage of the listener, from the moment
+    it was read from the socket to its ACK, measured with perf_counter_ns.
+
+    Stages shared by several messages, such as framing the read they came in,
+    committing the log or sending the ACKs, are added to each of them, so that
+    the stages of a message add up to its latency; the rest of it, spent
+    waiting, is reported as "waiting" by the slow message log.
+    """
+    __slots__ = ('received_ns', 'message_type', 'stages')
+
+    def __init__(self, received_ns: int) -> None:
+        self.received_ns = received_ns
+        self.message_type = INVALID
+        self.stages = dict()
+
+    def identify(self, message_object: object) -> None:
+        self.message_type = MESSAGE_TYPES.get(type(message_object), INVALID)
+
+    def add(self, stage: str, duration_ns: int) -> None:
+        self.stages[stage] = self.stages.get(stage, 0) + duration_ns
+
+    def finish(self, acknowledged_ns: int = None) -> None:
+        """
+        Records the stages of the message, once it has been acknowledged, and logs
+        it if it is over budget.
+        """
+        if acknowledged_ns is None:
+            acknowledged_ns = time.perf_counter_ns()
+        stage_histograms.observe_all(self.message_type, self.stages)
+        slow_message_log.record(self, acknowledged_ns - self.received_ns)
+
+    def describe(self, total_ns: int) -> str:
+        stages = ", ".join(f"{stage} {duration_ns / 1e6:.3f} ms" for stage, duration_ns in self.stages.items())
+        waiting_ns = total_ns - sum(self.stages.values())
+        return (f"{self.message_type} acknowledged after {total_ns / 1e6:.3f} ms: "
+                f"{stages}, waiting {waiting_ns / 1e6:.3f} ms")
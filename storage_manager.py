@@ -1,15 +1,31 @@
 import csv
 import datetime
-import pandas as pd
+import glob
+import io
+import mmap
 import os
+import pickle
+import shutil
+import threading
+import time
 import argparse
-import joblib
 import numpy as np
-from config import MESSAGE_LOG_CSV_PATH, MESSAGE_LOG_CSV_FIELDS, MODEL_PATH
-from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
+from config import (MESSAGE_LOG_CSV_PATH, MESSAGE_LOG_CSV_FIELDS, MODEL_PATH,
+                    MESSAGE_LOG_SYNC_POLICY, MESSAGE_LOG_SYNC_RECORDS, MESSAGE_LOG_SYNC_INTERVAL_MS,
+                    SNAPSHOT_INTERVAL_MESSAGES, PREDICTION_CACHE_SIZE, PREDICTION_CACHE_DECIMALS,
+                    MODEL_CHECK_INTERVAL_SECONDS, RULE_FAST_PATH, RULE_NEGATIVE_MAX_RATIO,
+                    RULE_NEGATIVE_MAX_VALUE)
+from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage, PositiveAKIPredictionMessage
 import copy
+from compiled_forest import CompiledForest
+from prediction_cache import PredictionCache
+from rule_classifier import RuleClassifier
+from write_ahead_log import WriteAheadLog
+from history_store import HistoryStore
+from patient_record import FEATURE_RESULTS, PatientRecord
+from binary_log import FILE_HEADER, complete_length, convert_csv_to_binary, encode_message, message_from_csv_row, read_log
 
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge, Histogram
 
 p_sum_of_all_messages = Counter("sum_of_all_messages", "Number of all messages received AND reinstated")
 p_sum_of_positive_aki_predictions = Counter("sum_of_positive_aki_predictions", "Number of all aki predictions from received AND reinstated")
@@ -19,8 +35,86 @@ p_reinstantiated_overall = Counter("reinstantiated_overall", "Number of overall
 p_reinstantiated_admission = Counter("reinstantiated_admission", "Number of admission messages reinstantiated")
 p_reinstantiated_discharge = Counter("reinstantiated_discharge", "Number of discarded admission reinstantiated")
 p_reinstantiated_test_result = Counter("reinstantiated_test_result", "Number of test result messages reinstantiated")
+p_reinstantiated_positive_prediction = Counter("reinstantiated_positive_prediction", "Number of positive AKI predictions reinstantiated")
 p_reinstantiation_errors = Counter("reinstantiation_errors", "Number of errors during message instantiation")
 
+p_snapshots = Counter("snapshots", "Number of state snapshots written")
+p_snapshot_duration = Histogram("snapshot_duration_seconds", "Time taken to write a state snapshot")
+p_snapshot_bytes = Gauge("snapshot_bytes", "Size of the latest state snapshot")
+p_log_segments_compacted = Counter("log_segments_compacted", "Number of message log segments removed after a snapshot")
+p_recovery_duration = Gauge("recovery_duration_seconds", "Time taken by the last recovery from snapshot and message log")
+p_recovery_replayed_messages = Gauge("recovery_replayed_messages", "Number of messages replayed by the last recovery")
+p_recovery_truncated_bytes = Gauge("recovery_truncated_bytes", "Number of bytes of a torn record removed from the end of the message log by the last recovery")
+
+# Version of the snapshot file layout
+SNAPSHOT_VERSION = 4
+
+def segment_filepath(message_log_filepath: str, segment: int) -> str:
+    """
+    Returns the path of a sealed segment of a message log.
+    """
+    return f"{message_log_filepath}.{segment:06d}"
+
+def list_segments(message_log_filepath: str) -> list:
+    """
+    Returns the numbers of the sealed segments of a message log on disk, in order.
+    """
+    segments = []
+    for path in glob.glob(glob.escape(message_log_filepath) + '.[0-9]*'):
+        suffix = path[len(message_log_filepath) + 1:]
+        if suffix.isdigit():
+            segments.append(int(suffix))
+    return sorted(segments)
+
+def convert_message_log_to_binary(csv_path: str, binary_path: str) -> int:
+    """
+    Converts the state kept by a CSV message log, that is its snapshot, its sealed
+    segments and the log itself, to the binary format, unless there already is a
+    binary log. The snapshot does not depend on the log format and is copied.
+
+    A marker file exists while the conversion is in progress, so that a conversion
+    interrupted by a crash is started again from the CSV files, which are kept.
+
+    Returns:
+    int: The number of messages converted, or None if there was nothing to convert.
+    """
+    marker = binary_path + '.converting'
+    binary_files = [binary_path, binary_path + '.snapshot'] + [segment_filepath(binary_path, segment)
+                                                               for segment in list_segments(binary_path)]
+    csv_files = [csv_path, csv_path + '.snapshot'] + [segment_filepath(csv_path, segment)
+                                                      for segment in list_segments(csv_path)]
+    if os.path.exists(marker):
+        for path in binary_files:
+            if os.path.exists(path):
+                os.remove(path)
+    elif any(os.path.exists(path) for path in binary_files) or not any(os.path.exists(path) for path in csv_files):
+        return None
+    
+    directory = os.path.dirname(os.path.abspath(binary_path))
+    def fsync_directory():
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    open(marker, 'w').close()
+    fsync_directory()
+    count = 0
+    for segment in list_segments(csv_path):
+        count += convert_csv_to_binary(segment_filepath(csv_path, segment), segment_filepath(binary_path, segment))
+    if os.path.exists(csv_path + '.snapshot'):
+        shutil.copyfile(csv_path + '.snapshot', binary_path + '.snapshot.tmp')
+        with open(binary_path + '.snapshot.tmp', 'rb') as file:
+            os.fsync(file.fileno())
+        os.replace(binary_path + '.snapshot.tmp', binary_path + '.snapshot')
+    if os.path.exists(csv_path):
+        count += convert_csv_to_binary(csv_path, binary_path)
+    fsync_directory()
+    os.remove(marker)
+    fsync_directory()
+    return count
+
 class StorageManager:
     """
     Manages storage and retrieval of patient data both in-memory and in a database.
@@ -28,79 +122,138 @@ class StorageManager:
     def __init__(self,
                  fields: list = MESSAGE_LOG_CSV_FIELDS, 
                  message_log_filepath: str = MESSAGE_LOG_CSV_PATH,
-                 model_path: str = MODEL_PATH):
+                 model_path: str = MODEL_PATH,
+                 history_cache_path: str = None,
+                 load_model_in_background: bool = False):
         """
         Initializes the storage manager by setting up the database connection and sessionmaker.
+        
+        history.csv is compiled into a memory-mapped cache at history_cache_path, by
+        default next to history.csv. With load_model_in_background, the model is
+        loaded by a background thread while the state is recovered; the first
+        prediction waits for it.
         """
         # Stores creatinine results for all patients
-        # The file history.csv is imported and the data is stored in this dictionary
+        # The file history.csv is imported into this columnar store, used as a dictionary
         # The key is the MRN and the value is a list of creatinine results as floats
         # We only write to the creatinine_results_history when a patient is discharged
-        self.creatinine_results_history = dict()
+        self.creatinine_results_history = HistoryStore()
+        self.history_cache_path = history_cache_path
         
         
         # Stores data for patients currently admitted in the hospital
-        # The key is the MRN and the value is a dictionary containing patient information
+        # The key is the MRN and the value is a PatientRecord holding the patient's information
         # Entries are added when a patient is admitted and removed when a patient is discharged
         self.current_patients = dict()
         
         self.message_log_filepath = message_log_filepath
         self.fields = fields
+        # Logs ending in .bin use the binary format of binary_log.py, others are CSV
+        self.message_log_format = 'binary' if message_log_filepath.endswith('.bin') else 'csv'
+        
+        # The message log stays open between messages; it is opened on the first append.
+        # The lock keeps appends from other threads out of a snapshot in progress.
+        self.message_log = None
+        self.message_log_lock = threading.RLock()
+        # LSNs carry on from one opening of the log to the next, so that an LSN
+        # of a log closed by a snapshot is already committed in the new one
+        self.message_log_lsn = 0
         
-        self.model = self.load_model(model_path)
+        # Every snapshot_interval logged messages, the state is written to the snapshot
+        # file and the log is rotated into a numbered segment which the snapshot covers
+        self.snapshot_filepath = message_log_filepath + '.snapshot'
+        self.snapshot_interval = SNAPSHOT_INTERVAL_MESSAGES
+        self.snapshot_segment = 0
+        self.messages_since_snapshot = 0
+        
+        # Predictions are cached by feature vector; the cache is cleared whenever the
+        # model file changes and the model is reloaded
+        self.model_path = model_path
+        self.model_signature = self.model_file_signature()
+        self.model_checked_at = time.monotonic()
+        self._model = None
+        self._model_error = None
+        self._model_loader = None
+        if load_model_in_background:
+            self._model_loader = threading.Thread(target=self._load_model_in_background, name="model-loader", daemon=True)
+            self._model_loader.start()
+        else:
+            self._model = self.load_model(model_path)
+        self.prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_DECIMALS)
+        # Clearly negative results are predicted by rule, without the cache or the model
+        self.rule_classifier = RuleClassifier(RULE_NEGATIVE_MAX_RATIO, RULE_NEGATIVE_MAX_VALUE,
+                                              enabled=RULE_FAST_PATH)
     
     def initialise_database(self, history_csv_path, wipe_past_message_log: bool = False):
-        # Read the history.csv file to populate the creatinine_results_history dictionary
-        with open(history_csv_path, 'r') as file:
-            reader = csv.reader(file)
-            next(reader, None)  # Skip the header row
-            for row in reader: 
-                mrn = row[0]
-                creatinine_results = [row[col] for col in range(2, len(row), 2) if row[col] != ""]
-                creatinine_results = list(map(float, creatinine_results))
-                self.creatinine_results_history[mrn] = creatinine_results
+        """
+        Loads the state from the newest snapshot, or from history.csv when there is none,
+        and replays the messages logged after it.
+        """
+        start = time.perf_counter()
+        # Commit and close the log, so that everything appended so far can be read back
+        self.close_message_log()
+        
+        if wipe_past_message_log:
+            self.remove_snapshot_and_segments()
         
-        # # Check if the CSV file does not exist, we create it
-        if not os.path.exists(self.message_log_filepath):
-            with open(self.message_log_filepath, 'w', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=self.fields)
-                writer.writeheader()  # Write the header row
+        self.load_history(history_csv_path)
+        self.load_snapshot()
+        
+        # # Check if the log file does not exist, we create it
+        if not os.path.exists(self.message_log_filepath) or wipe_past_message_log:
+            with open(self.message_log_filepath, 'wb') as logfile:
+                logfile.write(self.message_log_header())
+            replayed = self.replay_segments()
         else:
-            if wipe_past_message_log:
-                with open(self.message_log_filepath, 'w', newline='') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=self.fields)
-                    writer.writeheader()  # Write the header row
-            else:
-                self.instantiate_all_past_messages_from_log()
+            p_recovery_truncated_bytes.set(self.truncate_torn_record())
+            replayed = self.instantiate_all_past_messages_from_log()
+        self.messages_since_snapshot = replayed
+        self.compact_message_log()
+        
+        p_recovery_replayed_messages.set(replayed)
+        p_recovery_duration.set(time.perf_counter() - start)
+
+    def load_history(self, history_csv_path):
+        """
+        Opens the history.csv file as the creatinine_results_history store. It is
+        only read, or its cache mapped, when first used.
+        """
+        self.creatinine_results_history = HistoryStore.open(history_csv_path, self.history_cache_path)
         
     def add_admitted_patient_to_current_patients(self, admission_msg: PatientAdmissionMessage):
         """
-        Adds an admitted patient's data to the current_patients dictionary.
+        Adds an admitted patient's data to the current_patients dictionary. The
+        patient's results so far are copied from the history into the new record.
+
+        Raises:
+        ValueError: If the date of birth of the patient cannot be read.
         """
         if admission_msg.mrn in self.creatinine_results_history:
-            self.current_patients[admission_msg.mrn] = {
-                'name': admission_msg.name,
-                'date_of_birth': admission_msg.date_of_birth,
-                'sex': admission_msg.sex,
-                'creatinine_results': self.creatinine_results_history[admission_msg.mrn],
-                'previous_positive_aki_prediction': False
-                }
-                
+            creatinine_results = self.creatinine_results_history[admission_msg.mrn]
         else:
-            self.current_patients[admission_msg.mrn] = {
-                'name': admission_msg.name,
-                'date_of_birth': admission_msg.date_of_birth,
-                'sex': admission_msg.sex,
-                'creatinine_results': [],
-                'previous_positive_aki_prediction': False
-                }
+            creatinine_results = ()
+        self.current_patients[admission_msg.mrn] = PatientRecord(admission_msg.name,
+                                                                 admission_msg.date_of_birth,
+                                                                 admission_msg.sex,
+                                                                 creatinine_results)
     
-    def add_test_result_to_current_patients(self, test_results_msg: TestResultMessage):
+    def add_test_result_to_current_patients(self, test_results_msg: TestResultMessage) -> bool:
         """
         Appends a new test result for a patient in the in-memory dictionary.
+
+        A result with the same timestamp and value as one already received during the
+        admission, as when a frame that was not acknowledged is sent again, is not added.
+
+        Returns:
+        bool: Whether the result was added.
         """
         if test_results_msg.mrn in self.current_patients:
-            self.current_patients[test_results_msg.mrn]['creatinine_results'].append(float(test_results_msg.creatinine_value))
+            record = self.current_patients[test_results_msg.mrn]
+            creatinine_value = float(test_results_msg.creatinine_value)
+            if (test_results_msg.timestamp, creatinine_value) in record.received_results:
+                return False
+            record.add_result(creatinine_value, test_results_msg.timestamp)
+            return True
         else:
             raise ValueError(f"The lab results of patient {test_results_msg.mrn} cannot be processed," +
                              "since there is no record of an HL7 admission message for this patient.")
@@ -110,7 +263,8 @@ class StorageManager:
         Removes a patient's information from the in-memory storage.
         """
         if discharge_msg.mrn in self.current_patients:
-            self.current_patients.pop(discharge_msg.mrn, None)
+            # The results of this admission are kept for the next one
+            self.creatinine_results_history[discharge_msg.mrn] = self.current_patients.pop(discharge_msg.mrn).creatinine_results
         else:
             raise ValueError(f"The discharge of patient {discharge_msg.mrn} cannot be processed," + 
                              "since there is no record of an HL7 admission message for this patient.")
@@ -119,23 +273,43 @@ class StorageManager:
         """
         Updates the creatinine results history for a discharged patient.
         """
-        self.creatinine_results_history[discharge_msg.mrn] = self.current_patients[discharge_msg.mrn]['creatinine_results']
+        self.creatinine_results_history[discharge_msg.mrn] = self.current_patients[discharge_msg.mrn].creatinine_results
     
     def no_positive_aki_prediction_so_far(self, mrn):
         """
         Checks if previously a positive aki prediction was triggered
         """
-        return not self.current_patients[mrn]['previous_positive_aki_prediction']
+        return not self.current_patients[mrn].previous_positive_aki_prediction
     
     def update_positive_aki_prediction_to_current_patients(self, mrn):
         """
         Records to memory that a positive aki prediction was triggered
         """
-        self.current_patients[mrn]['previous_positive_aki_prediction'] = True
+        self.current_patients[mrn].previous_positive_aki_prediction = True
+
+    def record_positive_aki_prediction(self, mrn) -> int:
+        """
+        Records to memory that a positive aki prediction was triggered for an admitted
+        patient, and logs it so that recovery can restore it without the model.
+
+        Returns:
+        int: The log sequence number of the logged prediction, or None if the patient
+        is no longer admitted.
+        """
+        if mrn not in self.current_patients:
+            return None
+        self.update_positive_aki_prediction_to_current_patients(mrn)
+        return self.add_message_to_log_csv(PositiveAKIPredictionMessage(mrn))
     
-    def add_message_to_log_csv(self, message: object):
+    def add_message_to_log_csv(self, message: object) -> int:
         """
         Appends a message as a single row to message_log.csv.
+
+        The row is written to the write-ahead log but is only guaranteed to be on
+        disk once commit_message_log has returned for it.
+
+        Returns:
+        int: The log sequence number of the row, to be passed to commit_message_log.
         """
         # Prepare the message data based on the type of message
         if isinstance(message, PatientAdmissionMessage):
@@ -159,74 +333,393 @@ class StorageManager:
                 'mrn': message.mrn,
                 'additional_info': f"Test Date: {message.test_date}. Test Time: {message.test_time}. Creatinine Value: {message.creatinine_value}"
             }
+        elif isinstance(message, PositiveAKIPredictionMessage):
+            row_data = {
+                'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'type': 'PositiveAKIPrediction',
+                'mrn': message.mrn,
+                'additional_info': ''
+            }
         
-        # Append single row to the CSV file
-        with open(self.message_log_filepath, 'a', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames= self.fields)
+        if self.message_log_format == 'binary':
+            record = encode_message(message)
+        else:
+            # Append single row to the CSV file
+            row = io.StringIO()
+            writer = csv.DictWriter(row, fieldnames= self.fields)
             writer.writerow(row_data)
+            record = row.getvalue().encode()
+        with self.message_log_lock:
+            self.messages_since_snapshot += 1
+            return self.open_message_log().append(record)
+
+    def message_log_header(self) -> bytes:
+        """
+        Returns the bytes a new message log starts with: the CSV header row, or the
+        header of the binary format.
+        """
+        if self.message_log_format == 'binary':
+            return FILE_HEADER
+        header = io.StringIO()
+        csv.DictWriter(header, fieldnames=self.fields).writeheader()
+        return header.getvalue().encode()
+
+    def open_message_log(self) -> WriteAheadLog:
+        """
+        Returns the open message log, opening it if needed.
+        """
+        if self.message_log is None:
+            self.message_log = WriteAheadLog(self.message_log_filepath,
+                                             header=self.message_log_header(),
+                                             sync_policy=MESSAGE_LOG_SYNC_POLICY,
+                                             sync_records=MESSAGE_LOG_SYNC_RECORDS,
+                                             sync_interval_ms=MESSAGE_LOG_SYNC_INTERVAL_MS,
+                                             start_lsn=self.message_log_lsn)
+        return self.message_log
+
+    def commit_message_log(self, lsn: int = None, snapshot: bool = True):
+        """
+        Blocks until the row with the given log sequence number, and every row before
+        it, is on disk. Messages must only be acknowledged once this has returned.
+        
+        Once snapshot_interval messages have been logged since the last snapshot, a new
+        snapshot is taken, so this must only be called once the logged messages have
+        been applied to the in-memory state, from the thread applying them. Commits
+        made from any other thread pass snapshot=False, and the thread applying the
+        messages calls snapshot_if_due itself.
+        """
+        # A snapshot from another thread may close the log and open a new one meanwhile
+        message_log = self.message_log
+        if message_log is not None:
+            message_log.commit(lsn)
+        if snapshot:
+            self.snapshot_if_due()
+
+    def snapshot_if_due(self):
+        """
+        Takes a snapshot if snapshot_interval messages have been logged since the last
+        one. Every message applied to the in-memory state must have been logged, and
+        no other thread may change the state meanwhile.
+        """
+        if self.snapshot_interval and self.messages_since_snapshot >= self.snapshot_interval:
+            with self.message_log_lock:
+                if self.messages_since_snapshot >= self.snapshot_interval:
+                    self.snapshot()
+
+    def close_message_log(self):
+        """
+        Commits every logged row and closes the message log.
+        """
+        if self.message_log is not None:
+            self.message_log.close()
+            self.message_log_lsn = self.message_log.appended_lsn
+            self.message_log = None
+
+    def segment_filepath(self, segment: int) -> str:
+        """
+        Returns the path of a sealed message log segment.
+        """
+        return segment_filepath(self.message_log_filepath, segment)
+
+    def list_segments(self) -> list:
+        """
+        Returns the numbers of the sealed message log segments on disk, in order.
+        """
+        return list_segments(self.message_log_filepath)
+
+    def read_logged_messages(self, path: str):
+        """
+        Yields the messages of a message log file, in order, one at a time. Binary logs
+        are read through a memory map, CSV logs line by line.
+        """
+        if self.message_log_format == 'binary':
+            for message, _, _ in read_log(path):
+                yield message
+        else:
+            with open(path, 'r', newline='') as file:
+                reader = csv.reader(file)
+                next(reader, None)  # Skip the header row
+                for row in reader:
+                    try:
+                        yield message_from_csv_row(row)
+                    except ValueError:
+                        yield None
+
+    def truncate_torn_record(self) -> int:
+        """
+        Cuts the active message log back to the end of its last complete record,
+        removing what a crash during an append left after it, so that the records
+        appended from now on follow a complete one.
+
+        Returns:
+        int: The number of bytes removed.
+        """
+        with open(self.message_log_filepath, 'r+b') as file:
+            size = os.fstat(file.fileno()).st_size
+            if self.message_log_format == 'binary':
+                if size < len(FILE_HEADER):
+                    # The header itself is incomplete: the log is written again from scratch
+                    length = 0
+                else:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                        length = complete_length(buffer)
+            else:
+                # CSV rows end with a line break
+                length = size
+                while length > 0:
+                    chunk_start = max(0, length - (1 << 16))
+                    file.seek(chunk_start)
+                    newline = file.read(length - chunk_start).rfind(b'\n')
+                    if newline != -1:
+                        length = chunk_start + newline + 1
+                        break
+                    length = chunk_start
+            if length < size:
+                file.truncate(length)
+                file.flush()
+                os.fsync(file.fileno())
+                print(f"Removed {size - length} bytes of a torn record from the end of {self.message_log_filepath}")
+        return size - length
+
+    def replay_segments(self, include_active_log: bool = False) -> int:
+        """
+        Replays the sealed segments not covered by the loaded snapshot, in order, and
+        optionally the active message log after them.
+
+        Returns:
+        int: The number of messages replayed.
+        """
+        paths = [self.segment_filepath(segment) for segment in self.list_segments()
+                 if segment > self.snapshot_segment]
+        if include_active_log:
+            paths.append(self.message_log_filepath)
+        replayed = 0
+        for path in paths:
+            replayed += self.replay_messages(self.read_logged_messages(path))
+        return replayed
+
+    def instantiate_all_past_messages_from_log(self) -> int:
+        """
+        Reads the message log written since the last snapshot and applies the logged
+        messages in order, to rebuild the state of the current patients.
 
-    def instantiate_all_past_messages_from_log(self):
+        Returns:
+        int: The number of messages replayed.
         """
-        Reads message_log.csv, sorts messages chronologically, and creates message object instances.
+        return self.replay_segments(include_active_log=True)
+
+    def replay_messages(self, messages) -> int:
         """
-        df = pd.read_csv(self.message_log_filepath)         
-        for _, row in df.iterrows():
+        Applies logged messages to the in-memory state, in order.
+
+        The model is not run again: positive predictions are restored from the
+        PositiveAKIPredictionMessage entries logged when they were made.
+
+        Parameters:
+        messages: Iterable of message objects; None stands for an unreadable entry.
+
+        Returns:
+        int: The number of entries replayed.
+        """
+        replayed = 0
+        for message in messages:
+            replayed += 1
+            if isinstance(message, PositiveAKIPredictionMessage):
+                if message.mrn in self.current_patients:
+                    self.update_positive_aki_prediction_to_current_patients(message.mrn)
+                    p_sum_of_positive_aki_predictions.inc()
+                    p_reinstantiated_positive_prediction.inc()
+                continue
             p_sum_of_all_messages.inc()
             p_reinstantiated_overall.inc()
-            if row[1] == 'PatientAdmission':
-                # Assuming additional_info contains comma-separated data
-                info_parts = row[3].split('. ')
-                mrn = str(row[2])
-                name = info_parts[0].split(': ')[1]
-                dob = info_parts[1].split(': ')[1]
-                sex = info_parts[2].split(': ')[1]
-                self.add_admitted_patient_to_current_patients(
-                    PatientAdmissionMessage(mrn, name, dob, sex))
-                p_reinstantiated_admission.inc()
-            elif row[1] == 'PatientDischarge':
-                mrn = str(row[2])
+            if message is None:
+                p_reinstantiation_errors.inc()
+            elif isinstance(message, PatientAdmissionMessage):
+                try:
+                    self.add_admitted_patient_to_current_patients(message)
+                    p_reinstantiated_admission.inc()
+                except ValueError:
+                    p_reinstantiation_errors.inc()
+            elif isinstance(message, PatientDischargeMessage):
                 try:
-                    self.remove_patient_from_current_patients(
-                        PatientDischargeMessage(mrn))
+                    self.remove_patient_from_current_patients(message)
                     p_reinstantiated_discharge.inc()
                 except ValueError: 
                     p_reinstantiation_errors.inc()
                 
-            elif row[1] == 'TestResult':
-                info_parts = row[3].split('. ')
-                mrn = str(row[2])
-                test_date = info_parts[0].split(': ')[1]
-                test_time = info_parts[1].split(': ')[1]
-                creatinine_value = info_parts[2].split(': ')[1]
+            elif isinstance(message, TestResultMessage):
                 try:
-                    self.add_test_result_to_current_patients(
-                    TestResultMessage(mrn, 
-                                        test_date,
-                                        test_time, 
-                                        creatinine_value))
+                    self.add_test_result_to_current_patients(message)
                     p_reinstantiated_test_result.inc()
                 except ValueError: 
                     p_reinstantiation_errors.inc()
-                    continue
-                if self.no_positive_aki_prediction_so_far(mrn):
-                    prediction_result = self.predict_aki(mrn)
-                    if prediction_result == 1:
-                        self.update_positive_aki_prediction_to_current_patients(mrn)
-                        p_sum_of_positive_aki_predictions.inc()
-            else:
-                p_reinstantiation_errors.inc()
-                
+        return replayed
+
+    def snapshot(self):
+        """
+        Writes the in-memory state to the snapshot file and truncates the message log.
+
+        The active log is first sealed by renaming it to the next numbered segment.
+        The snapshot, written to a temporary file and renamed into place, records that
+        it covers every segment up to that one, so that recovery only replays what was
+        logged after it. The covered segments are then removed. A crash at any point
+        leaves either the old snapshot with its segments, or the new one.
+        """
+        start = time.perf_counter()
+        with self.message_log_lock:
+            self._snapshot()
+        p_snapshots.inc()
+        p_snapshot_duration.observe(time.perf_counter() - start)
+
+    def _snapshot(self):
+        self.close_message_log()
+        segment = max(self.list_segments() + [self.snapshot_segment]) + 1
+        if os.path.exists(self.message_log_filepath):
+            os.replace(self.message_log_filepath, self.segment_filepath(segment))
+            self._fsync_directory()
+        
+        state = {'version': SNAPSHOT_VERSION,
+                 'segment': segment,
+                 'history_updates': self.creatinine_results_history.updates,
+                 'current_patients': self.current_patients}
+        temporary_path = self.snapshot_filepath + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+        os.replace(temporary_path, self.snapshot_filepath)
+        self._fsync_directory()
+        
+        self.snapshot_segment = segment
+        self.messages_since_snapshot = 0
+        self.compact_message_log()
+        p_snapshot_bytes.set(size)
+
+    def load_snapshot(self) -> bool:
+        """
+        Loads the in-memory state from the snapshot file, if there is one. The
+        history must have been loaded already: the snapshot only holds the results
+        written to it since history.csv was read.
+
+        Returns:
+        bool: Whether a snapshot was loaded.
+        """
+        if not os.path.exists(self.snapshot_filepath):
+            self.snapshot_segment = 0
+            self.current_patients = dict()
+            return False
+        with open(self.snapshot_filepath, 'rb') as file:
+            state = pickle.load(file)
+        if state.get('version') == 3:
+            # Version 3 records do not keep the results received during the admission
+            for record in state['current_patients'].values():
+                record.received_results = set()
+        elif state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"{self.snapshot_filepath}: unsupported snapshot version {state.get('version')}")
+        self.snapshot_segment = state['segment']
+        self.creatinine_results_history.updates = state['history_updates']
+        self.current_patients = state['current_patients']
+        return True
+
+    def compact_message_log(self):
+        """
+        Removes the sealed message log segments covered by the current snapshot.
+        """
+        for segment in self.list_segments():
+            if segment <= self.snapshot_segment:
+                os.remove(self.segment_filepath(segment))
+                p_log_segments_compacted.inc()
+
+    def remove_snapshot_and_segments(self):
+        """
+        Removes the snapshot and every sealed segment, when starting from an empty log.
+        """
+        for segment in self.list_segments():
+            os.remove(self.segment_filepath(segment))
+        for path in (self.snapshot_filepath, self.snapshot_filepath + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+        self.snapshot_segment = 0
+
+    def _fsync_directory(self):
+        directory = os.open(os.path.dirname(os.path.abspath(self.message_log_filepath)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
                 
     def load_model(self, model_path: str):
         """Loads the predictive model from a file.
 
+        Models compiled by model_compiler.py (.npz) are evaluated with NumPy only;
+        any other file is loaded with joblib as a fitted sklearn model.
+
         Returns:
         The loaded predictive model.
         """
+        if model_path.endswith('.npz'):
+            return CompiledForest.load(model_path)
 
+        import joblib
         model = joblib.load(model_path)
         return model
 
+    def _load_model_in_background(self) -> None:
+        try:
+            self._model = self.load_model(self.model_path)
+        except Exception as e:
+            self._model_error = e
+
+    @property
+    def model(self):
+        """
+        The predictive model, waiting for it if it is still being loaded in the background.
+
+        Raises:
+        Exception: The error which stopped the model from loading in the background.
+        """
+        if self._model_loader is not None:
+            self._model_loader.join()
+            self._model_loader = None
+        if self._model_error is not None:
+            raise self._model_error
+        return self._model
+
+    @model.setter
+    def model(self, model) -> None:
+        if self._model_loader is not None:
+            self._model_loader.join()
+            self._model_loader = None
+        self._model = model
+        self._model_error = None
+
+    def model_file_signature(self) -> tuple:
+        """
+        Returns the size and modification time of the model file, or None when it cannot be read.
+        """
+        try:
+            stat = os.stat(self.model_path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def check_model(self) -> None:
+        """
+        Reloads the model and clears the prediction cache if the model file has
+        changed. The file is looked at most every MODEL_CHECK_INTERVAL_SECONDS.
+        """
+        now = time.monotonic()
+        if now - self.model_checked_at < MODEL_CHECK_INTERVAL_SECONDS:
+            return
+        self.model_checked_at = now
+        signature = self.model_file_signature()
+        if signature is None or signature == self.model_signature:
+            return
+        self.model = self.load_model(self.model_path)
+        self.model_signature = signature
+        self.prediction_cache.clear()
+
     @staticmethod
     def determine_age(date_of_birth: str) -> int:
         """
@@ -242,15 +735,15 @@ class StorageManager:
         dob = datetime.datetime.strptime(date_of_birth, "%Y-%m-%d").date()
         return int(today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day)))
     
-    def predict_aki(self, mrn: str, num_creatinine_results = 5) -> int:
+    def build_features(self, mrn: str, num_creatinine_results = 5) -> list:
         """
-        Predicts whether a patient is at risk of AKI based on their medical record number (MRN).
+        Builds the model input features for a patient from their current state.
 
         Parameters:
         mrn (str): The medical record number of the patient.
 
         Returns:
-        int: 0 if no AKI is predicted, 1 if AKI is predicted.
+        list: The age, sex and the most recent creatinine results of the patient.
         """
         # Access the data from current_patients dictionary
         patient_data = self.current_patients.get(mrn)
@@ -258,22 +751,92 @@ class StorageManager:
         if patient_data is None:
             raise ValueError(f"Patient with MRN {mrn} not found in current_patients dictionary.")
 
-        sex = 0 if patient_data['sex'].lower() == 'm' else 1
-        age = self.determine_age(patient_data['date_of_birth'])
+        today = datetime.date.today()
+        if num_creatinine_results == FEATURE_RESULTS:
+            # The record keeps these features up to date as results arrive
+            return patient_data.features(today)
 
-        creatinine_results = patient_data['creatinine_results'].copy()
+        # The most recent results, padded with the last one to match model input requirements
+        recent_results = patient_data.creatinine_results[-num_creatinine_results:].tolist()
+        recent_results += [recent_results[-1]] * (num_creatinine_results - len(recent_results))
 
-        # Adjust creatinine results to match model input requirements
-        if len(creatinine_results) > num_creatinine_results:
-            recent_results = creatinine_results[-num_creatinine_results:]
-        else:
-            while len(creatinine_results) < num_creatinine_results:
-                creatinine_results.append(creatinine_results[-1])
-            recent_results = creatinine_results
-        
-        input_features = [age, sex] + recent_results
-        return self.model.predict(np.array(input_features, dtype=np.float64).reshape(1, -1))[0]
+        return [patient_data.age(today), patient_data.sex] + recent_results
+
+    def predict_features(self, input_features: list) -> int:
+        """
+        Runs the model on features built by build_features, unless the result is
+        clear-cut enough to be predicted by rule or the prediction for the same
+        quantized features is cached.
+
+        Parameters:
+        input_features (list): The model input features of one patient.
+
+        Returns:
+        int: 0 if no AKI is predicted, 1 if AKI is predicted.
+        """
+        prediction = self.rule_classifier.classify(input_features)
+        if prediction is not None:
+            return prediction
+        self.check_model()
+        key = self.prediction_cache.key(input_features)
+        prediction = self.prediction_cache.get(key)
+        if prediction is None:
+            prediction = int(self.model.predict(np.array(key, dtype=np.float64).reshape(1, -1))[0])
+            self.prediction_cache.put(key, prediction)
+        return prediction
+    
+    def predict_features_batch(self, features: list) -> np.ndarray:
+        """
+        Runs the model once on the features of several patients, for those which
+        are not predicted by rule and whose quantized features have no cached prediction.
+
+        Parameters:
+        features (list): Model input features built by build_features, one entry per patient.
+
+        Returns:
+        np.ndarray: 0 or 1 for each entry of features.
+        """
+        self.check_model()
+        predictions = [self.rule_classifier.classify(input_features) for input_features in features]
+        missing = dict()
+        for i, prediction in enumerate(predictions):
+            if prediction is None:
+                key = self.prediction_cache.key(features[i])
+                predictions[i] = self.prediction_cache.get(key)
+                if predictions[i] is None:
+                    missing.setdefault(key, []).append(i)
+        if missing:
+            results = self.model.predict(np.array(list(missing), dtype=np.float64).reshape(len(missing), -1))
+            for (key, positions), prediction in zip(missing.items(), results):
+                prediction = int(prediction)
+                self.prediction_cache.put(key, prediction)
+                for i in positions:
+                    predictions[i] = prediction
+        return np.array(predictions, dtype=np.int64)
+
+    def predict_aki_batch(self, mrns: list, num_creatinine_results = 5) -> np.ndarray:
+        """
+        Predicts AKI for several patients with a single call to the model.
 
+        Parameters:
+        mrns (list): The medical record numbers of the patients.
+
+        Returns:
+        np.ndarray: 0 if no AKI is predicted, 1 if AKI is predicted, for each MRN in order.
+        """
+        return self.predict_features_batch([self.build_features(mrn, num_creatinine_results) for mrn in mrns])
+    
+    def predict_aki(self, mrn: str, num_creatinine_results = 5) -> int:
+        """
+        Predicts whether a patient is at risk of AKI based on their medical record number (MRN).
+
+        Parameters:
+        mrn (str): The medical record number of the patient.
+
+        Returns:
+        int: 0 if no AKI is predicted, 1 if AKI is predicted.
+        """
+        return self.predict_features(self.build_features(mrn, num_creatinine_results))
 
 if __name__ == "__main__":
     storage_manager = StorageManager()
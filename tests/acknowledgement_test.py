@@ -0,0 +1,97 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from alert_manager import AlertManager
+from message_listener import dispatch_frames, to_mllp
+from storage_manager import StorageManager
+
+def admission_frame(mrn):
+    return to_mllp(['MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102135300||ADT^A01|||2.5',
+                    f'PID|1||{mrn}||ROSCOE DOHERTY||19870515|M'])[1:-2]
+
+def result_frame(mrn, value):
+    return to_mllp(['MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240804082600||ORU^R01|||2.5',
+                    f'PID|1||{mrn}', 'OBR|1||||||20240804082600', f'OBX|1|SN|CREATININE||{value}'])[1:-2]
+
+class AcknowledgementTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.storage_manager = StorageManager(message_log_filepath=os.path.join(directory, 'message_log.csv'))
+        self.addCleanup(self.storage_manager.close_message_log)
+        self.alert_manager = AlertManager(outbox_path=os.path.join(directory, 'outbox'))
+
+    def dispatch(self, frames):
+        """
+        Dispatches the frames and returns the exception raised, if any, and the
+        number of ACKs sent.
+        """
+        listener, peer = socket.socketpair()
+        with listener, peer:
+            try:
+                dispatch_frames(listener, frames, self.storage_manager, self.alert_manager, 0.0)
+                error = None
+            except Exception as e:
+                error = e
+            listener.shutdown(socket.SHUT_WR)
+            acks = b""
+            while received := peer.recv(4096):
+                acks += received
+        return error, acks.count(b"MSA|AA")
+
+    def test_frames_after_a_failure_are_not_acknowledged(self):
+        """
+        Tests that when logging a message fails, the frames handled before it are
+        acknowledged, and neither it nor the frames after it are.
+        """
+        log = self.storage_manager.add_message_to_log_csv
+        logged = []
+        def append(message):
+            if logged:
+                raise OSError("disk full")
+            logged.append(message)
+            return log(message)
+        with mock.patch.object(self.storage_manager, 'add_message_to_log_csv', side_effect=append):
+            error, acks = self.dispatch([admission_frame('100'), admission_frame('200'), admission_frame('300')])
+
+        self.assertIsInstance(error, OSError)
+        self.assertEqual(acks, 1)
+
+    def test_test_result_waiting_for_its_prediction_is_not_acknowledged(self):
+        """
+        Tests that when the prediction of a read fails, the test results waiting
+        for it and the frames after them are not acknowledged.
+        """
+        with mock.patch.object(self.storage_manager, 'predict_aki_batch', side_effect=RuntimeError("model failed")):
+            error, acks = self.dispatch([admission_frame('100'), result_frame('100', 80.3), admission_frame('200')])
+
+        self.assertIsInstance(error, RuntimeError)
+        self.assertEqual(acks, 1)
+
+    def test_resent_frames_are_applied_once(self):
+        """
+        Tests that the frames sent again after a failure, including a test result
+        applied before it but not acknowledged, leave each result recorded once.
+        """
+        frames = [admission_frame('100'), result_frame('100', 80.3), result_frame('100', 95.1), admission_frame('200')]
+        with mock.patch.object(self.storage_manager, 'predict_aki_batch', side_effect=RuntimeError("model failed")):
+            error, acks = self.dispatch(frames)
+        self.assertIsInstance(error, RuntimeError)
+        self.assertEqual(acks, 1)
+
+        with mock.patch.object(self.storage_manager, 'predict_aki_batch', side_effect=lambda mrns: [0] * len(mrns)):
+            error, acks = self.dispatch(frames[acks:])
+
+        self.assertIsNone(error)
+        self.assertEqual(acks, 3)
+        self.assertEqual(self.storage_manager.current_patients['100'].creatinine_results.tolist(), [80.3, 95.1])
+        self.assertIn('200', self.storage_manager.current_patients)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from storage_manager import StorageManager
 from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
+from patient_record import PatientRecord
 
 class TestPatientDataPersistence(unittest.TestCase):
     """
@@ -42,8 +43,8 @@ class TestPatientDataPersistence(unittest.TestCase):
         )
         
         # Verify test result is recorded
-        self.assertIn(1.2, self.storage_manager.current_patients['001']['creatinine_results'])
-        self.assertTrue(self.storage_manager.current_patients['001'] == {'name': 'John Doe', 'date_of_birth': '1980-01-01', 'sex': 'M', 'creatinine_results': [1.2], 'previous_positive_aki_prediction': False})
+        self.assertIn(1.2, self.storage_manager.current_patients['001'].creatinine_results)
+        self.assertTrue(self.storage_manager.current_patients['001'] == PatientRecord('John Doe', '1980-01-01', 'M', [1.2], False))
 
         # Step 3: Discharge the patient
         self.storage_manager.update_patients_data_in_creatinine_results_history(
@@ -61,5 +62,24 @@ class TestPatientDataPersistence(unittest.TestCase):
         self.assertTrue(len(self.storage_manager.creatinine_results_history['001']) > 0)
         self.assertIn(1.2, self.storage_manager.creatinine_results_history['001'])
 
+    def test_admission_copies_the_history(self):
+        """
+        Tests that results added during an admission do not change the history until
+        the patient is discharged.
+        """
+        self.storage_manager.creatinine_results_history['001'] = [1.0]
+        self.storage_manager.add_admitted_patient_to_current_patients(
+            PatientAdmissionMessage('001', 'John Doe', '1980-01-01', 'M')
+        )
+        self.storage_manager.add_test_result_to_current_patients(
+            TestResultMessage('001', '2023-01-01', '08:00', 1.2)
+        )
+        
+        self.assertEqual(self.storage_manager.creatinine_results_history['001'], [1.0])
+        
+        self.storage_manager.remove_patient_from_current_patients(PatientDischargeMessage('001'))
+        
+        self.assertEqual(self.storage_manager.creatinine_results_history['001'], [1.0, 1.2])
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@ import unittest
 import numpy as np
 from datetime import datetime, date
 from storage_manager import StorageManager
+from patient_record import PatientRecord
 
 class AKIPredictorTest(unittest.TestCase):
     def setUp(self):
@@ -9,12 +10,7 @@ class AKIPredictorTest(unittest.TestCase):
         
     def test_predict_aki_positive_case(self):
         test_mrn = '12345'
-        test_patient_data_jane = {
-            'name': 'Jane Doe',
-            'sex': 'f',
-            'date_of_birth': '1990-01-01',
-            'creatinine_results': [60.7, 62.3, 53, 80, 165, 204.56]
-        }
+        test_patient_data_jane = PatientRecord('Jane Doe', '1990-01-01', 'f', [60.7, 62.3, 53, 80, 165, 204.56])
         self.storage_manager.current_patients[test_mrn] = test_patient_data_jane
         
         result = self.storage_manager.predict_aki(test_mrn)
@@ -23,18 +19,42 @@ class AKIPredictorTest(unittest.TestCase):
     
     def test_predict_aki_negative_case(self):
         test_mrn = '654321'
-        test_patient_data_jon = {
-            'name': 'Jon Doe',
-            'sex': 'm',
-            'date_of_birth': '1950-01-01',
-            'creatinine_results': [60.7, 60.7, 61.7]
-        }
+        test_patient_data_jon = PatientRecord('Jon Doe', '1950-01-01', 'm', [60.7, 60.7, 61.7])
         self.storage_manager.current_patients[test_mrn] = test_patient_data_jon
         
         result = self.storage_manager.predict_aki(test_mrn)
 
         self.assertEqual(result, 0)   
     
+    def test_predict_aki_batch_matches_single_predictions(self):
+        self.storage_manager.current_patients['12345'] = PatientRecord('Jane Doe', '1990-01-01', 'f', [60.7, 62.3, 53, 80, 165, 204.56])
+        self.storage_manager.current_patients['654321'] = PatientRecord('Jon Doe', '1950-01-01', 'm', [60.7, 60.7, 61.7])
+        mrns = ['12345', '654321', '12345']
+        
+        results = self.storage_manager.predict_aki_batch(mrns)
+
+        self.assertEqual(list(results), [self.storage_manager.predict_aki(mrn) for mrn in mrns])
+        self.assertEqual(list(results), [1, 0, 1])
+
+    def test_incremental_features_match_rebuilt_features(self):
+        test_patient_data_jane = PatientRecord('Jane Doe', '1990-01-01', 'f', [60.7])
+        self.storage_manager.current_patients['12345'] = test_patient_data_jane
+        results = [60.7]
+        for value in [62.3, 53, 80, 165, 204.56, 101.2, 99.9]:
+            test_patient_data_jane.add_result(value)
+            results.append(value)
+            recent_results = results[-5:] + [results[-1]] * (5 - len(results[-5:]))
+
+            self.assertEqual(self.storage_manager.build_features('12345'),
+                             [test_patient_data_jane.age(date.today()), 1] + recent_results)
+        self.assertEqual(self.storage_manager.build_features('12345', 3), [test_patient_data_jane.age(date.today()), 1] + results[-3:])
+
+    def test_features_of_patient_without_results(self):
+        self.storage_manager.current_patients['12345'] = PatientRecord('Jane Doe', '1990-01-01', 'f')
+
+        with self.assertRaises(IndexError):
+            self.storage_manager.build_features('12345')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from alert_manager import AlertManager
+from message_listener import Feed, dispatch_frames, to_mllp
+from mllp import OVERSIZED_FRAME
+from storage_manager import StorageManager
+
+class BackpressureTest(unittest.TestCase):
+
+    def test_oversized_frame_is_rejected_in_order(self):
+        """
+        Tests that an oversized frame gets an AE ACK, in its turn among the ACKs
+        of the other frames of the read.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        storage_manager = StorageManager(message_log_filepath=os.path.join(directory, 'message_log.csv'))
+        alert_manager = AlertManager(outbox_path=os.path.join(directory, 'outbox'))
+        admission = to_mllp(['MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102135300||ADT^A01|||2.5',
+                             'PID|1||497030||ROSCOE DOHERTY||19870515|M'])[1:-2]
+        rejected_before = REGISTRY.get_sample_value("oversized_frames_total")
+
+        listener, peer = socket.socketpair()
+        with listener, peer:
+            dispatch_frames(listener, [OVERSIZED_FRAME, admission], storage_manager, alert_manager, 0.0)
+            storage_manager.close_message_log()
+            listener.shutdown(socket.SHUT_WR)
+            acks = b""
+            while received := peer.recv(4096):
+                acks += received
+
+        self.assertEqual([segment for segment in acks.split(b"\r") if segment.startswith(b"MSA")],
+                         [b"MSA|AE", b"MSA|AA"])
+        self.assertEqual(REGISTRY.get_sample_value("oversized_frames_total") - rejected_before, 1)
+        self.assertIn('497030', storage_manager.current_patients)
+
+    @mock.patch("message_listener.LISTENER_LOW_WATERMARK_MESSAGES", 2)
+    @mock.patch("message_listener.LISTENER_HIGH_WATERMARK_MESSAGES", 4)
+    def test_feed_is_paused_between_the_watermarks(self):
+        """
+        Tests that a feed over its high watermark is not read again until it is
+        back down to its low watermark.
+        """
+        async def run():
+            feed = Feed("backpressure", mock.Mock())
+            feed.unacknowledged = 4
+            waiting = asyncio.create_task(feed.wait_until_readable())
+            await asyncio.sleep(0)
+            self.assertFalse(waiting.done())
+            self.assertEqual(REGISTRY.get_sample_value("feed_paused", {"feed": "backpressure"}), 1)
+
+            feed.release(messages=1)
+            await asyncio.sleep(0)
+            self.assertFalse(waiting.done())
+
+            feed.release(messages=1)
+            await asyncio.wait_for(waiting, 1)
+            self.assertEqual(REGISTRY.get_sample_value("feed_paused", {"feed": "backpressure"}), 0)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
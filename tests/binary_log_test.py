@@ -0,0 +1,160 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from binary_log import FILE_HEADER, RECORD_HEADER, BinaryLogError, convert_csv_to_binary, encode_message, iter_records, read_log
+from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage, PositiveAKIPredictionMessage
+from storage_manager import StorageManager, convert_message_log_to_binary
+
+class BinaryLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.messages = [PatientAdmissionMessage('822825', 'Dr. J. Smith', '1992-01-01', 'M'),
+                         TestResultMessage('822825', '2024-01-01', '08:00:00', 101.2),
+                         PositiveAKIPredictionMessage('822825'),
+                         PatientDischargeMessage('822825')]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, data):
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    def test_round_trip(self):
+        """
+        Tests that every message type decodes to the message that was encoded,
+        including a name containing '. '.
+        """
+        path = os.path.join(self.directory, 'message_log.bin')
+        self.write(path, FILE_HEADER + b''.join(encode_message(message, 1.5) for message in self.messages))
+
+        records = list(read_log(path))
+
+        self.assertEqual([vars(message) for message, _, _ in records], [vars(message) for message in self.messages])
+        self.assertEqual([logged_at for _, logged_at, _ in records], [1.5] * 4)
+        self.assertEqual(records[-1][2], os.path.getsize(path))
+
+    def test_truncated_record_is_ignored(self):
+        """
+        Tests that a record cut short by a crash during an append is not decoded.
+        """
+        data = FILE_HEADER + encode_message(self.messages[0]) + encode_message(self.messages[1])
+
+        records = list(iter_records(data[:-3]))
+
+        self.assertEqual([vars(message) for message, _, _ in records], [vars(self.messages[0])])
+
+    def test_second_restart_after_a_torn_record(self):
+        """
+        Tests that a record torn by a crash is removed on recovery, so that the
+        messages logged after the restart are replayed on the next one.
+        """
+        for name in ('message_log.bin', 'message_log.csv'):
+            with self.subTest(name):
+                path = os.path.join(self.directory, name)
+                storage_manager = StorageManager(message_log_filepath=path)
+                storage_manager.initialise_database('history.csv', wipe_past_message_log=True)
+                for message in self.messages[:2]:
+                    storage_manager.add_message_to_log_csv(message)
+                storage_manager.close_message_log()
+                with open(path, 'r+b') as file:
+                    file.truncate(os.path.getsize(path) - 3)
+
+                restarted = StorageManager(message_log_filepath=path)
+                restarted.initialise_database('history.csv')
+                results = list(restarted.current_patients['822825'].creatinine_results)
+                self.assertNotIn(101.2, results)
+                restarted.add_message_to_log_csv(TestResultMessage('822825', '2024-01-02', '08:00:00', 150.0))
+                restarted.add_message_to_log_csv(TestResultMessage('822825', '2024-01-03', '08:00:00', 170.0))
+                restarted.close_message_log()
+
+                recovered = StorageManager(message_log_filepath=path)
+                recovered.initialise_database('history.csv')
+                self.assertEqual(list(recovered.current_patients['822825'].creatinine_results), results + [150.0, 170.0])
+
+    def test_corrupt_record_is_reported(self):
+        """
+        Tests that a complete record which cannot be decoded raises BinaryLogError
+        with the file and offset, rather than a decoding exception.
+        """
+        path = os.path.join(self.directory, 'message_log.bin')
+        admission = encode_message(self.messages[0])
+        # An admission record holding two of its four fields
+        payload = b'822826\0Jane Doe'
+        corrupt = RECORD_HEADER.pack(RECORD_HEADER.size - 4 + len(payload), 1, 0.0) + payload
+        self.write(path, FILE_HEADER + admission + corrupt)
+
+        with self.assertRaisesRegex(BinaryLogError, f"message_log.bin: Corrupt record of type 1 at offset {len(FILE_HEADER) + len(admission)}"):
+            list(read_log(path))
+
+    def test_bad_header_is_rejected(self):
+        """
+        Tests that a file which is not a binary message log is refused.
+        """
+        path = os.path.join(self.directory, 'message_log.bin')
+        self.write(path, b'timestamp,type,mrn,additional_info\r\n')
+
+        with self.assertRaises(BinaryLogError):
+            list(read_log(path))
+
+    def test_replay_of_converted_csv_log(self):
+        """
+        Tests that a CSV message log converted to the binary format replays to the
+        same patients as the CSV log.
+        """
+        csv_path = os.path.join(self.directory, 'message_log.csv')
+        csv_storage_manager = StorageManager(message_log_filepath=csv_path)
+        csv_storage_manager.initialise_database('history.csv', wipe_past_message_log=True)
+        for message in self.messages[:2]:
+            csv_storage_manager.add_message_to_log_csv(message)
+        csv_storage_manager.close_message_log()
+        csv_storage_manager.initialise_database('history.csv')
+
+        binary_path = os.path.join(self.directory, 'message_log.bin')
+        self.assertEqual(convert_csv_to_binary(csv_path, binary_path), 2)
+        binary_storage_manager = StorageManager(message_log_filepath=binary_path)
+        binary_storage_manager.initialise_database('history.csv')
+
+        self.assertEqual(binary_storage_manager.current_patients, csv_storage_manager.current_patients)
+        self.assertEqual(binary_storage_manager.current_patients['822825'].name, 'Dr. J. Smith')
+
+    def test_switch_to_binary_after_a_snapshot(self):
+        """
+        Tests that the snapshot and sealed segments of a CSV message log are converted
+        with it, so that switching to the binary format keeps the patients admitted
+        before the snapshot, and that an interrupted conversion is started again.
+        """
+        csv_path = os.path.join(self.directory, 'message_log.csv')
+        csv_storage_manager = StorageManager(message_log_filepath=csv_path)
+        csv_storage_manager.snapshot_interval = 0
+        csv_storage_manager.initialise_database('history.csv', wipe_past_message_log=True)
+        def admit(mrn):
+            admission = PatientAdmissionMessage(mrn, 'JANE DOE', '1990-01-01', 'F')
+            csv_storage_manager.add_admitted_patient_to_current_patients(admission)
+            csv_storage_manager.add_message_to_log_csv(admission)
+        admit('100')
+        csv_storage_manager.snapshot()
+        admit('200')
+        # A sealed segment is left over from a snapshot that was not completed
+        csv_storage_manager.close_message_log()
+        os.replace(csv_path, csv_storage_manager.segment_filepath(csv_storage_manager.snapshot_segment + 1))
+        admit('300')
+        csv_storage_manager.close_message_log()
+
+        binary_path = os.path.join(self.directory, 'message_log.bin')
+        self.write(binary_path + '.converting', b'')
+        self.write(binary_path, b'partial')
+        self.assertEqual(convert_message_log_to_binary(csv_path, binary_path), 2)
+        self.assertIsNone(convert_message_log_to_binary(csv_path, binary_path))
+        binary_storage_manager = StorageManager(message_log_filepath=binary_path)
+        binary_storage_manager.initialise_database('history.csv')
+
+        self.assertEqual(sorted(binary_storage_manager.current_patients), ['100', '200', '300'])
+        self.assertFalse(os.path.exists(binary_path + '.converting'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import csv
+import random
+import unittest
+
+import joblib
+import numpy as np
+
+from compiled_forest import CompiledForest
+from config import MODEL_PATH, SKLEARN_MODEL_PATH
+from model_compiler import compile_forest
+
+def history_features(history_csv_path: str = 'history.csv', seed: int = 0) -> np.ndarray:
+    """
+    Builds model inputs from every window of five consecutive results in history.csv,
+    padded as in StorageManager.build_features, with random ages and sexes.
+    """
+    rng = random.Random(seed)
+    features = []
+    with open(history_csv_path, 'r') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        for row in reader:
+            results = [float(row[col]) for col in range(2, len(row), 2) if row[col] != ""]
+            for end in range(1, len(results) + 1):
+                recent = results[max(end - 5, 0):end]
+                recent += [recent[-1]] * (5 - len(recent))
+                features.append([rng.randint(18, 100), rng.randint(0, 1)] + recent)
+    return np.array(features, dtype=np.float64)
+
+class CompiledForestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = joblib.load(SKLEARN_MODEL_PATH)
+        cls.features = history_features()
+
+    def test_predictions_match_sklearn(self):
+        """
+        Tests that the compiled forest predicts the same class as sklearn for every
+        feature vector derived from history.csv.
+        """
+        compiled = compile_forest(self.model)
+        
+        np.testing.assert_array_equal(compiled.predict(self.features), self.model.predict(self.features))
+        np.testing.assert_allclose(compiled.predict_proba(self.features), self.model.predict_proba(self.features))
+
+    def test_single_row_predictions_match_sklearn(self):
+        """
+        Tests the plain Python path used for very small batches.
+        """
+        compiled = compile_forest(self.model)
+        rows = self.features[::20]
+        
+        single = np.concatenate([compiled.predict(row.reshape(1, -1)) for row in rows])
+        np.testing.assert_array_equal(single, self.model.predict(rows))
+
+    def test_shipped_model_is_up_to_date(self):
+        """
+        Tests that the compiled model at MODEL_PATH matches the sklearn model it was compiled from.
+        Rerun `python model_compiler.py` after changing the sklearn model if this fails.
+        """
+        compiled = CompiledForest.load(MODEL_PATH)
+
+        np.testing.assert_array_equal(compiled.predict(self.features), self.model.predict(self.features))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
+import copy
 import unittest
+from unittest import mock
 from storage_manager import StorageManager
 from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
 
@@ -31,6 +33,9 @@ class TestRecoveryProcess(unittest.TestCase):
             self.storage_manager.add_test_result_to_current_patients(test_result_message)
             self.storage_manager.add_message_to_log_csv(test_result_message)
         
+        # A positive prediction is logged when it is made
+        self.storage_manager.record_positive_aki_prediction('172293')
+        
         discharge_messages = [PatientDischargeMessage('123')]
         
         for discharge_message in discharge_messages:
@@ -60,9 +65,22 @@ class TestRecoveryProcess(unittest.TestCase):
         self.assertIn('822825', self.storage_manager.current_patients)
         self.assertIn('172293', self.storage_manager.current_patients)
 
-        self.assertEqual(self.storage_manager.current_patients['124']['creatinine_results'], [1.2])
-        self.assertEqual(self.storage_manager.current_patients['172293']['creatinine_results'], [111.98,91.21,105.09,93.44,110.52,56.4,74.2])
-        self.assertEqual(self.storage_manager.current_patients['822825']['creatinine_results'], [68.58,70.58,64.15,48.39,58.01,85.93,101.2])
+        self.assertEqual(self.storage_manager.current_patients['124'].creatinine_results.tolist(), [1.2])
+        self.assertEqual(self.storage_manager.current_patients['172293'].creatinine_results.tolist(), [111.98,91.21,105.09,93.44,110.52,56.4,74.2])
+        self.assertEqual(self.storage_manager.current_patients['822825'].creatinine_results.tolist(), [68.58,70.58,64.15,48.39,58.01,85.93,101.2])
+
+    def test_recovery_restores_identical_state_without_the_model(self):
+        """Test that replay restores the same patients, including logged positive predictions, without predicting again."""
+        state_before_crash = copy.deepcopy(self.storage_manager.current_patients)
+        self.simulate_crash()
+
+        with mock.patch.object(self.storage_manager, 'predict_aki_batch', side_effect=AssertionError("model called")), \
+             mock.patch.object(self.storage_manager, 'predict_features_batch', side_effect=AssertionError("model called")):
+            self.storage_manager.initialise_database('history.csv')
+
+        self.assertEqual(self.storage_manager.current_patients, state_before_crash)
+        self.assertTrue(self.storage_manager.current_patients['172293'].previous_positive_aki_prediction)
+        self.assertFalse(self.storage_manager.current_patients['822825'].previous_positive_aki_prediction)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,110 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from history_store import HistoryStore, cache_is_valid
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_matches_row_by_row_loader(self):
+        """
+        Tests that the columnar store holds the same results as reading history.csv row by row.
+        """
+        expected = dict()
+        with open('history.csv', 'r') as file:
+            reader = csv.reader(file)
+            next(reader, None)
+            for row in reader:
+                expected[row[0]] = [float(row[col]) for col in range(2, len(row), 2) if row[col] != ""]
+
+        store = HistoryStore.from_csv('history.csv')
+
+        self.assertEqual(len(store), len(expected))
+        self.assertEqual(dict(store.items()), expected)
+        self.assertEqual(store['822825'], [68.58, 70.58, 64.15, 48.39, 58.01, 85.93])
+        self.assertEqual(store.result_dates('822825')[0], np.datetime64('2024-01-01T06:12:00'))
+
+    def test_mrns_keep_leading_zeros(self):
+        """
+        Tests that MRNs are read as strings and that patients without results are kept.
+        """
+        path = os.path.join(self.directory, 'history.csv')
+        with open(path, 'w') as file:
+            file.write("mrn,creatinine_date_0,creatinine_result_0,creatinine_date_1,creatinine_result_1\n"
+                       "007,2024-01-01 06:12:00,68.5,,\n"
+                       "8,,,,\n")
+
+        store = HistoryStore.from_csv(path)
+
+        self.assertEqual(store['007'], [68.5])
+        self.assertEqual(store['8'], [])
+        self.assertNotIn('7', store)
+
+    def test_updates_take_precedence(self):
+        """
+        Tests that results written after loading replace the loaded ones, and that
+        deleted patients disappear.
+        """
+        store = HistoryStore.from_csv('history.csv')
+        size = len(store)
+
+        store['822825'] = [1.0]
+        store['new'] = [2.0]
+        del store['16318']
+
+        self.assertEqual(store['822825'], [1.0])
+        self.assertEqual(store['new'], [2.0])
+        self.assertNotIn('16318', store)
+        self.assertEqual(len(store), size)
+        self.assertEqual(len(list(store)), size)
+
+    def test_cache_is_built_and_memory_mapped(self):
+        """
+        Tests that opening history.csv builds the cache, and that the next open maps
+        the cache lazily and reads the same results.
+        """
+        path = os.path.join(self.directory, 'history.csv')
+        shutil.copy('history.csv', path)
+        cache_path = os.path.join(self.directory, 'history.cache')
+
+        built = HistoryStore.open(path, cache_path)
+        self.assertFalse(built.loaded)
+        self.assertEqual(built['822825'], [68.58, 70.58, 64.15, 48.39, 58.01, 85.93])
+        self.assertTrue(cache_is_valid(path, cache_path))
+
+        mapped = HistoryStore.open(path, cache_path)
+        self.assertEqual(dict(mapped.items()), dict(built.items()))
+        self.assertIsNotNone(mapped._buffer)
+        self.assertEqual(mapped.result_dates('822825')[0], np.datetime64('2024-01-01T06:12:00'))
+
+    def test_cache_is_rebuilt_when_history_changes(self):
+        """
+        Tests that a cache is only used while history.csv has the contents it was built
+        from: a new mtime alone is accepted once the contents are checked.
+        """
+        path = os.path.join(self.directory, 'history.csv')
+        cache_path = os.path.join(self.directory, 'history.cache')
+        with open(path, 'w') as file:
+            file.write("mrn,creatinine_date_0,creatinine_result_0\n1,2024-01-01 06:12:00,68.5\n")
+        HistoryStore.open(path, cache_path)['1']
+
+        os.utime(path, ns=(0, 0))
+        self.assertTrue(cache_is_valid(path, cache_path))
+
+        with open(path, 'w') as file:
+            file.write("mrn,creatinine_date_0,creatinine_result_0\n1,2024-01-01 06:12:00,70.5\n")
+        self.assertFalse(cache_is_valid(path, cache_path))
+        self.assertEqual(HistoryStore.open(path, cache_path)['1'], [70.5])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from mllp import MLLPFramer, MLLPEncodingError, OVERSIZED_FRAME, parse_mllp_messages
+
+def to_mllp(payload: bytes) -> bytes:
+    return b"\x0b" + payload + b"\x1c\x0d"
+
+class MLLPFramerTest(unittest.TestCase):
+
+    def test_multiple_frames_in_one_read(self):
+        """
+        Tests that every complete frame in a single read is returned, in order.
+        """
+        framer = MLLPFramer("test")
+        frames = framer.feed(to_mllp(b"first\r") + to_mllp(b"second\r") + to_mllp(b"third\r"))
+        
+        self.assertEqual([bytes(f) for f in frames], [b"first\r", b"second\r", b"third\r"])
+        self.assertEqual(framer.buffered_bytes, 0)
+        
+    def test_partial_frame_is_kept_across_reads(self):
+        """
+        Tests that a frame split across reads, including between the end of block
+        and the carriage return, is returned once it is complete.
+        """
+        data = to_mllp(b"first\r") + to_mllp(b"second\r")
+        framer = MLLPFramer("test")
+        
+        self.assertEqual([bytes(f) for f in framer.feed(data[:5])], [])
+        self.assertEqual([bytes(f) for f in framer.feed(data[5:8])], [])
+        self.assertEqual([bytes(f) for f in framer.feed(data[8:-1])], [b"first\r"])
+        self.assertEqual(framer.buffered_bytes, len(to_mllp(b"second\r")) - 1)
+        self.assertEqual([bytes(f) for f in framer.feed(data[-1:])], [b"second\r"])
+        self.assertEqual(framer.buffered_bytes, 0)
+        
+    def test_byte_by_byte_feed(self):
+        """
+        Tests that feeding one byte at a time yields the same frames as a single read.
+        """
+        data = to_mllp(b"MSH|a\rPID|1\r") + to_mllp(b"MSH|b\r")
+        framer = MLLPFramer("test")
+        frames = []
+        for i in range(len(data)):
+            frames += [bytes(f) for f in framer.feed(data[i:i + 1])]
+        
+        self.assertEqual(frames, [b"MSH|a\rPID|1\r", b"MSH|b\r"])
+        
+    def test_frames_are_memoryviews(self):
+        """
+        Tests that frames are returned as views over the received data.
+        """
+        frames = MLLPFramer("test").feed(to_mllp(b"payload\r"))
+        
+        self.assertIsInstance(frames[0], memoryview)
+        self.assertEqual(str(frames[0][:-1], "ascii"), "payload")
+        
+    def test_missing_start_of_block(self):
+        """
+        Tests that data outside a frame is rejected with the source in the message.
+        """
+        with self.assertRaisesRegex(MLLPEncodingError, "feed: bad MLLP encoding: want 0xb, found 0x41"):
+            MLLPFramer("feed").feed(b"A" + to_mllp(b"payload\r"))
+            
+    def test_end_of_block_without_carriage_return(self):
+        """
+        Tests that an end of block byte must be followed by a carriage return.
+        """
+        framer = MLLPFramer("feed")
+        framer.feed(b"\x0bpayload\x1c")
+        with self.assertRaisesRegex(MLLPEncodingError, "want 0xd, found 0x41"):
+            framer.feed(b"A")
+        
+    def test_oversized_frame_is_rejected(self):
+        """
+        Tests that a complete frame over the maximum size is returned as
+        OVERSIZED_FRAME, in its place among the other frames.
+        """
+        framer = MLLPFramer("test", max_frame_size=8)
+        frames = framer.feed(to_mllp(b"first\r") + to_mllp(b"much too long\r") + to_mllp(b"third\r"))
+
+        self.assertEqual(frames[0], b"first\r")
+        self.assertIs(frames[1], OVERSIZED_FRAME)
+        self.assertEqual(frames[2], b"third\r")
+
+    def test_oversized_partial_frame_is_not_buffered(self):
+        """
+        Tests that the bytes of a frame over the maximum size are dropped as they
+        arrive, including an end of block split from its carriage return, and
+        that the frames after it are returned.
+        """
+        framer = MLLPFramer("test", max_frame_size=16)
+        frames = framer.feed(b"\x0b" + b"x" * 20)
+        self.assertEqual(framer.buffered_bytes, 0)
+        for _ in range(100):
+            frames += framer.feed(b"x" * 1000)
+            self.assertEqual(framer.buffered_bytes, 0)
+        frames += framer.feed(b"x\x1c")
+        frames += framer.feed(b"\x0d" + to_mllp(b"next\r"))
+
+        self.assertEqual(len(frames), 2)
+        self.assertIs(frames[0], OVERSIZED_FRAME)
+        self.assertEqual(frames[1], b"next\r")
+        self.assertEqual(framer.buffered_bytes, 0)
+
+    def test_parse_mllp_messages(self):
+        """
+        Tests the one-shot helper returns complete frames and the remainder.
+        """
+        messages, remaining = parse_mllp_messages(to_mllp(b"first\r") + b"\x0bsec", "test")
+        
+        self.assertEqual(messages, [b"first\r"])
+        self.assertEqual(remaining, b"\x0bsec")
+
+if __name__ == '__main__':
+    unittest.main()
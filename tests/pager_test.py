@@ -0,0 +1,98 @@
+import http.server
+import shutil
+import tempfile
+import threading
+import unittest
+
+from pager import PagerOutbox, PagerPool
+
+class RecordingPagerHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Pager which fails the first `failures` requests and records the pages it accepts.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            if self.server.failures > 0:
+                self.server.failures -= 1
+                status = 500
+            else:
+                self.server.pages.append(body)
+                status = 200
+            self.server.connections.add(self.client_address)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(*args):
+        pass
+
+class PagerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = http.server.ThreadingHTTPServer(("localhost", 0), RecordingPagerHandler)
+        self.server.lock = threading.Lock()
+        self.server.failures = 0
+        self.server.pages = []
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+    def new_pool(self, num_workers=1):
+        return PagerPool(PagerOutbox(self.directory), num_workers=num_workers,
+                         port=self.server.server_address[1], base_delay=0.01, max_delay=0.05)
+        
+    def test_pages_are_delivered_over_one_connection(self):
+        """
+        Tests that a worker reuses its connection for consecutive pages.
+        """
+        pool = self.new_pool()
+        pool.start()
+        for mrn in ('1', '2', '3'):
+            pool.submit(mrn, '20240101120000')
+        pool.join()
+        pool.stop()
+        
+        self.assertEqual(self.server.pages, [b'1,20240101120000', b'2,20240101120000', b'3,20240101120000'])
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(PagerOutbox(self.directory).pending(), [])
+        
+    def test_failed_requests_are_retried(self):
+        """
+        Tests that a page is retried with backoff until the pager accepts it.
+        """
+        self.server.failures = 3
+        results = []
+        pool = self.new_pool()
+        pool.start()
+        pool.submit('1', '20240101120000', results.append)
+        pool.join()
+        pool.stop()
+        
+        self.assertEqual(self.server.pages, [b'1,20240101120000'])
+        self.assertEqual(results, [True])
+        
+    def test_pending_pages_survive_a_restart(self):
+        """
+        Tests that pages recorded in the outbox before a crash are delivered on the next start.
+        """
+        PagerOutbox(self.directory).add('1', '20240101120000')
+        PagerOutbox(self.directory).add('2', '20240101120000')
+        
+        pool = self.new_pool()
+        pool.start()
+        pool.join()
+        pool.stop()
+        
+        self.assertEqual(self.server.pages, [b'1,20240101120000', b'2,20240101120000'])
+        self.assertEqual(PagerOutbox(self.directory).pending(), [])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+if __name__ == '__main__':
+    unittest.main()
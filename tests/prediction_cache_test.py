@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from prediction_cache import PredictionCache
+from storage_manager import StorageManager
+
+class PredictionCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PredictionCache(2)
+        cache.put(cache.key([1.0]), 0)
+        cache.put(cache.key([2.0]), 1)
+        cache.get(cache.key([1.0]))
+        cache.put(cache.key([3.0]), 1)
+
+        self.assertEqual(cache.get(cache.key([1.0])), 0)
+        self.assertIsNone(cache.get(cache.key([2.0])))
+        self.assertEqual(cache.get(cache.key([3.0])), 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_features_are_quantized(self):
+        cache = PredictionCache(10)
+        cache.put(cache.key([35, 1, 60.7, 62.3000000001]), 1)
+
+        self.assertEqual(cache.get(cache.key([35.0, 1.0, 60.7, 62.3])), 1)
+
+    def test_cached_predictions_match_the_model(self):
+        storage_manager = StorageManager()
+        # The second patient is stable enough to be predicted by rule, without the cache
+        storage_manager.rule_classifier.enabled = False
+        features = [[34, 1, 60.7, 62.3, 53, 80, 165], [74, 0, 60.7, 60.7, 61.7, 61.7, 61.7],
+                    [34, 1, 60.7, 62.3, 53, 80, 165]]
+        expected = list(storage_manager.model.predict(features))
+
+        self.assertEqual(list(storage_manager.predict_features_batch(features)), expected)
+        self.assertEqual(len(storage_manager.prediction_cache), 2)
+        self.assertEqual([storage_manager.predict_features(f) for f in features], expected)
+
+    def test_cache_is_cleared_when_the_model_file_changes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        model_path = os.path.join(directory, 'model.npz')
+        shutil.copy('model/model.npz', model_path)
+        storage_manager = StorageManager(model_path=model_path)
+        storage_manager.rule_classifier.enabled = False
+        storage_manager.predict_features([34, 1, 60.7, 62.3, 53, 80, 165])
+        self.assertEqual(len(storage_manager.prediction_cache), 1)
+
+        # Unchanged model file
+        storage_manager.model_checked_at = float("-inf")
+        storage_manager.check_model()
+        self.assertEqual(len(storage_manager.prediction_cache), 1)
+
+        os.utime(model_path, ns=(0, 0))
+        storage_manager.model_checked_at = float("-inf")
+        storage_manager.check_model()
+        self.assertEqual(len(storage_manager.prediction_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import asyncio
+import http.server
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import message_listener
+from alert_manager import AlertManager
+from hospital_message import PatientAdmissionMessage, TestResultMessage
+from storage_manager import StorageManager
+from tests.pager_test import RecordingPagerHandler
+
+def killed_after(function):
+    """
+    Wraps function so that the process is killed as soon as it has returned.
+    """
+    def wrapper(*args, **kwargs):
+        function(*args, **kwargs)
+        os.kill(os.getpid(), signal.SIGKILL)
+    return wrapper
+
+def predict_positive_and_crash(directory, pager_port):
+    """
+    Runs the asyncio prediction task on a positive test result, and kills the
+    process once either the page or the prediction has been made durable.
+    """
+    storage_manager = StorageManager(message_log_filepath=os.path.join(directory, 'message_log.csv'))
+    admission = PatientAdmissionMessage('100', 'JANE DOE', '1990-01-01', 'F')
+    storage_manager.add_admitted_patient_to_current_patients(admission)
+    storage_manager.commit_message_log(storage_manager.add_message_to_log_csv(admission))
+    alert_manager = AlertManager(outbox_path=os.path.join(directory, 'outbox'), address=('localhost', pager_port))
+
+    async def run():
+        prediction_queue = asyncio.Queue()
+        await prediction_queue.put((TestResultMessage('100', '2024-08-04', '08:26:00', 80.3), None, time.time()))
+        await message_listener._predict_aki(storage_manager, alert_manager, prediction_queue)
+
+    with mock.patch.object(storage_manager, 'predict_features_batch', return_value=[1]), \
+         mock.patch.object(storage_manager, 'commit_message_log', killed_after(storage_manager.commit_message_log)), \
+         mock.patch('message_listener.page_positive_prediction', killed_after(message_listener.page_positive_prediction)):
+        asyncio.run(run())
+
+class PredictionPageTest(unittest.TestCase):
+
+    def test_page_survives_a_crash_after_the_prediction(self):
+        """
+        Tests that a process killed between paging for a positive prediction and
+        committing it has the page in its outbox, and delivers it after a restart.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # The pager is unreachable until the restart, so the page stays in the outbox
+        with socket.create_server(("localhost", 0)) as unreachable:
+            unreachable_port = unreachable.getsockname()[1]
+        process = multiprocessing.get_context('spawn').Process(target=predict_positive_and_crash,
+                                                               args=(directory, unreachable_port))
+        process.start()
+        process.join(60)
+        if process.is_alive():
+            process.kill()
+        self.assertEqual(process.exitcode, -signal.SIGKILL)
+
+        server = http.server.ThreadingHTTPServer(("localhost", 0), RecordingPagerHandler)
+        server.lock = threading.Lock()
+        server.failures = 0
+        server.pages = []
+        server.connections = set()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        alert_manager = AlertManager(outbox_path=os.path.join(directory, 'outbox'), address=server.server_address)
+        alert_manager.start()
+        alert_manager.pool.join()
+        alert_manager.pool.stop()
+
+        self.assertEqual(server.pages, [b'100,20240804082600'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import threading
+import unittest
+import wsgiref.util
+
+from profiler import SamplingProfiler, collapsed, profile_app, profiler, top
+
+def busy_loop(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=busy_loop, args=(self.stop,), name="busy")
+        self.thread.start()
+        self.addCleanup(self.thread.join)
+        self.addCleanup(self.stop.set)
+
+    def test_samples_show_the_running_functions(self):
+        stacks = SamplingProfiler(interval=0.001).run(0.2)
+
+        busy = [line for line in collapsed(stacks).splitlines() if line.startswith("busy;")]
+        self.assertTrue(busy)
+        self.assertTrue(all("busy_loop (profiler_test.py:" in line for line in busy))
+        self.assertIn("busy_loop (profiler_test.py:", top(stacks))
+
+    def test_only_one_session_runs_at_a_time(self):
+        def request(query):
+            environ = {"PATH_INFO": "/profile", "QUERY_STRING": query}
+            wsgiref.util.setup_testing_defaults(environ)
+            status = []
+            body = b"".join(profile_app(None)(environ, lambda s, headers: status.append(s)))
+            return status[0], body
+
+        session = threading.Thread(target=request, args=("seconds=0.5",))
+        session.start()
+        # Wait until the first session holds the profiler
+        while not profiler._lock.locked():
+            pass
+        status, _ = request("seconds=0.1")
+        session.join()
+
+        self.assertEqual(status, "409 Conflict")
+        self.assertEqual(request("seconds=0.1&format=top")[0], "200 OK")
+        self.assertEqual(request("seconds=-1")[0], "400 Bad Request")
+        self.assertEqual(request("format=svg")[0], "400 Bad Request")
+
+    def test_other_paths_are_served_by_the_metrics_app(self):
+        environ = {"PATH_INFO": "/metrics"}
+        wsgiref.util.setup_testing_defaults(environ)
+        metrics_app = lambda environ, start_response: [b"metrics"]
+
+        self.assertEqual(profile_app(metrics_app)(environ, None), [b"metrics"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from prometheus_client import REGISTRY
+
+from benchmarks.rule_fast_path import disagreements, generated_features
+from rule_classifier import RuleClassifier
+from storage_manager import StorageManager
+
+class RuleClassifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rule_classifier = RuleClassifier(negative_max_ratio=1.3, negative_max_value=130)
+
+    def test_clear_cut_results_are_decided(self):
+        # Stable results, all of them low
+        self.assertEqual(self.rule_classifier.decide([74, 0, 60.7, 62.3, 58.0, 61.7, 61.7]), 0)
+
+    def test_ambiguous_results_are_left_to_the_model(self):
+        # Rising results
+        self.assertIsNone(self.rule_classifier.decide([34, 1, 60.7, 62.3, 53.0, 80.0, 110.0]))
+        # A latest result three times the baseline, which the model does not always predict positive
+        self.assertIsNone(self.rule_classifier.decide([71, 0, 44.87, 22.43, 17.95, 24.68, 89.73]))
+        # Stable but high results
+        self.assertIsNone(self.rule_classifier.decide([34, 1, 180.0, 182.0, 181.0, 180.0, 180.0]))
+        self.assertIsNone(RuleClassifier(1.3, 130, enabled=False).decide([74, 0, 60.7, 60.7, 60.7, 60.7, 60.7]))
+
+    def test_predictions_count_their_path(self):
+        storage_manager = StorageManager()
+        def count(path):
+            return REGISTRY.get_sample_value("prediction_path_total", {"path": path}) or 0
+        before = {path: count(path) for path in ("rule_negative", "model")}
+
+        features = [[74, 0, 60.7, 62.3, 58.0, 61.7, 61.7], [34, 1, 60.7, 62.3, 53.0, 80.0, 110.0]]
+        self.assertEqual(list(storage_manager.predict_features_batch(features)),
+                         [0, storage_manager.predict_features(features[1])])
+
+        self.assertEqual(count("rule_negative") - before["rule_negative"], 1)
+        self.assertEqual(count("model") - before["model"], 2)
+
+    def test_rule_agrees_with_the_model_on_generated_features(self):
+        """
+        Tests that the rule agrees with the model on random features, and not only
+        on the patients of history.csv.
+        """
+        storage_manager = StorageManager()
+        paths, disagreeing = disagreements(storage_manager, generated_features(20000, seed=1))
+
+        self.assertGreater(paths["rule_negative"], 5000)
+        self.assertEqual(disagreeing, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from prometheus_client import REGISTRY, CollectorRegistry
+
+import message_listener
+from message_listener import to_mllp
+from sharded_listener import ShardMetricsCollector, ShardPool, listen_for_messages_sharded, shard_message_log_path, shard_of
+from storage_manager import StorageManager
+
+def admission(mrn):
+    return to_mllp(['MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102135300||ADT^A01|||2.5',
+                    f'PID|1||{mrn}||ROSCOE DOHERTY||19870515|M'])
+
+def read_ack(connection):
+    received = b""
+    while not received.endswith(b"\x1c\x0d"):
+        data = connection.recv(1024)
+        if not data:
+            raise ConnectionError("closed before the ACK")
+        received += data
+    return received
+
+class ShardedListenerTest(unittest.TestCase):
+
+    def test_stopped_worker_is_restarted(self):
+        """
+        Tests that a worker which stops is restarted from its log, that the
+        connection is dropped so that the peer sends its messages again, and
+        that the messages sent on the next connection are handled.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'message_log.csv')
+        server = socket.create_server(("localhost", 0))
+        server.settimeout(60)
+        self.addCleanup(server.close)
+        shards = ShardPool(1, path, history_csv_path='history.csv', history_cache_path=None,
+                           outbox_path=os.path.join(directory, 'outbox'))
+        restarts_before = REGISTRY.get_sample_value("shard_restarts_total")
+        message_listener.stopping_condition = False
+        self.addCleanup(setattr, message_listener, 'stopping_condition', False)
+        front_end = threading.Thread(target=listen_for_messages_sharded, args=(shards, server.getsockname()),
+                                     kwargs={'retries': 3, 'start_delay': 0.01})
+        front_end.start()
+        try:
+            connection, _ = server.accept()
+            with connection:
+                connection.settimeout(60)
+                connection.sendall(admission('100'))
+                self.assertIn(b"MSA|AA", read_ack(connection))
+                shards.processes[0].kill()
+                self.assertEqual(connection.recv(1024), b"")
+
+            connection, _ = server.accept()
+            with connection:
+                connection.settimeout(60)
+                connection.sendall(admission('200'))
+                self.assertIn(b"MSA|AA", read_ack(connection))
+                message_listener.stopping_condition = True
+        finally:
+            message_listener.stopping_condition = True
+            front_end.join(60)
+            shards.stop()
+
+        self.assertEqual(REGISTRY.get_sample_value("shard_restarts_total") - restarts_before, 1)
+        recovered = StorageManager(message_log_filepath=shard_message_log_path(path, 0))
+        recovered.initialise_database('history.csv')
+        self.assertEqual(sorted(recovered.current_patients), ['100', '200'])
+
+    def test_metrics_of_the_workers_are_collected(self):
+        """
+        Tests that the metrics updated by a worker process are served by the
+        front-end, labelled with the shard of the worker.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'message_log.csv')
+        server = socket.create_server(("localhost", 0))
+        server.settimeout(60)
+        self.addCleanup(server.close)
+        shards = ShardPool(2, path, history_csv_path='history.csv', history_cache_path=None,
+                           outbox_path=os.path.join(directory, 'outbox'))
+        self.addCleanup(shards.stop)
+        registry = CollectorRegistry()
+        registry.register(ShardMetricsCollector(shards))
+        def logged(shard):
+            return registry.get_sample_value("messages_added_to_log_total", {"shard": str(shard)})
+        before = [logged(shard) for shard in range(2)]
+        message_listener.stopping_condition = False
+        self.addCleanup(setattr, message_listener, 'stopping_condition', False)
+        front_end = threading.Thread(target=listen_for_messages_sharded, args=(shards, server.getsockname()),
+                                     kwargs={'retries': 1, 'start_delay': 0.01})
+        front_end.start()
+        try:
+            connection, _ = server.accept()
+            with connection:
+                connection.settimeout(60)
+                connection.sendall(admission('100'))
+                self.assertIn(b"MSA|AA", read_ack(connection))
+                message_listener.stopping_condition = True
+        finally:
+            message_listener.stopping_condition = True
+            front_end.join(60)
+
+        shard = shard_of('100', 2)
+        self.assertEqual(logged(shard) - before[shard], 1)
+        self.assertEqual(logged(1 - shard), before[1 - shard])
+        self.assertIsNotNone(registry.get_sample_value("shard_restarts_total"))
+
+
+if __name__ == '__main__':
+    unittest.main()
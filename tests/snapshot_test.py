@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from hospital_message import PatientAdmissionMessage, TestResultMessage, PatientDischargeMessage
+from storage_manager import StorageManager
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'message_log.csv')
+        self.storage_manager = self.start()
+        self.storage_manager.initialise_database('history.csv', wipe_past_message_log=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def start(self):
+        storage_manager = StorageManager(message_log_filepath=self.path)
+        storage_manager.snapshot_interval = 0
+        return storage_manager
+
+    def log(self, *messages):
+        for message in messages:
+            if isinstance(message, PatientAdmissionMessage):
+                self.storage_manager.add_admitted_patient_to_current_patients(message)
+            elif isinstance(message, TestResultMessage):
+                self.storage_manager.add_test_result_to_current_patients(message)
+            else:
+                self.storage_manager.remove_patient_from_current_patients(message)
+            self.storage_manager.add_message_to_log_csv(message)
+        self.storage_manager.commit_message_log()
+
+    def recover(self):
+        self.storage_manager.close_message_log()
+        recovered = self.start()
+        recovered.initialise_database('history.csv')
+        return recovered
+
+    def test_recovery_replays_only_the_log_after_the_snapshot(self):
+        """
+        Tests that the state recovered from a snapshot and the log tail matches the
+        state before the restart, and that the log covered by the snapshot is removed.
+        """
+        self.log(PatientAdmissionMessage('822825', 'John Smith', '1992-01-01', 'M'),
+                 TestResultMessage('822825', '2021-01-01', '08:00', 101.2),
+                 PatientAdmissionMessage('124', 'Jane Doe', '1991-01-01', 'F'))
+        self.storage_manager.snapshot()
+        self.log(TestResultMessage('124', '2021-01-01', '09:00', 1.2),
+                 PatientDischargeMessage('822825'))
+
+        recovered = self.recover()
+
+        self.assertEqual(recovered.current_patients, self.storage_manager.current_patients)
+        self.assertEqual(recovered.creatinine_results_history, self.storage_manager.creatinine_results_history)
+        self.assertEqual(recovered.messages_since_snapshot, 2)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['message_log.csv', 'message_log.csv.snapshot'])
+
+    def test_snapshot_is_taken_every_interval(self):
+        """
+        Tests that committing the log takes a snapshot once enough messages were logged.
+        """
+        self.storage_manager.snapshot_interval = 2
+        self.log(PatientAdmissionMessage('124', 'Jane Doe', '1991-01-01', 'F'))
+        self.assertFalse(os.path.exists(self.storage_manager.snapshot_filepath))
+
+        self.log(TestResultMessage('124', '2021-01-01', '09:00', 1.2))
+
+        self.assertTrue(os.path.exists(self.storage_manager.snapshot_filepath))
+        self.assertEqual(self.storage_manager.messages_since_snapshot, 0)
+        self.assertEqual(self.recover().current_patients['124'].creatinine_results.tolist(), [1.2])
+
+    def test_commit_without_snapshot(self):
+        """
+        Tests that a commit made with snapshot=False, as from a thread other than the
+        one applying the messages, never takes a snapshot, which is left to
+        snapshot_if_due.
+        """
+        self.storage_manager.snapshot_interval = 2
+        self.log(PatientAdmissionMessage('822825', 'John Smith', '1992-01-01', 'M'))
+        self.storage_manager.add_message_to_log_csv(TestResultMessage('822825', '2021-01-01', '08:00', 101.2))
+        self.storage_manager.commit_message_log(snapshot=False)
+        self.assertFalse(os.path.exists(self.storage_manager.snapshot_filepath))
+
+        self.storage_manager.snapshot_if_due()
+
+        self.assertTrue(os.path.exists(self.storage_manager.snapshot_filepath))
+        self.assertEqual(self.storage_manager.messages_since_snapshot, 0)
+
+    @mock.patch("storage_manager.MESSAGE_LOG_SYNC_POLICY", "interval")
+    def test_commit_after_a_snapshot_rotated_the_log(self):
+        """
+        Tests that the LSN of a row logged before a snapshot is committed in the log
+        opened after it, so that committing it does not wait for new rows.
+        """
+        self.storage_manager.close_message_log()
+        self.log(PatientAdmissionMessage('822825', 'John Smith', '1992-01-01', 'M'))
+        lsn = self.storage_manager.record_positive_aki_prediction('822825')
+        self.storage_manager.snapshot()
+        self.storage_manager.open_message_log()
+
+        commit = threading.Thread(target=self.storage_manager.commit_message_log, args=(lsn,), daemon=True)
+        commit.start()
+        commit.join(5)
+        self.assertFalse(commit.is_alive())
+        self.storage_manager.close_message_log()
+
+    def test_crash_before_snapshot_is_written(self):
+        """
+        Tests that a log segment sealed by a snapshot which never completed is replayed.
+        """
+        self.log(PatientAdmissionMessage('124', 'Jane Doe', '1991-01-01', 'F'))
+        self.storage_manager.snapshot()
+        self.log(TestResultMessage('124', '2021-01-01', '09:00', 1.2))
+        # The log is sealed but the process stops before the new snapshot is written
+        self.storage_manager.close_message_log()
+        os.replace(self.path, self.storage_manager.segment_filepath(2))
+
+        recovered = self.recover()
+
+        self.assertEqual(recovered.current_patients['124'].creatinine_results.tolist(), [1.2])
+        recovered.snapshot()
+        self.assertEqual(recovered.list_segments(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import contextlib
+import io
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from prometheus_client import REGISTRY
+
+from alert_manager import AlertManager
+from hospital_message import PatientAdmissionMessage
+from message_listener import dispatch_frames, to_mllp
+from stage_timing import MessageTiming, SlowMessageLog
+from storage_manager import StorageManager
+
+def stage_count(stage, message_type):
+    return REGISTRY.get_sample_value("message_stage_duration_seconds_count",
+                                     {"stage": stage, "message_type": message_type}) or 0
+
+class StageTimingTest(unittest.TestCase):
+
+    def test_every_stage_of_a_test_result_is_timed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        storage_manager = StorageManager(message_log_filepath=os.path.join(directory, 'message_log.csv'))
+        storage_manager.add_admitted_patient_to_current_patients(PatientAdmissionMessage('853291', 'JANE DOE', '1990-01-01', 'F'))
+        alert_manager = AlertManager(outbox_path=os.path.join(directory, 'outbox'))
+        frame = to_mllp(['MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240804082600||ORU^R01|||2.5',
+                         'PID|1||853291', 'OBR|1||||||20240804082600', 'OBX|1|SN|CREATININE||80.3'])[1:-2]
+        stages = ("framing", "parse", "apply", "log", "predict", "page", "commit", "ack")
+        before = {stage: stage_count(stage, "ORU^R01") for stage in stages}
+
+        listener, peer = socket.socketpair()
+        with listener, peer:
+            dispatch_frames(listener, [frame], storage_manager, alert_manager, 0.0)
+            storage_manager.close_message_log()
+
+        for stage in stages:
+            self.assertEqual(stage_count(stage, "ORU^R01") - before[stage], 1, stage)
+
+    def test_slow_messages_are_logged_at_most_once_per_interval(self):
+        slow_message_log = SlowMessageLog(budget_ms=1, interval=60)
+        timing = MessageTiming(0)
+        timing.identify(PatientAdmissionMessage('497030', 'ROSCOE DOHERTY', '1987-05-15', 'M'))
+        timing.add("parse", 200_000)
+        slow_before = REGISTRY.get_sample_value("slow_messages_total")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            slow_message_log.record(timing, 500_000)
+            slow_message_log.record(timing, 5_000_000)
+            slow_message_log.record(timing, 6_000_000)
+
+        self.assertEqual(REGISTRY.get_sample_value("slow_messages_total") - slow_before, 2)
+        self.assertEqual(output.getvalue(), "Slow message: ADT^A01 acknowledged after 5.000 ms: "
+                                            "parse 0.200 ms, waiting 4.800 ms\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
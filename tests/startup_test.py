@@ -0,0 +1,40 @@
+import unittest
+
+from benchmarks.startup import first_ack_time, import_time, imported_side_effects
+from storage_manager import StorageManager
+
+# Startup budgets of the listener, well above the times measured so that only
+# regressions such as a heavy import or a blocking model load fail them
+IMPORT_BUDGET_SECONDS = 1.0
+FIRST_ACK_BUDGET_SECONDS = 5.0
+
+class StartupTest(unittest.TestCase):
+
+    def test_import_has_no_side_effects(self):
+        side_effects = imported_side_effects()
+
+        self.assertEqual(side_effects["heavy_modules"], [])
+        # No Prometheus HTTP server thread
+        self.assertEqual(side_effects["threads"], 1)
+
+    def test_import_time_is_within_budget(self):
+        total, _ = import_time()
+
+        self.assertLess(total, IMPORT_BUDGET_SECONDS)
+
+    def test_first_ack_is_within_budget(self):
+        first_ack, first_prediction = first_ack_time()
+
+        self.assertLess(first_ack, FIRST_ACK_BUDGET_SECONDS)
+        self.assertLess(first_prediction, FIRST_ACK_BUDGET_SECONDS)
+
+    def test_model_loaded_in_background_predicts_like_the_model(self):
+        storage_manager = StorageManager(load_model_in_background=True)
+        storage_manager.rule_classifier.enabled = False
+        features = [34, 1, 60.7, 62.3, 53, 80, 165]
+
+        self.assertEqual(storage_manager.predict_features(features), int(StorageManager().model.predict([features])[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
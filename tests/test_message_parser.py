@@ -1,5 +1,5 @@
 import unittest
-from message_parser import parse_message
+from message_parser import parse_frame, parse_message
 from hospital_message import PatientAdmissionMessage, PatientDischargeMessage, TestResultMessage
 
 class MessageParserTest(unittest.TestCase):
@@ -104,6 +104,49 @@ class MessageParserTest(unittest.TestCase):
         self.assertEqual(parsed_object.test_time, expected_object.test_time)
         self.assertEqual(parsed_object.creatinine_value, expected_object.creatinine_value)
 
+    def test_parsing_frame_with_extra_segments(self):
+        """
+        Test parsing of a test result frame, as bytes, with extra segments and
+        several observations, only one of which is a creatinine result.
+        """
+
+        frame = (b'MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240804082600||ORU^R01|||2.5\r'
+                 b'PID|1||853291^^^MRN||DOE^JANE\r'
+                 b'PV1|1|I|WARD 4\r'
+                 b'OBR|1||||||20240804082600\r'
+                 b'OBX|1|SN|POTASSIUM||4.1\r'
+                 b'NTE|1|L|Sample slightly haemolysed\r'
+                 b'OBX|2|SN|CREATININE^Creatinine||80.3\r')
+
+        parsed_object = parse_frame(memoryview(frame))
+
+        self.assertEqual(parsed_object.__class__.__name__, "TestResultMessage")
+        self.assertEqual(parsed_object.mrn, '853291')
+        self.assertEqual(parsed_object.test_date, '2024-08-04')
+        self.assertEqual(parsed_object.test_time, '08:26:00')
+        self.assertEqual(parsed_object.creatinine_value, 80.3)
+
+    def test_parsing_malformed_frames(self):
+        """
+        Test that malformed messages are rejected with a ValueError.
+        """
+
+        frames = [
+            # No PID segment
+            b'MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240804082900||ADT^A03|||2.5\r',
+            # No creatinine observation
+            b'MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240804082600||ORU^R01|||2.5\r'
+            b'PID|1||853291\rOBR|1||||||20240804082600\rOBX|1|SN|POTASSIUM||4.1\r',
+            # Truncated PID segment
+            b'MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102135300||ADT^A01|||2.5\rPID|1||497030\r',
+            # Unknown message type
+            b'MSH|^~\\&|SIMULATION|SOUTH RIVERSIDE|||20240102135300||ADT^A08|||2.5\rPID|1||497030\r',
+        ]
+
+        for frame in frames:
+            with self.assertRaises(ValueError):
+                parse_frame(frame)
+
 
 if __name__ == '__main__':
     unittest.main()
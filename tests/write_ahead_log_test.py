@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from write_ahead_log import WriteAheadLog
+
+class WriteAheadLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'message_log.csv')
+
+    def read(self):
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def test_header_is_written_once(self):
+        """
+        Tests that reopening an existing log appends to it without a second header.
+        """
+        log = WriteAheadLog(self.path, header=b'header\n')
+        log.append(b'first\n')
+        log.close()
+        log = WriteAheadLog(self.path, header=b'header\n')
+        log.append(b'second\n')
+        log.close()
+        
+        self.assertEqual(self.read(), b'header\nfirst\nsecond\n')
+
+    def test_always_policy_commits_every_append(self):
+        log = WriteAheadLog(self.path, sync_policy='always')
+        lsn = log.append(b'first\n')
+        
+        self.assertEqual(log.committed_lsn, lsn)
+        self.assertEqual(self.read(), b'first\n')
+        log.close()
+
+    def test_records_policy_groups_appends_until_commit(self):
+        """
+        Tests that with the 'records' policy appends wait for a commit, or for
+        sync_records records, before reaching the disk.
+        """
+        log = WriteAheadLog(self.path, sync_policy='records', sync_records=3)
+        log.append(b'1\n')
+        lsn = log.append(b'2\n')
+        
+        self.assertEqual(log.committed_lsn, 0)
+        log.commit(lsn)
+        self.assertEqual(log.committed_lsn, 2)
+        self.assertEqual(self.read(), b'1\n2\n')
+        
+        for record in (b'3\n', b'4\n', b'5\n'):
+            log.append(record)
+        self.assertEqual(log.committed_lsn, 5)
+        log.close()
+
+    def test_interval_policy_commits_concurrent_appends(self):
+        """
+        Tests that commits from several threads are all released by the background fsync.
+        """
+        log = WriteAheadLog(self.path, sync_policy='interval', sync_interval_ms=1)
+        
+        def append_and_commit(i):
+            log.commit(log.append(b'%d\n' % i))
+        threads = [threading.Thread(target=append_and_commit, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(log.committed_lsn, 8)
+        self.assertEqual(sorted(self.read().split()), [b'%d' % i for i in range(8)])
+        log.close()
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            WriteAheadLog(self.path, sync_policy='never')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+if __name__ == '__main__':
+    unittest.main()
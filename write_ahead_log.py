@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+
+p_wal_append_latency = Histogram("wal_append_latency", "Time to append a record to the write-ahead log",
+                                 buckets=[0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05])
+p_wal_fsync_latency = Histogram("wal_fsync_latency", "Time to flush and fsync the write-ahead log",
+                                buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1])
+p_wal_records_per_fsync = Histogram("wal_records_per_fsync", "Number of records made durable by a single fsync",
+                                    buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+p_wal_fsyncs = Counter("wal_fsyncs", "Number of fsyncs of the write-ahead log")
+
+SYNC_ALWAYS = 'always'
+SYNC_RECORDS = 'records'
+SYNC_INTERVAL = 'interval'
+
+class WriteAheadLog:
+    """
+    Append-only log file which stays open and commits records in groups.
+
+    Every appended record gets a log sequence number (LSN). A record is committed
+    once it has been fsynced; commit(lsn) returns only when that is the case, so
+    callers acknowledge a message only after its commit point. The sync policy
+    decides when fsyncs happen:
+
+    - 'always': every append is fsynced before it returns;
+    - 'records': an fsync happens whenever sync_records records are waiting, and
+      commit() fsyncs whatever is left, so all the records appended before a
+      commit share one fsync;
+    - 'interval': a background thread fsyncs every sync_interval_ms milliseconds
+      and commit() waits for the next one, so concurrent committers share it.
+    """
+    def __init__(self,
+                 path: str,
+                 header: bytes = b"",
+                 sync_policy: str = SYNC_RECORDS,
+                 sync_records: int = 100,
+                 sync_interval_ms: float = 5,
+                 start_lsn: int = 0) -> None:
+        """
+        Opens the log, creating it with the given header if it does not exist.
+
+        Args:
+            path (str): Path of the log file.
+            header (bytes): Written at the start of a new log file.
+            sync_policy (str): 'always', 'records' or 'interval'.
+            sync_records (int): Records waiting before an fsync, for the 'records' policy.
+            sync_interval_ms (float): Time between fsyncs, for the 'interval' policy.
+            start_lsn (int): LSN after which the records of this log are numbered. A
+                             log reopened after another one starts from its last LSN,
+                             so that the LSNs of the closed log count as committed.
+        """
+        if sync_policy not in (SYNC_ALWAYS, SYNC_RECORDS, SYNC_INTERVAL):
+            raise ValueError(f"Unknown sync policy: {sync_policy}")
+        self.path = path
+        self.sync_policy = sync_policy
+        self.sync_records = sync_records
+        self.sync_interval = sync_interval_ms / 1000
+
+        created = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab', buffering=1 << 16)
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._appended_lsn = start_lsn
+        self._committed_lsn = start_lsn
+        self._closed = False
+        if created:
+            with self._lock:
+                self._file.write(header)
+                self._sync_locked()
+            directory = os.path.dirname(os.path.abspath(path))
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        self._syncer = None
+        if sync_policy == SYNC_INTERVAL:
+            self._syncer = threading.Thread(target=self._sync_periodically, name="wal-sync", daemon=True)
+            self._syncer.start()
+
+    @property
+    def appended_lsn(self) -> int:
+        """
+        LSN of the last appended record.
+        """
+        return self._appended_lsn
+
+    @property
+    def committed_lsn(self) -> int:
+        """
+        LSN of the last record known to be on disk.
+        """
+        return self._committed_lsn
+
+    def append(self, record: bytes) -> int:
+        """
+        Appends a record to the log.
+
+        Args:
+            record (bytes): The encoded record.
+
+        Returns:
+            int: The LSN of the record, to be passed to commit.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._file.write(record)
+            self._appended_lsn += 1
+            lsn = self._appended_lsn
+            if self.sync_policy == SYNC_ALWAYS or (
+                    self.sync_policy == SYNC_RECORDS and lsn - self._committed_lsn >= self.sync_records):
+                self._sync_locked()
+        p_wal_append_latency.observe(time.perf_counter() - start)
+        return lsn
+
+    def commit(self, lsn: int = None) -> None:
+        """
+        Blocks until the record with the given LSN, and every record before it, is on disk.
+
+        Args:
+            lsn (int): The LSN returned by append. Defaults to the last appended record.
+        """
+        with self._lock:
+            if lsn is None:
+                lsn = self._appended_lsn
+            if self.sync_policy == SYNC_INTERVAL:
+                while self._committed_lsn < lsn and not self._closed:
+                    self._committed.wait()
+            elif self._committed_lsn < lsn:
+                self._sync_locked()
+
+    def flush(self) -> None:
+        """
+        Makes appended records visible to readers of the file, without waiting for the disk.
+        """
+        with self._lock:
+            self._file.flush()
+
+    def close(self) -> None:
+        """
+        Commits every appended record and closes the file.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._sync_locked()
+            self._closed = True
+            self._file.close()
+            self._committed.notify_all()
+        if self._syncer is not None:
+            self._syncer.join()
+
+    def _sync_locked(self) -> None:
+        start = time.perf_counter()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        p_wal_fsyncs.inc()
+        p_wal_fsync_latency.observe(time.perf_counter() - start)
+        if self._appended_lsn > self._committed_lsn:
+            p_wal_records_per_fsync.observe(self._appended_lsn - self._committed_lsn)
+        self._committed_lsn = self._appended_lsn
+        self._committed.notify_all()
+
+    def _sync_periodically(self) -> None:
+        while True:
+            time.sleep(self.sync_interval)
+            with self._lock:
+                if self._closed:
+                    return
+                if self._committed_lsn < self._appended_lsn:
+                    self._sync_locked()